@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+JavaScript rendering of html pages with a long-lived headless browser
+
+Primary vars::
+* class Renderer - scheduling of renders: tab limit, per-render deadline, browser recycling
+* class ChromiumRenderer - Renderer over a pyppeteer Chromium, one incognito context per page
+* class FakeRenderer - Renderer without a browser, for tests of the scheduling
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+import asyncio
+import threading
+import time
+
+
+
+class _Browser:
+    """A launched browser, with the pages started on it and those still open."""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.pages = 0
+        self.active = 0
+
+
+
+class Renderer:
+    """Render html pages, running their scripts, and return the resulting html.
+
+    One browser is launched on first use and shared by all renders, in an
+    event loop on a thread of its own, so it can be called from any thread.
+    At most `BROWSER_MAX_TABS` pages are open at once; further renders wait
+    for a tab.  A page that takes longer than `BROWSER_RENDER_TIMEOUT_SEC`
+    is closed and raises TimeoutError.  After `BROWSER_RECYCLE_PAGES` pages,
+    or a failure, new renders go to a new browser and the old one is closed
+    once its open pages finish, which bounds the memory a browser leaks.
+
+    Subclasses provide the browser, with the coroutines `_launch()`,
+    `_render_page(handle, url, html)` and `_close_browser(handle)`.
+
+    Usage::
+        >>> Browser = ChromiumRenderer(config)
+        >>> html = Browser.render('https://www.jpmorgan.com', html=resp.text)
+        >>> Browser.dump()
+        {'rendered': 1, 'failed': 0, 'timed_out': 0, 'launches': 1, 'recycled': 0, 'max_tabs': 1, 'mean_secs': 1.2}
+        >>> Browser.close()
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._loop = None
+        self._thread = None
+        self._tabs = None
+        self._launching = None
+        self._current = None
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def reset(self):
+        with self._lock:
+            self.rendered = 0
+            self.failed = 0
+            self.timed_out = 0
+            self.launches = 0
+            self.recycled = 0
+            self.active_tabs = 0
+            self.max_tabs = 0
+            self.render_secs = 0.0
+
+    def dump(self):
+        with self._lock:
+            return {'rendered': self.rendered,
+                    'failed': self.failed,
+                    'timed_out': self.timed_out,
+                    'launches': self.launches,
+                    'recycled': self.recycled,
+                    'max_tabs': self.max_tabs,
+                    'mean_secs': round(self.render_secs / self.rendered, 6) if self.rendered else 0.0
+                    }
+
+    def _start(self):
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name='entero-browser', daemon=True)
+                self._thread.start()
+                self._loop = loop
+                self._tabs = asyncio.run_coroutine_threadsafe(self._make_tabs(), loop).result()
+            return self._loop
+
+    async def _make_tabs(self):
+        self._launching = asyncio.Lock()
+        return asyncio.Semaphore(self.config.BROWSER_MAX_TABS)
+
+    def render(self, url, html=None):
+        """Render `url`, or the `html` already downloaded from it, and return
+        the html once its scripts have run."""
+        loop = self._start()
+        return asyncio.run_coroutine_threadsafe(self._render(url, html), loop).result()
+
+    async def _render(self, url, html):
+        async with self._tabs:
+            try:
+                browser = await self._acquire_browser()
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                raise
+            with self._lock:
+                self.active_tabs += 1
+                self.max_tabs = max(self.max_tabs, self.active_tabs)
+            time0 = time.perf_counter()
+            healthy = True
+            try:
+                result = await asyncio.wait_for(self._render_page(browser.handle, url, html),
+                                                timeout=self.config.BROWSER_RENDER_TIMEOUT_SEC
+                                                )
+            except asyncio.TimeoutError:
+                with self._lock:
+                    self.timed_out += 1
+                raise TimeoutError(f'rendering {url} took more than {self.config.BROWSER_RENDER_TIMEOUT_SEC}sec')
+            except Exception:
+                healthy = False
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.active_tabs -= 1
+                await self._release_browser(browser, healthy)
+            with self._lock:
+                self.rendered += 1
+                self.render_secs += time.perf_counter() - time0
+            return result
+
+    async def _acquire_browser(self):
+        async with self._launching:
+            current = self._current
+            if current is None or current.pages >= self.config.BROWSER_RECYCLE_PAGES:
+                self._current = _Browser(await self._launch())
+                with self._lock:
+                    self.launches += 1
+                if current is not None and current.active == 0:
+                    await self._retire(current)
+            self._current.pages += 1
+            self._current.active += 1
+            return self._current
+
+    async def _release_browser(self, browser, healthy):
+        browser.active -= 1
+        if not healthy and browser is self._current:
+            browser.pages = self.config.BROWSER_RECYCLE_PAGES        #the next render relaunches
+        if browser is not self._current and browser.active == 0:
+            await self._retire(browser)
+
+    async def _retire(self, browser):
+        with self._lock:
+            self.recycled += 1
+        try:
+            await self._close_browser(browser.handle)
+        except Exception:
+            pass
+
+    def close(self):
+        """Close the browser and stop its event loop."""
+        with self._start_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        current, self._current = self._current, None
+        if current is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self._close_browser(current.handle), loop).result()
+            except Exception:
+                pass
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
+
+    async def _launch(self):
+        raise NotImplementedError
+
+    async def _render_page(self, handle, url, html):
+        raise NotImplementedError
+
+    async def _close_browser(self, handle):
+        raise NotImplementedError
+
+
+
+class ChromiumRenderer(Renderer):
+    """Renderer over a headless Chromium driven by pyppeteer, as used by
+    requests-html, but launched once rather than per page.
+
+    Each page gets its own incognito context, so pages share no cookies or
+    storage.  When the html was already downloaded, it is served to the
+    page's navigation instead of requesting the url again; the scripts,
+    styles and images it links to are loaded by the browser.
+    """
+
+    _launch_args = ['--no-sandbox', '--disable-gpu', '--disable-dev-shm-usage']
+
+    async def _launch(self):
+        import pyppeteer
+        #signal handlers can only be installed from the main thread
+        return await pyppeteer.launch(headless=True,
+                                      args=self._launch_args,
+                                      handleSIGINT=False,
+                                      handleSIGTERM=False,
+                                      handleSIGHUP=False
+                                      )
+
+    async def _render_page(self, handle, url, html):
+        context = await handle.createIncognitoBrowserContext()
+        try:
+            page = await context.newPage()
+            if html is not None:
+                served = []
+                async def intercept(request):
+                    if not served and request.isNavigationRequest():
+                        served.append(request.url)
+                        await request.respond({'status': 200, 'contentType': 'text/html; charset=utf-8', 'body': html})
+                    else:
+                        await request.continue_()
+                await page.setRequestInterception(True)
+                page.on('request', lambda request: asyncio.ensure_future(intercept(request)))
+            timeout_ms = int(self.config.BROWSER_RENDER_TIMEOUT_SEC * 1000)
+            await page.goto(url, waitUntil='load', timeout=timeout_ms)
+            return await page.content()
+        finally:
+            await context.close()
+
+    async def _close_browser(self, handle):
+        await handle.close()
+
+
+
+class FakeRenderer(Renderer):
+    """Renderer without a browser: each page takes `delay` secs (or its own
+    in `delays`) and returns its `html`, or the page in `pages`.  Launching
+    takes `launch_secs`.  Used to test the scheduling of renders.
+
+    Usage::
+        >>> Browser = FakeRenderer(config, delay=0.1, pages={'https://a.com': '<html>...</html>'})
+        >>> Browser.render('https://a.com')
+        '<html>...</html>'
+    """
+
+    def __init__(self, config, delay=0.0, delays=None, pages=None, launch_secs=0.0):
+        self.delay = delay
+        self.delays = delays if delays else {}
+        self.pages = pages if pages else {}
+        self.launch_secs = launch_secs
+        self.closed = []
+        super().__init__(config)
+
+    async def _launch(self):
+        await asyncio.sleep(self.launch_secs)
+        return {'id': self.launches, 'pages': []}
+
+    async def _render_page(self, handle, url, html):
+        handle['pages'].append(url)
+        await asyncio.sleep(self.delays.get(url, self.delay))
+        content = html if html is not None else self.pages.get(url)
+        if content is None:
+            raise ConnectionError(f'no page for {url}')
+        return content
+
+    async def _close_browser(self, handle):
+        self.closed.append(handle['id'])
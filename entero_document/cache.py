@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Persistent, content-addressed caches
+
+Primary vars::
+* dumps_value / loads_value - json serialization of cached values, which cannot run code when loaded
+* class DiskCache - size-bounded LRU store of bytes on disk, safe to share between processes
+* class ExtractionCache - extractor record output keyed by content hash, extractor version and config
+* class ResponseCache - http responses keyed by url, revalidated with their ETag / Last-Modified
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from .record import DocumentTemplate
+from .utils import get_html_parser
+
+import requests
+
+try:
+    import fcntl
+except ImportError:                                                             #not available on windows
+    fcntl = None
+
+from pathlib import Path
+import base64
+import datetime
+import email.utils
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+
+EXTRACTOR_VERSION = '7'          #increment when extraction output changes, to invalidate old entries
+
+
+
+def _tag(value):
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, list):
+        return [_tag(item) for item in value]
+    if isinstance(value, tuple):
+        return {'__tuple__': [_tag(item) for item in value]}
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            raise TypeError('only str keys can be cached')
+        return {key: _tag(item) for key, item in value.items()}
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f'values of type {type(value).__name__} cannot be cached')
+
+_untaggers = {'__tuple__': tuple,
+              '__datetime__': datetime.datetime.fromisoformat,
+              '__date__': datetime.date.fromisoformat,
+              '__bytes__': base64.b64decode
+              }
+
+def _untag(obj):
+    if len(obj) == 1:
+        key = next(iter(obj))
+        if key in _untaggers:
+            return _untaggers[key](obj[key])
+    return obj
+
+
+def dumps_value(value):
+    """Serialize plain data (None, str, numbers, lists, tuples, dicts with 
+    str keys, dates and bytes) to json bytes; other types raise TypeError.
+
+    The caches under `cache_dir` use this rather than pickle, so that 
+    whoever can write to the directory cannot run code in the process that
+    reads it.
+    """
+    return json.dumps(_tag(value), separators=(',', ':')).encode('utf-8')
+
+
+def loads_value(value):
+    """Inverse of `dumps_value()`; raises ValueError for invalid data."""
+    return json.loads(value, object_hook=_untag)
+
+
+
+class DiskCache:
+    """Size-bounded store of bytes in a directory, evicting least-recently-used.
+
+    Entries are written to a temp file and renamed into place, so readers in
+    other processes never see partial values.  Hits touch the entry's mtime,
+    which eviction uses as recency.  Eviction runs under an exclusive lock
+    file, after every `max_size_bytes / 10` bytes written by this process.
+
+    Usage::
+        >>> cache = DiskCache(Path('.cache/entero'), max_size_bytes=1e+9)
+        >>> cache.set('key', b'value')
+        >>> cache.get('key')
+        b'value'
+    """
+
+    _suffix = '.bin'
+
+    def __init__(self, directory, max_size_bytes):
+        self.directory = Path(directory)
+        self.max_size_bytes = int(max_size_bytes)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lockfile = self.directory / '.lock'
+        self._written_since_evict = 0
+        self._evict_interval = max(self.max_size_bytes // 10, 1)
+
+    def _path(self, key):
+        return self.directory / key[:2] / (key + self._suffix)
+
+    def get(self, key):
+        """Return the stored bytes, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+        except (FileNotFoundError, PermissionError):
+            #missing, or evicted by another process
+            return None
+        return value
+
+    def set(self, key, value):
+        """Store bytes under key, replacing any previous value."""
+        if len(value) > self.max_size_bytes:
+            return False
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._written_since_evict += len(value)
+        if self._written_since_evict >= self._evict_interval:
+            self.evict()
+        return True
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def size(self):
+        """Total bytes of stored entries."""
+        return sum(size for path, size, mtime in self._entries())
+
+    def _entries(self):
+        entries = []
+        for path in self.directory.glob(f'*/*{self._suffix}'):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def evict(self):
+        """Delete least-recently-used entries until under `max_size_bytes`."""
+        self._written_since_evict = 0
+        with open(self._lockfile, 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entries = sorted(self._entries(), key=lambda entry: entry[2])
+                total = sum(entry[1] for entry in entries)
+                removed = 0
+                for path, size, mtime in entries:
+                    if total <= self.max_size_bytes:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    removed += 1
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        return removed
+
+
+
+class ExtractionCache:
+    """Record output of `PdfExtracts` / `HtmlExtracts` keyed by content.
+
+    The key is the sha256 of the file's bytes together with the extractor
+    version and the config attributes that change extraction output, so
+    renamed copies and re-crawls of a document share one entry.  Records are
+    serialized with `dumps_value()` and zlib-compressed; file-level 
+    attributes (path, name, size) are left to the Document.
+
+    Usage::
+        >>> config.cache_dir = Path('.cache/entero')
+        >>> cache = ExtractionCache(config)
+        >>> key = cache.make_key(pdf_stream, '.pdf')
+        >>> record = cache.get(key)
+    """
+
+    _config_keys = ['MAX_PAGE_EXTRACT', 'MAX_CONTENT_SIZE', 'MAX_CONTENT_CHARS', 'applyPyMuPDF', 'applyOCRmyPDF', 'applyHtmlToPdf',
+                    'HTML_PARSER'
+                    ]
+    _file_attrs = ['id', 'reference_number', 'filepath', 'filename_original', 'filename_modified',
+                   'file_extension', 'filetype', 'file_str', 'file_document', 'file_size_mb'
+                   ]
+
+    def __init__(self, config):
+        self.config = config
+        self.store = DiskCache(directory=config.cache_dir,
+                               max_size_bytes=config.MAX_CACHE_SIZE
+                               )
+
+    def make_key(self, content, filetype):
+        """Key for a bytes-like `content` (bytes, mmap), hashed without copying."""
+        digest = hashlib.sha256(content).hexdigest()
+        settings = [EXTRACTOR_VERSION, filetype]
+        settings.extend([f'{key}={getattr(self.config, key, None)}' for key in self._config_keys if key != 'HTML_PARSER'])
+        settings.append(f'HTML_PARSER={get_html_parser(getattr(self.config, "HTML_PARSER", None))}')     #the parser actually used
+        settings_digest = hashlib.sha256('|'.join(settings).encode()).hexdigest()[:16]
+        return f'{digest}-{settings_digest}'
+
+    def make_key_from_filepath(self, filepath, filetype):
+        """Key for a local file, hashed through a memory map."""
+        with open(filepath, 'rb') as f:
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                    return self.make_key(content, filetype)
+            except ValueError:
+                #empty files cannot be mapped
+                return self.make_key(b'', filetype)
+
+    def get(self, key):
+        """Return the cached record, or None."""
+        value = self.store.get(key)
+        if value is None:
+            return None
+        try:
+            cached = loads_value(zlib.decompress(value))
+        except Exception:
+            self.store.delete(key)
+            return None
+        record = DocumentTemplate()
+        record.update(cached)
+        return record
+
+    def set(self, key, record):
+        cached = {k: v for k, v in record.items() if k not in self._file_attrs}
+        try:
+            value = zlib.compress(dumps_value(cached))
+        except TypeError:
+            return False
+        return self.store.set(key, value)
+
+
+
+class ResponseCache:
+    """Http responses keyed by url, for `UniformResourceLocator.request_artifact_()`.
+
+    Bodies are stored with their headers in a DiskCache under `cache_dir` / 
+    'responses'.  While a response is fresh, by its Cache-Control max-age 
+    or Expires header, it is served without a request.  After that it is 
+    revalidated with If-None-Match / If-Modified-Since, and a 304 serves the
+    stored body.  Responses marked no-store, or with neither freshness nor a
+    validator, are not kept.  Vary is not considered.
+
+    Usage::
+        >>> config.cache_dir = Path('.cache/entero')
+        >>> cache = ResponseCache(config)
+        >>> resp = cache.request(session, url, timeout=30)
+        >>> cache.add(url, resp)
+        >>> cache.dump()
+        {'hits': 0, 'revalidated': 0, 'misses': 1, 'bytes_saved': 0}
+    """
+
+    _revalidated_headers = ['etag', 'last-modified', 'cache-control', 'expires', 'date', 'age']
+
+    def __init__(self, config):
+        self.config = config
+        self.store = DiskCache(directory=Path(config.cache_dir) / 'responses',
+                               max_size_bytes=config.MAX_RESPONSE_CACHE_SIZE
+                               )
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def dump(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'revalidated': self.revalidated,
+                    'misses': self.misses,
+                    'bytes_saved': self.bytes_saved
+                    }
+
+    def _count(self, name, bytes_saved=0):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+            self.bytes_saved += bytes_saved
+
+    def make_key(self, url):
+        return hashlib.sha256(f'GET {url}'.encode()).hexdigest()
+
+    def get(self, key):
+        """Return the stored entry, or None."""
+        value = self.store.get(key)
+        if value is None:
+            return None
+        try:
+            header, _, content = value.partition(b'\n')
+            entry = loads_value(header)
+            entry['content'] = content
+            return entry
+        except Exception:
+            self.store.delete(key)
+            return None
+
+    def set(self, key, entry):
+        """Keep `entry`, its body stored as is after the json of the rest."""
+        header = dumps_value({name: item for name, item in entry.items() if name != 'content'})
+        return self.store.set(key, header + b'\n' + entry['content'])
+
+    def request(self, session, url, timeout=None):
+        """GET `url` with `session`, through the cache.  Responses from the
+        network are streamed; pass them to `add()` once they are read."""
+        key = self.make_key(url)
+        entry = self.get(key)
+        if entry and time.time() < entry['expires_at']:
+            self._count('hits', len(entry['content']))
+            return self._to_response(entry, session)
+        headers = {}
+        if entry:
+            stored = requests.structures.CaseInsensitiveDict(entry['headers'])
+            if stored.get('etag'):
+                headers['If-None-Match'] = stored['etag']
+            if stored.get('last-modified'):
+                headers['If-Modified-Since'] = stored['last-modified']
+        resp = session.get(url, timeout=timeout, headers=headers, stream=True)
+        if resp.status_code == 304 and entry:
+            resp.content                #empty; releases the connection
+            stored.update({name: resp.headers[name] for name in self._revalidated_headers if name in resp.headers})
+            entry['headers'] = dict(stored)
+            entry['expires_at'] = self._get_expires_at(stored)
+            self.set(key, entry)
+            self._count('revalidated', len(entry['content']))
+            return self._to_response(entry, session)
+        self._count('misses')
+        return resp
+
+    def add(self, url, resp):
+        """Keep a response to `url` read from the network, if it may be cached."""
+        if resp.status_code != 200:
+            return False
+        expires_at = self._get_expires_at(resp.headers)
+        validated = resp.headers.get('etag') or resp.headers.get('last-modified')
+        if expires_at is None or not (validated or expires_at > time.time()):
+            return False
+        return self.set(self.make_key(url), {'url': resp.url,
+                                             'headers': dict(resp.headers),
+                                             'encoding': resp.encoding,
+                                             'content': resp.content,
+                                             'expires_at': expires_at
+                                             })
+
+    def _get_expires_at(self, headers):
+        """Time until which a response is fresh, or None if it must not be stored."""
+        now = time.time()
+        directives = {}
+        for item in headers.get('cache-control', '').split(','):
+            name, _, value = item.strip().partition('=')
+            if name:
+                directives[name.lower()] = value.strip('"')
+        if 'no-store' in directives:
+            return None
+        if 'no-cache' in directives:
+            return now
+        try:
+            if 'max-age' in directives:
+                return now + int(directives['max-age']) - int(headers.get('age', 0))
+            if headers.get('expires'):
+                expires = email.utils.parsedate_to_datetime(headers['expires']).timestamp()
+                date = email.utils.parsedate_to_datetime(headers['date']).timestamp() if headers.get('date') else now
+                return now + expires - date
+        except (ValueError, TypeError):
+            #invalid dates mean already expired
+            pass
+        return now
+
+    def _to_response(self, entry, session):
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.reason = 'OK'
+        resp.url = entry['url']
+        resp.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+        resp.encoding = entry['encoding']
+        resp._content = entry['content']
+        resp._content_consumed = True
+        resp.from_cache = True
+        #ie. HTMLSession wraps responses in its HTMLResponse
+        return requests.hooks.dispatch_hook('response', session.hooks, resp)
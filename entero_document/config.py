@@ -40,8 +40,51 @@ class EnteroConfig:
 
         #constants
         self.MAX_PAGE_EXTRACT = None
-        self.MAX_CONTENT_SIZE = 1e+8         #in bytes => 100MB
+        self.MAX_CONTENT_SIZE = 1e+8         #in bytes => 100MB, of extracted text
+        self.MAX_CONTENT_CHARS = None        #characters of extracted text, None => no limit
         self.ALLOWED_EXTENSIONS = {'.zip'}
+        self.PAGE_WORKERS = 1                #processes per pdf body extraction, 1 => serial
+        self.MIN_PAGES_PARALLEL = 200        #smaller pdfs are not worth the process overhead
+        self.MAX_TIME_SEC = 60               #deadline for extracting one document
+        self.MAX_TITLE_TIME_SEC = 5          #deadline for the `pdftitle` heuristics
+        self.HTML_STREAM_MIN_SIZE = 5e+6     #in bytes => 5MB, larger html is parsed incrementally instead of as a tree
+        self.HTML_PARSER = 'lxml'            #BeautifulSoup tree builder: 'lxml', 'html5lib' or 'html.parser' (used when others are not installed)
+        self.RENDER_WORKERS = 2              #processes rendering html to pdf, with `applyHtmlToPdf`
+        self.MAX_RENDER_TIME_SEC = 30        #deadline for rendering one html document to pdf
+        self.BROWSER_MAX_TABS = 4            #pages rendered at once by the shared headless browser, with `applyRequestsRenderJs`
+        self.BROWSER_RENDER_TIMEOUT_SEC = 30 #deadline for rendering one page in the browser
+        self.BROWSER_RECYCLE_PAGES = 100     #pages rendered before the browser is relaunched, releasing its leaked memory
+        self.URL_FETCH_WORKERS = 8           #concurrent requests of `UrlFactory.fetch_many()`
+        self.URL_HOST_WORKERS = 2            #concurrent requests to any one hostname
+        self.URL_FETCH_TIMEOUT_SEC = 30      #connect / read timeout of each request in a batch
+        self.URL_POOL_HOSTS = 10             #hosts with pooled connections in a UrlFactory session
+        self.URL_POOL_SIZE = 8               #keep-alive connections kept per host
+        self.URL_RATE_PER_SEC = 5.0          #requests per second to any one hostname
+        self.URL_RATE_BURST = 5              #requests to a hostname allowed at once, after a pause
+        self.URL_HOST_RATES = {}             #per-host (or parent domain) rates, ie. {'sec.gov': 10}
+        self.URL_RETRY_ATTEMPTS = 3          #tries of a request after connection errors, timeouts, 429 or 5xx
+        self.URL_BACKOFF_SEC = 0.5           #first retry waits up to this, doubling for each retry
+        self.URL_BACKOFF_MAX_SEC = 30        #longest wait between retries
+        self.URL_MAX_RETRY_AFTER_SEC = 120   #longest `Retry-After` honoured
+        self.URL_BREAKER_FAILURES = 5        #failed requests in a row before a host is skipped
+        self.URL_BREAKER_RESET_SEC = 60      #time a failing host is skipped before it is tried again
+        self.MAX_DOWNLOAD_SIZE = 5e+8        #in bytes => 500MB, larger downloads are abandoned
+        self.DOWNLOAD_SPOOL_SIZE = 2e+7      #in bytes => 20MB, larger binary downloads go to a temp file instead of memory
+        self.SNIFF_SIZE = 4096               #in bytes, read ahead to decide the type of a download, with `applySniffing`
+        self.WHOIS_RATE_PER_SEC = 1.0        #lookups per registry (ie. 'com'), ICANN rejects faster requests
+        self.WHOIS_ATTEMPTS = 2              #tries per domain
+        self.WHOIS_TTL_SEC = 604800          #7 days, for owners kept under `cache_dir` / 'whois'
+        self.WHOIS_FAILURE_TTL_SEC = 3600    #failed lookups are not retried within this time
+        self.WHOIS_WORKERS = 4               #concurrent lookups of `WhoisResolver.get_owners()`
+        self.CRAWL_MAX_DEPTH = 2             #links followed from a seed url by `Crawler.crawl()`
+        self.CRAWL_MAX_PAGES = 100           #urls fetched by one crawl
+        self.CRAWL_SCOPE = 'hostname'        #links kept: same 'hostname', registered 'domain', or WHOIS 'owner' as their seed
+        self.CRAWL_SEEN_CAPACITY = 1e+6      #urls in the Bloom filter of seen urls, about 1.8MB at 0.1% false positives
+
+        #cache
+        self.cache_dir = None                #directory for ExtractionCache, None => no cache
+        self.MAX_CACHE_SIZE = 1e+9           #in bytes => 1GB
+        self.MAX_RESPONSE_CACHE_SIZE = 1e+9  #in bytes => 1GB, of http responses under `cache_dir` / 'responses'
 
         #output
         self.output_mapping_template_path = None
@@ -52,6 +95,11 @@ class EnteroConfig:
         self.applySpacy = False
         self.applyPyMuPDF = True
         self.applyOCRmyPDF = False
+        self.applyHtmlToPdf = False          #render html with xhtml2pdf and extract from the pdf, instead of parsing directly
+        self.applyLazyExtraction = False     #compute body, toc, clean_body on first access
+        self.applyMetadataOnly = False       #fast indexing: only title, author, subject, keywords, date, page_nos, file_size_mb
+        self.applySniffing = True            #decide the type of downloads from their first bytes, skip unsupported ones unread
+        self.applyRobotsTxt = True           #skip urls disallowed by the host's robots.txt when crawling
 
         # logging
         if apply_logger:
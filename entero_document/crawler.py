@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Crawl sites from seed urls into Documents
+
+Primary vars::
+* class BloomFilter - fixed-memory seen-set of urls
+* class Crawler - frontier of per-host queues, scope rules, depth and page budget
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from .config import ConfigObj
+from .url import UrlFactory, canonicalize_url, parse_url
+from .document_factory import DocumentFactory
+
+from collections import deque
+import urllib.parse
+import urllib.robotparser
+import hashlib
+import math
+import weakref
+
+
+
+class BloomFilter:
+    """Set of strings in fixed memory, sized for `capacity` items at a false
+    positive rate of `error_rate`; there are no false negatives.
+
+    In a crawl, a false positive skips a url that was not seen, which is
+    the price of not keeping every url of a large site in memory.
+
+    Usage::
+        >>> seen = BloomFilter(capacity=1e+6)           #about 1.8MB
+        >>> seen.add('https://www.jpmorgan.com')
+        True
+        >>> 'https://www.jpmorgan.com' in seen
+        True
+    """
+
+    def __init__(self, capacity, error_rate=1e-3):
+        capacity = max(int(capacity), 1)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + idx * h2) % self.size for idx in range(self.hashes)]
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def add(self, item):
+        """Add `item`; return False if it was (probably) already present."""
+        added = False
+        for pos in self._positions(item):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                self.bits[pos >> 3] |= 1 << (pos & 7)
+                added = True
+        self.count += added
+        return added
+
+
+
+class Crawler:
+    """Breadth-first crawl from seed urls, yielding a Document for each
+    fetched artifact.
+
+    Links are canonicalized and kept if they are within the scope of their
+    seed (`CRAWL_SCOPE`: the same 'hostname', registered 'domain', or WHOIS
+    'owner'), new to the seen-set and, with `applyRobotsTxt`, allowed by the
+    host's robots.txt.  Pages deeper than `CRAWL_MAX_DEPTH` links from a seed
+    are not followed and at most `CRAWL_MAX_PAGES` are fetched.
+
+    The frontier has a queue per host.  Each round takes up to
+    `URL_HOST_WORKERS` urls from each host in turn, up to
+    `URL_FETCH_WORKERS`, and fetches them together with
+    `UrlFactory.fetch_many()`, so no host gets more than its share.
+
+    Usage::
+        >>> Crawl = Crawler(config)
+        >>> docs = list(Crawl.crawl(['https://www.jpmorgan.com']))
+        >>> Crawl.dump()
+        {'fetched': 100, 'documents': 97, 'frontier': 1311, 'seen': 1532, 'out_of_scope': 221, 'disallowed': 0}
+    """
+
+    _scopes = ['hostname', 'domain', 'owner']
+
+    def __init__(self, config=None, url_factory=None, document_factory=None):
+        if config:
+            self.config = config
+        else:
+            self.config = ConfigObj
+        if self.config.CRAWL_SCOPE not in self._scopes:
+            raise ValueError(f'`CRAWL_SCOPE` must be one of {self._scopes}')
+        self._owns_url_factory = url_factory is None
+        self.URL = url_factory if url_factory else UrlFactory(self.config)
+        self.Doc = document_factory if document_factory else DocumentFactory(self.config)
+        self.reset()
+
+    def reset(self):
+        self.seen = BloomFilter(self.config.CRAWL_SEEN_CAPACITY)
+        self._frontier = {}
+        self._hosts = deque()
+        self._robots = {}
+        self.fetched = 0
+        self.documents = 0
+        self.out_of_scope = 0
+        self.disallowed = 0
+
+    def dump(self):
+        return {'fetched': self.fetched,
+                'documents': self.documents,
+                'frontier': sum([len(queue) for queue in self._frontier.values()]),
+                'seen': len(self.seen),
+                'out_of_scope': self.out_of_scope,
+                'disallowed': self.disallowed
+                }
+
+    def crawl(self, seeds):
+        """Crawl from `seeds` and yield Documents as they are built.
+
+        When the generator finishes, or is closed, the spooled downloads 
+        of the fetched urls are released, and the UrlFactory too if the 
+        Crawler made it; attributes deferred by `applyLazyExtraction` 
+        should be read before then.
+        """
+        fetched_urls = weakref.WeakSet()
+        try:
+            for seed in seeds:
+                seed = canonicalize_url(seed)
+                if seed:
+                    self.push(seed, 0, seed)
+            while self._hosts and self.fetched < self.config.CRAWL_MAX_PAGES:
+                batch = self._next_batch(self.config.CRAWL_MAX_PAGES - self.fetched)
+                urls = [self.URL.build(href) for href, depth, seed in batch]
+                fetched_urls.update(urls)
+                self.URL.fetch_many(urls)
+                self.fetched += len(urls)
+                for (href, depth, seed), url in zip(batch, urls):
+                    if not url.file_document:
+                        continue
+                    if url.file_format == 'html' and depth < self.config.CRAWL_MAX_DEPTH:
+                        for link in url.get_canonical_hrefs_():
+                            self.push(link, depth + 1, seed)
+                    doc = self.Doc.build(url)
+                    if doc:
+                        self.documents += 1
+                        yield doc
+        finally:
+            for url in list(fetched_urls):
+                url.close()
+            if self._owns_url_factory:
+                self.URL.close()
+
+    def push(self, href, depth, seed):
+        """Add a canonical url to the frontier, unless it is out of the 
+        scope of `seed`, was seen or is disallowed.
+
+        Scope is checked first, so a url out of the scope of one seed is
+        still crawled when it is reached from a seed whose scope it is in.
+        """
+        if not self.in_scope(href, seed):
+            self.out_of_scope += 1
+            return False
+        if not self.seen.add(href):
+            return False
+        if self.config.applyRobotsTxt and not self.is_allowed(href):
+            self.disallowed += 1
+            return False
+        hostname = parse_url(href).hostname
+        if hostname not in self._frontier:
+            self._frontier[hostname] = deque()
+            self._hosts.append(hostname)
+        self._frontier[hostname].append((href, depth, seed))
+        return True
+
+    def in_scope(self, href, seed):
+        components, seed_components = parse_url(href), parse_url(seed)
+        if self.config.CRAWL_SCOPE == 'hostname':
+            return components.hostname == seed_components.hostname
+        if components.registered_domain == seed_components.registered_domain:
+            return True
+        if self.config.CRAWL_SCOPE == 'owner':
+            return self.URL.has_same_owners(seed, [href])[0]
+        return False
+
+    def is_allowed(self, href):
+        """Whether the host's robots.txt, fetched once per host, allows `href`."""
+        parsed = urllib.parse.urlparse(href)
+        root = f'{parsed.scheme}://{parsed.netloc}'
+        if root not in self._robots:
+            robots = urllib.robotparser.RobotFileParser(f'{root}/robots.txt')
+            try:
+                resp = self.URL.session.get(robots.url, timeout=self.config.URL_FETCH_TIMEOUT_SEC)
+                if resp.status_code in (401, 403):
+                    robots.disallow_all = True
+                elif resp.status_code == 200:
+                    robots.parse(resp.text.splitlines())
+                else:
+                    robots.allow_all = True
+            except Exception:
+                robots.allow_all = True
+            self._robots[root] = robots
+        user_agent = self.URL.session.headers.get('User-Agent', '*')
+        return self._robots[root].can_fetch(user_agent, href)
+
+    def _next_batch(self, budget):
+        """Take urls from the host queues in turn, for one round of fetching."""
+        batch = []
+        size = min(self.config.URL_FETCH_WORKERS, budget)
+        while self._hosts and len(batch) < size:
+            hostname = self._hosts.popleft()
+            queue = self._frontier[hostname]
+            for _ in range(min(self.config.URL_HOST_WORKERS, size - len(batch))):
+                if not queue:
+                    break
+                batch.append(queue.popleft())
+            if queue:
+                self._hosts.append(hostname)
+            else:
+                del self._frontier[hostname]
+        return batch
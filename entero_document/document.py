@@ -7,8 +7,10 @@ __author__ = "Jason Beach"
 __version__ = "0.1.0"
 __license__ = "MIT"
 
-from .record import record_attrs, DocumentTemplate, DocumentRecord
+from .record import record_attrs, DocumentTemplate, DocumentRecord, LazyRecord
 from .extractor import Extractor
+from .utils import get_clean_text
+from .stats import StageStats
 
 import shutil
 import itertools
@@ -39,6 +41,17 @@ class Document:
                          '.csv': None,
                          '.xlsx': None
                         }
+    _useable_page_iterators = {'.html': Extractor.iter_html_pages,
+                               '.pdf': Extractor.iter_pdf_pages
+                              }
+    _useable_metadata_suffixes = {'.html': Extractor.extract_metadata_from_html,
+                                  '.pdf': Extractor.extract_metadata_from_pdf
+                                  }
+    #attributes computed on first access when built with `applyLazyExtraction`
+    _deferred_attrs = ['title', 'author', 'subject', 'keywords', 'date', 'page_nos',
+                       'toc', 'pp_toc', 'body', 'clean_body', 'truncated',
+                       'truncated_at_page', 'truncated_at_char'
+                       ]
     #TODO:_record_attrs = record_attrs
     _record_attrs = record_attrs
 
@@ -46,13 +59,16 @@ class Document:
     #TODO: ppt_extensions = [".ppt", ".pptx"]
     #TODO: initialize all attributes before running methods
 
-    def __init__(self, path_or_url_format, path_or_url_obj, logger, applySpacy, output_mapping):
+    def __init__(self, path_or_url_format, path_or_url_obj, logger, applySpacy, output_mapping, applyLazyExtraction=False, applyMetadataOnly=False, stats_registry=None):
         """Args:
                 path_or_url_format - 'url', 'path'
                 path_or_url_obj - <UniformResourceLocator>, <PosixPath>
                 logger - EnteroConfig.logger
                 applySpacy - EnteroConfig.applySpacy
                 output_mapping - TODO
+                applyLazyExtraction - EnteroConfig.applyLazyExtraction
+                applyMetadataOnly - EnteroConfig.applyMetadataOnly
+                stats_registry - DocumentFactory.stats, given the stages deferred past `__init__`
 
         private vars - `self._<name>`
         record vars - `self.record.<name>`
@@ -62,14 +78,18 @@ class Document:
         self._logger = logger
         self._applySpacy = applySpacy
         self._output_mapping = output_mapping
+        self._applyLazyExtraction = applyLazyExtraction
+        self._applyMetadataOnly = applyMetadataOnly
+        self._stats_registry = stats_registry
         self.record = DocumentTemplate()
+        self.stats = StageStats()
 
         # set file indexing and raw attrs
         if self._file_format=='url':
             url = self._obj
             self.record.filepath = url
             self.record.filename_original = url.get_filename()
-            self.record.file_extension = url.get_suffix()
+            self.record.file_extension = url.get_file_extension()
             self.record.filetype = '.'+url.file_format
             self.record.file_str = url.file_str
             self.record.file_document = url.file_document      #TODO:add file_document to filepath as FileImitator, [ref](https://stackoverflow.com/questions/40391487/how-to-create-a-python-object-that-be-passed-to-be-open-as-a-file)
@@ -85,20 +105,44 @@ class Document:
             self.record.filetype, self.record.file_size_mb = self.determine_file_info()
 
         self.set_filename_modified()
+        self._docs = None
 
-        # process inferred metadata
-        record_extracts = self.run_extraction_pipeline()
-        self.update_record_attrs(record_extracts, replace=False)
+        if self._applyMetadataOnly:
+            # process cheap metadata only, for indexing
+            record_extracts = self.run_metadata_pipeline()
+            self.update_record_attrs(record_extracts, replace=False)
+            logger.info(f"Document `{self.record.filename_original}` built with metadata only")
+        elif self._applyLazyExtraction:
+            # process cheap metadata, defer the rest until first accessed
+            record_extracts = self.run_metadata_pipeline()
+            self.update_record_attrs(record_extracts, replace=False)
+            lazy_keys = [attr for attr in self._deferred_attrs if self.record[attr] == None]
+            self.record = LazyRecord(self.record, lazy_keys=lazy_keys, loader=self.load_deferred_attrs)
+            logger.info(f"Document `{self.record.filename_original}` built lazily with {len(lazy_keys)} deferred attributes: {lazy_keys}")
+        else:
+            self.load_deferred_attrs()
 
-        # process searchable text
-        self._docs = None
-        if self.record.body and self._applySpacy:
-            self.run_spacy_pipeline(body=self.record.body)
+            # compare current and template attrs
+            missing_attr = self.get_missing_attributes()
+            cnt = missing_attr.__len__()
+            logger.info(f"Document `{self.record.filename_original}` populated with {cnt} missing (None) attributes: {missing_attr}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Release the downloaded artifact of a url, ie. its spooled temp file.
         
-        # compare current and template attrs
-        missing_attr = self.get_missing_attributes()
-        cnt = missing_attr.__len__()
-        logger.info(f"Document `{self.record.filename_original}` populated with {cnt} missing (None) attributes: {missing_attr}")
+        Extracted attributes are kept, but `iter_body()` and attributes 
+        deferred by `applyLazyExtraction` cannot be read afterwards.
+        """
+        if self._file_format == 'url':
+            self.record.filepath.close()
+            self.record.file_str = None
+            self.record.file_document = None
 
     def _asdict(self):
         """Return dict of recode attributes."""
@@ -166,13 +210,62 @@ class Document:
         check1 = self._useable_suffixes[self.record.filetype] if check0 else None
         if check1:
             fun_call = self._useable_suffixes[self.record.filetype]
-            result = (fun_call)(self.record)
+            result = (fun_call)(self.record, stats=self.stats)
             result['pp_toc'] = self.pretty_print_toc( result['toc'] )
         else:
             self._logger.info("filetype (extension) is not one of the supported suffixes")
             result['pp_toc'] = None
         return result
 
+    def iter_body(self):
+        """Yield `(page_number, text)` one page at a time.
+
+        The file is read again and `record.body` is never built, so peak 
+        memory stays at one page.  Unsupported filetypes yield nothing.
+
+        Usage::
+            >>> texts = (text for page_number, text in doc.iter_body())
+            >>> docs = nlp.pipe(texts)
+        """
+        fun_call = self._useable_page_iterators.get(self.record.filetype)
+        if fun_call:
+            yield from (fun_call)(self.record)
+
+    def iter_clean_body(self):
+        """Yield `(page_number, clean_text)`, the per-page form of `record.clean_body`."""
+        for page_number, text in self.iter_body():
+            yield page_number, get_clean_text(text)
+
+    def load_deferred_attrs(self):
+        """Run the extraction and text pipelines.
+
+        Called from `__init__`, or when built lazily, on first access of a 
+        deferred record attribute; the stages then run are also added to
+        `stats_registry`, which already has those of `__init__`.
+        """
+        deferred = isinstance(self.record, LazyRecord) and self._stats_registry is not None
+        earlier = self.stats.copy()
+
+        # process inferred metadata
+        record_extracts = self.run_extraction_pipeline()
+        self.update_record_attrs(record_extracts, replace=False)
+
+        # process searchable text
+        if self.record.body and self._applySpacy:
+            with self.stats.stage('spacy'):
+                self.run_spacy_pipeline(body=self.record.body)
+        if deferred:
+            self._stats_registry.add(self.stats.since(earlier), document=False)
+        return 1
+
+    def run_metadata_pipeline(self):
+        """Apply only the cheap metadata extraction for the format, if any."""
+        result = {}
+        fun_call = self._useable_metadata_suffixes.get(self.record.filetype)
+        if fun_call:
+            result = (fun_call)(self.record, stats=self.stats, use_xmp=self._applyMetadataOnly)
+        return result
+
     def run_spacy_pipeline(self, body):
         """Run nlp pipeline to apply tags.
         
@@ -10,6 +10,7 @@ __license__ = "MIT"
 from .config import ConfigObj
 from .url import UniformResourceLocator
 from .document import Document
+from .stats import StatsRegistry
 
 from pathlib import Path, PosixPath
 
@@ -28,6 +29,10 @@ class DocumentFactory:
         >>> test_file = Path('tests/examples/example.pdf')
         >>> doc = Doc.build(test_file)
         >>> assert type(doc) == Document
+
+        Per-stage timings and counters of every built Document are totalled
+        in `stats`
+        >>> Doc.stats.dump()
     """
 
     def __init__(self, config=None):
@@ -35,6 +40,7 @@ class DocumentFactory:
             self.config = config
         else:
             self.config = ConfigObj
+        self.stats = StatsRegistry()
         if self.config.applySpacy:
             import spacy
             nlp = spacy.load("en_core_web_sm")
@@ -44,12 +50,17 @@ class DocumentFactory:
         """Create Document object with path or url."""
         validation_dict = self._validate(path_or_url=path_or_url)
         if validation_dict:
-            return Document(path_or_url_format=validation_dict[0],
-                            path_or_url_obj=validation_dict[1],
-                            logger=self.config.logger,
-                            applySpacy=self.config.applySpacy,
-                            output_mapping=self.config.output_mapping
-                            )
+            doc = Document(path_or_url_format=validation_dict[0],
+                           path_or_url_obj=validation_dict[1],
+                           logger=self.config.logger,
+                           applySpacy=self.config.applySpacy,
+                           output_mapping=self.config.output_mapping,
+                           applyLazyExtraction=self.config.applyLazyExtraction,
+                           applyMetadataOnly=self.config.applyMetadataOnly,
+                           stats_registry=self.stats
+                           )
+            self.stats.add(doc.stats)
+            return doc
         else:
             return None
 
@@ -8,10 +8,22 @@ __version__ = "0.1.0"
 __license__ = "MIT"
 
 from .config import ConfigObj
-from .extracts_pdf import PdfExtracts
+from .extracts_pdf import PdfExtracts, PdfContext
 from .extracts_html import HtmlExtracts
+from .stats import StageStats
+from .cache import ExtractionCache
+from .render import PdfRenderService
 #from .office_extracts import OfficeExtracts
 
+import bs4
+import pypdf
+
+from contextlib import contextmanager
+from pathlib import Path
+import atexit
+import io
+import os
+
 
 
 class ExtractsSuite:
@@ -32,30 +44,177 @@ class ExtractsSuite:
     """
 
     def __init__(self, config):
+        self.config = config
         self.Pdf = PdfExtracts(config)
         self.Html = HtmlExtracts(config)
+        self._cache = None
+        self._renderer = None
+
+    @property
+    def cache(self):
+        """ExtractionCache for `config.cache_dir`, or None when not configured."""
+        cache_dir = self.config.cache_dir
+        if not cache_dir:
+            return None
+        if self._cache is None or self._cache.store.directory != Path(cache_dir):
+            self._cache = ExtractionCache(self.config)
+        return self._cache
+
+    @property
+    def renderer(self):
+        """PdfRenderService used with `applyHtmlToPdf`, started on first use."""
+        if self._renderer is None:
+            self._renderer = PdfRenderService(self.config)
+        return self._renderer
+
+    def close(self):
+        """Shut down the worker processes of parallel page extraction and of
+        the html to pdf renderer; they are started again when next needed."""
+        self.Pdf.close()
+        renderer, self._renderer = self._renderer, None
+        if renderer is not None:
+            renderer.close()
+
+    def _open_pdf_context(self, record, stats=None):
+        """PdfContext over the content a `UniformResourceLocator` already 
+        fetched and parsed, or else a memory map of the local file."""
+        if record.file_str:
+            reader = record.file_document if isinstance(record.file_document, pypdf.PdfReader) else None
+            #a large download is spooled to a temp file, which pymupdf opens by path
+            filepath = getattr(record.filepath, 'file_path', None)
+            return PdfContext(record.file_str, filepath=filepath, stats=stats, pypdf_reader=reader)
+        return PdfContext.from_filepath(record.filepath, stats=stats)
+
+    @contextmanager
+    def _open_html(self, record, stats=None, use_tree=True):
+        """The html a `UniformResourceLocator` already parsed (with `use_tree`)
+        or fetched, or else the open local file."""
+        if use_tree and isinstance(record.file_document, bs4.BeautifulSoup):
+            yield record.file_document
+        elif record.file_str:
+            yield record.file_str
+        else:
+            with open(record.filepath, 'r') as f:
+                if stats is not None:
+                    stats.count('bytes_read', os.fstat(f.fileno()).st_size)
+                yield f
+
+    def _count_incomplete(self, stats):
+        return stats.counters.get('timeouts', 0) + stats.counters.get('errors', 0)
+
+    def _set_cached(self, key, result_record, stats, incomplete):
+        """Cache the record, unless a stage timed out or failed since 
+        `incomplete` was counted: its output depends on this run."""
+        if self._count_incomplete(stats) > incomplete:
+            self.config.logger.info('Extraction was incomplete, its record is not cached')
+            return False
+        return self.cache.set(key, result_record)
 
-    def extract_from_pdf(self, record):
-        pdf_stream = ''
-        with open(record.filepath, 'rb') as f:
-            pdf_stream = f.read()
-        result_record = self.Pdf.extract_from_pdf_string(pdf_stream)
+    def _get_cached(self, key, stats):
+        result_record = self.cache.get(key)
+        stats.count('cache_hits' if result_record else 'cache_misses')
+        if result_record and result_record.get('truncated'):
+            stats.count('truncations')                  #the stats of the extraction are not cached, but its record is
         return result_record
 
-    def extract_from_html(self, record):
-        html_str = ''
-        with open(record.filepath, 'r') as f:
-            html_str = f.read()
-        record_from_context, pdf_bytes = self.Html.html_string_to_pdf(html_str=html_str, 
-                                                              url_path=None, 
-                                                              record=record
-                                                              )
-        result_record = self.Pdf.extract_from_pdf_string(pdf_stream=pdf_bytes, 
-                                                         record=record_from_context
-                                                         )
+    def extract_from_pdf(self, record, stats=None):
+        stats = stats if stats is not None else StageStats()
+        cache = self.cache
+        with self._open_pdf_context(record, stats=stats) as context:
+            if cache:
+                with stats.stage('cache_lookup'):
+                    key = cache.make_key(context.pdf_stream, '.pdf')
+                    result_record = self._get_cached(key, stats)
+                if result_record:
+                    return result_record
+            incomplete = self._count_incomplete(stats)
+            result_record = self.Pdf.extract_from_pdf_string(pdf_stream=context.pdf_stream,
+                                                             context=context
+                                                             )
+        if cache:
+            self._set_cached(key, result_record, stats, incomplete)
         return result_record
 
+    def extract_metadata_from_pdf(self, record, stats=None, use_xmp=False):
+        with self._open_pdf_context(record, stats=stats) as context:
+            result_record = self.Pdf.extract_metadata_from_pdf_string(pdf_stream=context.pdf_stream,
+                                                                      context=context,
+                                                                      use_xmp=use_xmp
+                                                                      )
+        return result_record
+
+    def extract_from_html(self, record, stats=None):
+        """Extract directly from the html, or with `applyHtmlToPdf` from the 
+        pdf rendered by xhtml2pdf (slower, by orders of magnitude)."""
+        stats = stats if stats is not None else StageStats()
+        cache = self.cache
+        if cache:
+            with stats.stage('cache_lookup'):
+                if record.file_str:
+                    key = cache.make_key(record.file_str.encode('utf-8'), '.html')
+                else:
+                    key = cache.make_key_from_filepath(record.filepath, '.html')
+                result_record = self._get_cached(key, stats)
+            if result_record:
+                return result_record
+        incomplete = self._count_incomplete(stats)
+        with self._open_html(record, stats=stats, use_tree=not self.config.applyHtmlToPdf) as html:
+            if self.config.applyHtmlToPdf:
+                record_from_context, pdf_bytes = self.Html.html_string_to_pdf(html_str=html, 
+                                                                      url_path=None, 
+                                                                      stats=stats,
+                                                                      renderer=self.renderer
+                                                                      )
+            elif isinstance(html, io.IOBase) and os.fstat(html.fileno()).st_size >= self.config.HTML_STREAM_MIN_SIZE:
+                result_record = self.Html.extract_from_html_stream(html_file=html,
+                                                                   stats=stats
+                                                                   )
+            else:
+                result_record = self.Html.extract_from_html_string(html_str=html,
+                                                                   stats=stats
+                                                                   )
+        if self.config.applyHtmlToPdf and not pdf_bytes:
+            result_record = record_from_context
+        elif self.config.applyHtmlToPdf:
+            with PdfContext(pdf_bytes, stats=stats) as context:
+                result_record = self.Pdf.extract_from_pdf_string(pdf_stream=pdf_bytes, 
+                                                                 record=record_from_context,
+                                                                 context=context
+                                                                 )
+        if cache:
+            self._set_cached(key, result_record, stats, incomplete)
+        return result_record
+
+    def extract_metadata_from_html(self, record, stats=None, use_xmp=False):
+        """Metadata from the html `<head>`; `use_xmp` does not apply to html."""
+        with self._open_html(record) as html:
+            result_record = self.Html.extract_metadata_from_html_string(html_str=html,
+                                                                        stats=stats
+                                                                        )
+        return result_record
+
+    def iter_pdf_pages(self, record):
+        """Yield `(page_number, text)` for each page of the pdf."""
+        with self._open_pdf_context(record) as context:
+            yield from self.Pdf.iter_pdf_pages(context)
+
+    def iter_html_pages(self, record):
+        """Yield `(page_number, text)` for each page of the html rendered to 
+        pdf with `applyHtmlToPdf`; otherwise for each chunk of text as the
+        html is read, numbered from 1."""
+        with self._open_html(record, use_tree=False) as html:
+            if not self.config.applyHtmlToPdf:
+                yield from enumerate(self.Html.iter_html_text(html), start=1)
+                return
+            record_from_context, pdf_bytes = self.Html.html_string_to_pdf(html_str=html,
+                                                                  url_path=None,
+                                                                  renderer=self.renderer
+                                                                  )
+        with PdfContext(pdf_bytes) as context:
+            yield from self.Pdf.iter_pdf_pages(context)
+
 
 # export
 #config = Config(apply_logger=False)
-Extractor = ExtractsSuite(ConfigObj)
\ No newline at end of file
+Extractor = ExtractsSuite(ConfigObj)
+atexit.register(Extractor.close)
@@ -10,17 +10,258 @@ __license__ = "MIT"
 
 
 from entero_document.record import record_attrs, DocumentTemplate
+from .stats import StageStats
+from .utils import get_clean_text, get_html_parser, iter_visible, iter_within_budget
 
 #html
 import bs4
 from xhtml2pdf import pisa 
 
+from html.parser import HTMLParser
+import datetime
 import io
-import time
+import re
+
+
+_heading_tags = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+_invisible_tags = ['head', 'script', 'style', 'noscript', 'template', 'iframe', 'svg', 'object', 'canvas']
+_block_tags = {'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'details', 'dialog', 'div', 'dl', 'dt',
+               'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+               'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'tr', 'ul'
+               }
+_void_tags = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+#`<meta>` name / property values for each record attribute, in order of preference
+_meta_names = {'title': ['dc.title', 'og:title', 'twitter:title', 'citation_title'],
+               'author': ['author', 'dc.creator', 'citation_author', 'article:author'],
+               'subject': ['subject', 'description', 'dc.description', 'og:description', 'dc.subject'],
+               'keywords': ['keywords', 'prism:keyword', 'article:tag', 'citation_keywords'],
+               'date': ['dc.date', 'article:published_time', 'citation_publication_date', 'prism:publicationdate', 'date']
+               }
+_whitespace = re.compile(r'\s+')
+
+
+def _get_html_date(date_str):
+    """Date from an iso-like string ('2014-04-15T10:32:13-05:00'), None if it cannot be parsed."""
+    try:
+        Ymd = re.sub(r'[-/]', '', date_str.strip()[:10])
+        return datetime.datetime.strptime(Ymd, "%Y%m%d").date()
+    except Exception:
+        return None
+
+
+def _select_html_metadata(metas, title=None):
+    """Title, author, subject, keywords and date from `<meta>` (name or 
+    property, content) pairs and the `<title>` text."""
+    contents = {}
+    for key, content in metas:
+        if not key or not content or not content.strip():
+            continue
+        items = contents.setdefault(key.strip().lower(), [])
+        if content.strip() not in items:
+            items.append(content.strip())
+    result = {}
+    for attr, names in _meta_names.items():
+        for name in names:
+            if name in contents:
+                result[attr] = ', '.join(contents[name])
+                break
+    if title and title.strip():
+        result['title'] = _whitespace.sub(' ', title).strip()
+    if 'date' in result:
+        result['date'] = _get_html_date(result['date'])
+    return {k: v for k, v in result.items() if v}
+
+
+def _get_html_metadata(soup):
+    """Title, author, subject, keywords and date from `<title>` and `<meta>` tags."""
+    metas = [(meta.get(attr), meta.get('content')) for meta in soup.find_all('meta') for attr in ['name', 'property']]
+    title = soup.title.string if soup.title else None
+    return _select_html_metadata(metas, title)
+
+
+class _VisibleText:
+    """Writer of visible text: whitespace is collapsed as a browser would, 
+    with block elements on their own lines.  `length` is the number of 
+    characters written, used as toc offsets; `take()` returns the text 
+    written since the last call, so it can be emitted in chunks.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.length = 0
+        self.at_line_start = True
+        self.pending_space = False
+
+    def block(self):
+        if not self.at_line_start:
+            self.parts.append('\n')
+            self.length += 1
+            self.at_line_start = True
+        self.pending_space = False
+
+    def write(self, text):
+        text = _whitespace.sub(' ', text)
+        if not text:
+            return
+        stripped = text.strip(' ')
+        if not stripped:
+            self.pending_space = True
+            return
+        if (self.pending_space or text[0] == ' ') and not self.at_line_start:
+            stripped = ' ' + stripped
+        self.parts.append(stripped)
+        self.length += len(stripped)
+        self.at_line_start = False
+        self.pending_space = text[-1] == ' '
+
+    def take(self):
+        text = ''.join(self.parts)
+        self.parts = []
+        return text
+
+
+def _get_html_text_and_toc(soup):
+    """Visible text of the document and a toc of `(level, title, dest)` from
+    its headings, where `dest` is the heading's character offset in the text.
+    """
+    root = soup.body or soup
+    writer = _VisibleText()
+    toc = []
+    for element in iter_visible(root, _invisible_tags):
+        if isinstance(element, bs4.element.Tag):
+            if element.name in _block_tags:
+                writer.block()
+            if element.name in _heading_tags:
+                texts = [item for item in iter_visible(element, _invisible_tags) if not isinstance(item, bs4.element.Tag)]
+                title = _whitespace.sub(' ', ''.join(texts)).strip()
+                if title:
+                    toc.append([_heading_tags[element.name], title, writer.length])
+        else:
+            writer.write(element)
+    return writer.take(), toc
+
+
+class _HtmlEventParser(HTMLParser):
+    """Event-driven html parser: text goes to a `_VisibleText` writer as it
+    is tokenized, and metadata / toc entries are queued in `events`.  Only 
+    the stack of open tags is kept, so no tree is built.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.writer = _VisibleText()
+        self.events = []
+        self.stack = []
+        self.invisible = 0
+        self.metas = []
+        self.title = None
+        self.metadata_sent = False
+        self.heading = None
+        self.heading_texts = []
+
+    def send_metadata(self):
+        if not self.metadata_sent:
+            self.metadata_sent = True
+            self.events.append(('metadata', _select_html_metadata(self.metas, self.title)))
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'meta':
+            attrs = dict(attrs)
+            self.metas.extend([(attrs.get(attr), attrs.get('content')) for attr in ['name', 'property']])
+        elif tag == 'body':
+            self.send_metadata()
+        if tag in _block_tags and not self.invisible:
+            self.writer.block()
+        if tag in _void_tags:
+            return
+        self.stack.append(tag)
+        if tag in _invisible_tags:
+            self.invisible += 1
+        if tag == 'title' and self.title is None:
+            self.title = ''
+        if tag in _heading_tags and not self.invisible and self.heading is None:
+            self.heading = [_heading_tags[tag], None, self.writer.length]
+            self.heading_texts = []
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _void_tags:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+        #close any elements left open inside this one
+        while self.stack:
+            closed = self.stack.pop()
+            if closed in _invisible_tags:
+                self.invisible -= 1
+            if closed == 'head':
+                self.send_metadata()
+            if closed in _heading_tags and self.heading and 'h' + str(self.heading[0]) == closed:
+                self.heading[1] = _whitespace.sub(' ', ''.join(self.heading_texts)).strip()
+                if self.heading[1]:
+                    self.events.append(('toc', self.heading))
+                self.heading = None
+            if closed == tag:
+                break
+
+    def handle_data(self, data):
+        if self.stack and self.stack[-1] == 'title':
+            self.title += data
+        if not self.invisible:
+            self.writer.write(data)
+            if self.heading:
+                self.heading_texts.append(data)
+
+
+def _iter_html_events(html_file, read_size=1 << 16):
+    """Parse html incrementally, yielding events as it is read:
+
+    * `('metadata', dict)` - at the end of `<head>`, or of the document
+    * `('toc', [level, title, dest])` - at the end of each heading
+    * `('text', str)` - the visible text decoded from each `read_size` read
+
+    Only the current read, the unconsumed tail of the tokenizer and the open
+    tags are held, so memory stays bounded however large the document.
+    """
+    if isinstance(html_file, str):
+        html_file = io.StringIO(html_file)
+    parser = _HtmlEventParser()
+    while True:
+        data = html_file.read(read_size)
+        if data:
+            parser.feed(data)
+        else:
+            parser.close()
+            parser.send_metadata()
+        events, parser.events = parser.events, []
+        yield from events
+        text = parser.writer.take()
+        if text:
+            yield 'text', text
+        if not data:
+            break
+
+
+_pisa_meta_attrs = ["title", "author", "subject", "keywords"]
+
+
+def _pisa_render(html_str, url_path=None, link_callback=None):
+    """Render html (str or open text file) to pdf with xhtml2pdf, returning
+    `(meta, pdf_bytes)`."""
+    html = io.StringIO(html_str) if isinstance(html_str, str) else html_str
+    result = io.BytesIO()
+    context = pisa.pisaDocument(src=html,
+                                dest=result,
+                                path=url_path,
+                                link_callback=link_callback)
+    meta = {key: context.meta[key] for key in _pisa_meta_attrs}
+    return meta, result.getvalue()
 
 
 class HtmlExtracts:
-    """Singleton of extract logic for pdf format.
+    """Singleton of extract logic for html format.
     
     TODO:check html_str is bs4 compliant
     TODO:check with url_path
@@ -29,34 +270,177 @@ class HtmlExtracts:
     def __init__(self, config):
         self.config = config
 
+    def _iter_within_budget(self, stats, texts):
+        """Pass through `(kind, text)` until the text reaches 
+        `MAX_CONTENT_CHARS` characters or `MAX_CONTENT_SIZE` utf-8 bytes.
+
+        The text that crosses the budget is cut to fit and iteration stops.
+        Truncation is counted in `stats` and the length of the text kept
+        noted as `truncated_at_char`, which the record gets as 
+        `truncated_at_char`.
+        """
+        total_chars = 0
+        for kind, text, truncated in iter_within_budget(texts, 
+                                                         max_chars=self.config.MAX_CONTENT_CHARS, 
+                                                         max_bytes=self.config.MAX_CONTENT_SIZE
+                                                         ):
+            total_chars += len(text)
+            yield kind, text
+            if truncated:
+                stats.count('truncations')
+                stats.note('truncated_at_char', total_chars)
+                self.config.logger.info(f'Content budget reached, html text truncated at {total_chars} chars')
+
+    def extract_from_html_string(self, html_str, record=None, stats=None):
+        """Extract metadata, toc and text from html in a single parse, without
+        rendering to pdf.  An open text file may be given as `html_str`, or 
+        a tree already parsed by BeautifulSoup, which is used as is.
+
+        Title, author, subject, keywords and date come from `<title>` and 
+        `<meta>`; the toc from `h1`-`h6`; the body from the visible text.
+        Html has no pages, so `page_nos` is left unset.  The body is cut at
+        `MAX_CONTENT_CHARS` / `MAX_CONTENT_SIZE`, and the record's 
+        `truncated_at_char` gives the char where it was cut.
+        """
+        if stats is None:
+            stats = StageStats()
+        if record is None:
+            record = DocumentTemplate()
+        if len(record.keys())==0:
+            for key in record_attrs:
+                record[key] = None
+
+        if isinstance(html_str, bs4.BeautifulSoup):
+            soup = html_str
+        else:
+            with stats.stage('html_parse'):
+                soup = bs4.BeautifulSoup(html_str, get_html_parser(self.config.HTML_PARSER))
+        with stats.stage('metadata'):
+            for key, value in _get_html_metadata(soup).items():
+                if not record[key]:
+                    record[key] = value
+        stats.notes.pop('truncated_at_char', None)
+        with stats.stage('body_html'):
+            body, toc = _get_html_text_and_toc(soup)
+            body = ''.join([text for kind, text in self._iter_within_budget(stats, [('text', body)])])
+        if not record['title'] and toc:
+            record['title'] = toc[0][1]
+        if not record['toc']:
+            record['toc'] = [item for item in toc if item[2] <= len(body)]
+        if not record['body']:
+            record['body'] = body
+            record['truncated_at_char'] = stats.notes.get('truncated_at_char')
+            record['truncated'] = record['truncated_at_char'] is not None
+        with stats.stage('clean_text'):
+            record['clean_body'] = get_clean_text(record['body'])
 
-    def html_string_to_pdf(self, html_str, url_path=None, record=DocumentTemplate()):
+        self.config.logger.info(f"Extract from html took: {sum(stats.timings.get(name, 0.0) for name in ['html_parse', 'metadata', 'body_html'])} secs")
+        return record
+
+    def extract_from_html_stream(self, html_file, record=None, stats=None):
+        """Extract metadata, toc and text incrementally, for html too large 
+        to hold as a tree.  An open text file or a str may be given.
+
+        Gives the same record as `extract_from_html_string()`.  Reading stops
+        once the body reaches `MAX_CONTENT_CHARS` / `MAX_CONTENT_SIZE`, and 
+        the record's `truncated_at_char` gives the char where the body was cut.
+        """
+        if stats is None:
+            stats = StageStats()
+        if record is None:
+            record = DocumentTemplate()
+        if len(record.keys())==0:
+            for key in record_attrs:
+                record[key] = None
+
+        toc = []
+        def iter_texts():
+            for kind, value in _iter_html_events(html_file):
+                if kind == 'metadata':
+                    for key, item in value.items():
+                        if not record[key]:
+                            record[key] = item
+                elif kind == 'toc':
+                    toc.append(value)
+                else:
+                    yield kind, value
+        stats.notes.pop('truncated_at_char', None)
+        with stats.stage('body_html_stream'):
+            body = ''.join([text for kind, text in self._iter_within_budget(stats, iter_texts())])
+        if not record['title'] and toc:
+            record['title'] = toc[0][1]
+        if not record['toc']:
+            record['toc'] = [item for item in toc if item[2] <= len(body)]
+        if not record['body']:
+            record['body'] = body
+            record['truncated_at_char'] = stats.notes.get('truncated_at_char')
+            record['truncated'] = record['truncated_at_char'] is not None
+        with stats.stage('clean_text'):
+            record['clean_body'] = get_clean_text(record['body'])
+        return record
+
+    def iter_html_text(self, html_file):
+        """Yield chunks of visible text as the html is read, without holding
+        the document or its text."""
+        for kind, value in _iter_html_events(html_file):
+            if kind == 'text':
+                yield value
+
+    def extract_metadata_from_html_string(self, html_str, record=None, stats=None):
+        """Extract only title, author, subject, keywords and date; reading 
+        stops at the end of the `<head>`.  A BeautifulSoup tree may be given.
+        """
+        if stats is None:
+            stats = StageStats()
+        if record is None:
+            record = DocumentTemplate()
+        with stats.stage('metadata'):
+            if isinstance(html_str, bs4.BeautifulSoup):
+                metadata = _get_html_metadata(html_str)
+            else:
+                metadata = {}
+                for kind, value in _iter_html_events(html_str):
+                    if kind == 'metadata':
+                        metadata = value
+                        break
+            for key, item in metadata.items():
+                if not record[key]:
+                    record[key] = item
+        return record
+
+    def html_string_to_pdf(self, html_str, url_path=None, record=None, stats=None, renderer=None):
         """Generate a pdf:str and associated record metadata (title, toc, ...) 
-        from html string content.
+        from html string content.  An open text file may be given as 
+        `html_str`, so it is read by xhtml2pdf without an extra copy.
+
+        With a `PdfRenderService` as `renderer`, rendering runs in its worker
+        pool under a deadline; otherwise it runs inline.
         """
-        time0 = time.time()
+        if stats is None:
+            stats = StageStats()
 
-        context = {}
-        result = io.BytesIO()
+        meta = {}
+        pdf_bytes = b''
+        if record is None:
+            record = DocumentTemplate()
         if len(record.keys())==0:
             for key in record_attrs:
                 record[key] = None
-        meta_attrs = ["title", "author", "subject", "keywords"]
 
         try:
-            html = io.StringIO(html_str) 
-            context = pisa.pisaDocument(src=html,
-                                     dest=result,
-                                     path=url_path)
-        except:
-            print("Error: unable to create the PDF")
-
-        if context:
-            for key in meta_attrs:
-                record[key] = context.meta[key]
-        pdf_bytes = result.getvalue()
-
-        time1 = time.time()
-        self.config.logger.info(f'Convert html to pdf took: {time1 - time0} secs')
-
-        return record, pdf_bytes
\ No newline at end of file
+            with stats.stage('html_to_pdf'):
+                if renderer is not None:
+                    meta, pdf_bytes = renderer.render(html_str, url_path=url_path, stats=stats)
+                else:
+                    meta, pdf_bytes = _pisa_render(html_str, url_path=url_path)
+        except Exception as e:
+            stats.count('timeouts' if isinstance(e, TimeoutError) else 'errors')
+            self.config.logger.error(f'unable to create the pdf from html: {e!r}')
+
+        if meta:
+            for key in _pisa_meta_attrs:
+                record[key] = meta[key]
+
+        self.config.logger.info(f"Convert html to pdf took: {stats.timings.get('html_to_pdf', 0.0)} secs")
+
+        return record, pdf_bytes
@@ -32,23 +32,255 @@ __version__ = "0.1.0"
 __license__ = "MIT"
 
 from entero_document.record import record_attrs, DocumentTemplate
-from .utils import timeout, get_clean_text
+from .utils import timeout, check_timeout, remaining_time, run_with_timeout, get_spawn_context, get_clean_text, iter_within_budget, BufferReader
+from .stats import StageStats
 
 #pdf
-import pypdf
 import pdftitle                                                                 #uses pdfminer
-from pdfminer.high_level import extract_text as pdf_extract_text                #uses pdfminer.six, problem TODO???
-from pdfminer.high_level import extract_pages as pdf_extract_pages
 from pdfminer.pdfparser import PDFParser
 from pdfminer.pdfdocument import PDFDocument
-from pdfminer.pdfinterp import resolve1
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
 
 import fitz
 from pikepdf import Pdf
 
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import concurrent.futures
+import xml.etree.ElementTree as ET
 import datetime
 import io
+import math
+import mmap
+import signal
+import threading
 import time
+import uuid
+
+
+class PdfContext:
+    """Parsed handles and raw buffer of one pdf, shared by all extraction stages.
+
+    Each backend parses the buffer at most once, on first use.  Every parse is
+    counted in `parse_count`, which should be 1 for the common case where
+    pymupdf provides metadata, toc and body.  Stage timings and counters
+    are collected in `stats`.
+
+    Local files should use `PdfContext.from_filepath()`: the file is memory-
+    mapped rather than read, pymupdf opens it by path and pdfminer reads 
+    slices of the map, so the whole file is never copied into Python.
+
+    Content already fetched by `UniformResourceLocator` is passed as is, 
+    with its `pypdf_reader`, which then provides the document info and page
+    count without another parse.
+
+    Usage::
+        >>> with PdfContext(pdf_stream) as context:
+        ...     record = Pdf.extract_from_pdf_string(pdf_stream, context=context)
+        >>> context.parse_count
+        1
+        >>> with PdfContext.from_filepath(Path('tests/examples/example.pdf')) as context:
+        ...     record = Pdf.extract_from_pdf_string(context.pdf_stream, context=context)
+    """
+
+    def __init__(self, pdf_stream, filepath=None, stats=None, pypdf_reader=None):
+        self.pdf_stream = pdf_stream
+        self.filepath = filepath
+        self.pypdf_reader = pypdf_reader
+        self.stats = stats if stats is not None else StageStats()
+        self.parse_count = 0
+        self._fitz_document = None
+        self._pdfminer_document = None
+        self._readers = []
+        self._file = None
+
+    @classmethod
+    def from_filepath(cls, filepath, stats=None):
+        """Memory-map a local file instead of reading it."""
+        stats = stats if stats is not None else StageStats()
+        with stats.stage('read'):
+            f = open(filepath, 'rb')
+            try:
+                pdf_stream = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                #empty files cannot be mapped
+                pdf_stream = f.read()
+        stats.count('bytes_read', len(pdf_stream))
+        context = cls(pdf_stream, filepath=filepath, stats=stats)
+        context._file = f
+        return context
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def get_io(self):
+        """Get a file-like view of the raw buffer, without copying it."""
+        reader = BufferReader(self.pdf_stream)
+        self._readers.append(reader)
+        return reader
+
+    def reparse_io(self):
+        """Get a file-like view for libraries that only parse on their own,
+        such as `pdftitle`.  This is counted as another parse.
+        """
+        self.parse_count += 1
+        return self.get_io()
+
+    @property
+    def fitz_document(self):
+        """pymupdf document, opened once."""
+        if self._fitz_document is None:
+            with self.stats.stage('fitz_open'):
+                if self.filepath:
+                    self._fitz_document = fitz.open(self.filepath, filetype='pdf')
+                else:
+                    self._fitz_document = fitz.open(stream=self.pdf_stream, filetype='pdf')
+            self.parse_count += 1
+        return self._fitz_document
+
+    @property
+    def pdfminer_document(self):
+        """pdfminer document, parsed once."""
+        if self._pdfminer_document is None:
+            with self.stats.stage('pdfminer_open'):
+                parser = PDFParser(self.get_io())
+                self._pdfminer_document = PDFDocument(parser)
+            self.parse_count += 1
+        return self._pdfminer_document
+
+    def close(self):
+        if self._fitz_document is not None:
+            self._fitz_document.close()
+            self._fitz_document = None
+        self._pdfminer_document = None
+        for reader in self._readers:
+            reader.close()
+        self._readers = []
+        if self._file is not None:
+            if isinstance(self.pdf_stream, mmap.mmap):
+                try:
+                    self.pdf_stream.close()
+                except BufferError:
+                    #an abandoned (timed out) stage still holds a slice; left to gc
+                    pass
+            self._file.close()
+            self._file = None
+
+
+_worker_document = {}           #the pymupdf document of the current job, in a worker process
+
+
+def _open_worker_document(job_id, filepath, shm_name, size):
+    """Open the job's pdf once per worker process, rather than once per 
+    chunk, closing the document of the previous job."""
+    if job_id not in _worker_document:
+        for ingest in _worker_document.values():
+            ingest.close()
+        _worker_document.clear()
+        if filepath:
+            ingest = fitz.open(filepath, filetype='pdf')
+        else:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            try:
+                #pymupdf cannot open a memoryview, so each worker takes one copy
+                pdf_stream = bytes(shm.buf[:size])
+            finally:
+                shm.close()
+            ingest = fitz.open(stream=pdf_stream, filetype='pdf')
+        _worker_document[job_id] = ingest
+    return _worker_document[job_id]
+
+
+def _extract_page_range(job_id, filepath, shm_name, size, start, stop):
+    """Worker for `PdfExtracts.get_pdf_raw_text(mode='pymupdf-parallel')`.
+
+    Return the texts of pages [start, stop), from the worker's own pymupdf
+    handle on the local file when there is one or else on the shared buffer.
+    """
+    ingest = _open_worker_document(job_id, filepath, shm_name, size)
+    return [ingest[pg_idx].get_text() for pg_idx in range(start, stop)]
+
+
+def _title_worker_ready():
+    """First job of the title worker, which imports this module there."""
+    return True
+
+
+def _on_title_alarm(signum, frame):
+    raise TimeoutError('`pdftitle` took too long')
+
+
+def _get_title_job(get_title, filepath, pdf_stream, deadline):
+    """Worker for `PdfExtracts.get_pdf_title()`.
+
+    Workers run jobs on their main thread, so a timer signal stops the job
+    at `deadline` (a `time.time()`) and frees the worker, where 
+    `signal.setitimer` exists.  A job that waited past its deadline is not
+    started.
+    """
+    seconds = deadline - time.time()
+    if seconds <= 0:
+        raise TimeoutError('`pdftitle` job started after its deadline')
+    use_alarm = hasattr(signal, 'setitimer')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_title_alarm)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        if filepath:
+            with open(filepath, 'rb') as f:
+                return get_title(f)
+        return get_title(io.BytesIO(pdf_stream))
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+_xmp_namespaces = {'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+                   'dc': 'http://purl.org/dc/elements/1.1/',
+                   'pdf': 'http://ns.adobe.com/pdf/1.3/',
+                   'xmp': 'http://ns.adobe.com/xap/1.0/'
+                   }
+
+
+def _get_pdf_date(date_str):
+    """Date from a pdf date string ('D:20230504175927+00'00'') or an xmp
+    date ('2014-04-15T10:32:13-05:00'), None if it cannot be parsed."""
+    try:
+        if date_str.startswith('D:'):
+            Ymd = date_str.split('D:')[1][:8]
+        else:
+            Ymd = date_str[:10].replace('-', '')
+        return datetime.datetime.strptime(Ymd, "%Y%m%d").date()
+    except Exception:
+        return None
+
+
+def _get_xmp_metadata(xmp_str):
+    """Title, author, subject, keywords and date from an xmp packet."""
+    result = {}
+    if not xmp_str:
+        return result
+    try:
+        root = ET.fromstring(xmp_str.strip().encode('utf-8'))
+    except ET.ParseError:
+        return result
+    def find_text(path):
+        items = [item.text.strip() for item in root.iterfind(path, _xmp_namespaces) if item.text and item.text.strip()]
+        return ', '.join(items) if items else None
+    result['title'] = find_text('.//dc:title//rdf:li')
+    result['author'] = find_text('.//dc:creator//rdf:li')
+    result['subject'] = find_text('.//dc:description//rdf:li')
+    result['keywords'] = find_text('.//pdf:Keywords')
+    create_date = find_text('.//xmp:CreateDate')
+    result['date'] = _get_pdf_date(create_date) if create_date else None
+    return {k: v for k, v in result.items() if v}
 
 
 class PdfExtracts:
@@ -56,117 +288,413 @@ class PdfExtracts:
     
     """
 
+    _get_title = staticmethod(pdftitle.get_title_from_io)
+
     def __init__(self, config):
         self.config = config
+        self._page_pool = None
+        self._title_pool = None
+        self._title_lock = threading.Lock()
 
-    def extract_from_pdf_string(self, pdf_stream, record=DocumentTemplate()):
-        """TODO"""
-        time0 = time.time()
+    def close(self):
+        """Shut down the process pools of 'pymupdf-parallel' extraction 
+        and of `pdftitle`, if they were started; later extractions start
+        new ones."""
+        pool, self._page_pool = self._page_pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        with self._title_lock:
+            pool, self._title_pool = self._title_pool, None
+        if pool:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _get_title_pool(self):
+        """The one persistent `pdftitle` worker, started on first use; None
+        where a worker cannot be started, ie. within a daemonic process."""
+        with self._title_lock:
+            if self._title_pool is None:
+                pool = ProcessPoolExecutor(max_workers=1, mp_context=get_spawn_context())
+                try:
+                    pool.submit(_title_worker_ready).result()
+                    self._title_pool = pool
+                except Exception as e:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self._title_pool = False
+                    self.config.logger.info(f'`pdftitle` worker could not start ({type(e).__name__}: {e}), '
+                                            f'so `pdftitle` runs in a thread that is abandoned on timeout')
+            return self._title_pool or None
+
+    def _replace_title_pool(self, pool):
+        with self._title_lock:
+            if self._title_pool is not pool:
+                return
+            self._title_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run_pdftitle(self, context):
+        """Title from `pdftitle` within `MAX_TITLE_TIME_SEC`, or the nearest 
+        enclosing timeout, else TimeoutError.
+
+        `pdftitle` has no `check_timeout()` calls, so it runs in the title
+        worker, which stops it at the deadline.  The worker is started with 
+        forkserver or spawn, since forking a process with other threads 
+        running can deadlock.
+        """
+        seconds = self.config.MAX_TITLE_TIME_SEC
+        enclosing = remaining_time()
+        if enclosing is not None:
+            seconds = min(seconds, enclosing)
+        pool = self._get_title_pool()
+        if pool is None:
+            return run_with_timeout(self._get_title, context.reparse_io(), seconds=seconds)
+        context.parse_count += 1            #parsed again in the worker
+        filepath = str(context.filepath) if context.filepath else None
+        pdf_stream = None if filepath else bytes(context.pdf_stream)
+        future = pool.submit(_get_title_job, self._get_title, filepath, pdf_stream, time.time() + seconds)
+        try:
+            return future.result(timeout=seconds)
+        except concurrent.futures.TimeoutError:
+            if not future.cancel() and not hasattr(signal, 'setitimer'):
+                self._replace_title_pool(pool)
+            raise TimeoutError(f'`pdftitle` took more than {seconds}sec')
+        except BrokenProcessPool:
+            self._replace_title_pool(pool)
+            raise
 
+    def extract_from_pdf_string(self, pdf_stream, record=None, context=None):
+        """Extract metadata, toc and text from pdf bytes.
+
+        All stages share one `PdfContext`.  Pass `context` to inspect it 
+        afterwards (ie. `context.parse_count`, `context.stats`); otherwise one
+        is created and closed here.
+
+        The stages share one `MAX_TIME_SEC` deadline.  A stage that runs out
+        of time is abandoned and the record keeps what was extracted so far.
+        """
+        if record is None:
+            record = DocumentTemplate()
         if len(record.keys())==0:
             for key in record_attrs:
                 record[key] = None
+        close_context = context is None
+        if close_context:
+            context = PdfContext(pdf_stream)
+        stats = context.stats
+        time0 = time.perf_counter()
 
-        #pymupdf
-        with fitz.open(stream = pdf_stream) as ingest:
+        try:
+            with timeout(seconds=self.config.MAX_TIME_SEC, error_message=f'extraction took more than {self.config.MAX_TIME_SEC}sec'):
+                #pymupdf
+                ingest = context.fitz_document
+                self.get_pdf_metadata(context, record)
+                #pdf.miner
+                if not record['title']:
+                    record['title'] = self.get_pdf_title(context)
+                if not record['toc']:
+                    with stats.stage('toc'):
+                        record['toc'] = ingest.get_toc()
+
+                number_of_pages_to_extract_text = self.get_number_of_pages_to_extract(record['page_nos'])
+
+                use_parallel = self.config.PAGE_WORKERS > 1 and record['page_nos'] >= self.config.MIN_PAGES_PARALLEL
+                extract_body = not record['body']
+                stats.notes.pop('truncated_at_page', None)
+                if not record['body']:
+                    with stats.stage('body_pymupdf'):
+                        record['body'] = self.get_pdf_raw_text(context=context, 
+                                                                mode='pymupdf-parallel' if use_parallel else 'pymupdf', 
+                                                                number_of_pages_to_extract_text=number_of_pages_to_extract_text, 
+                                                                )
+                #pdf.miner
+                if not record['body']:
+                    stats.count('fallbacks')
+                    with stats.stage('body_pdfminer'):
+                        record['body'] = self.get_pdf_raw_text(context=context, 
+                                                                mode='pdf.miner', 
+                                                                number_of_pages_to_extract_text=number_of_pages_to_extract_text,  
+                                                                )
+                if extract_body:
+                    record['truncated_at_page'] = stats.notes.get('truncated_at_page')
+                    record['truncated'] = record['truncated_at_page'] is not None
+        finally:
+            if close_context:
+                context.close()
+        with stats.stage('clean_text'):
+            record['clean_body'] = get_clean_text(record['body'])
+
+        self.config.logger.info(f'Extract from pdf took: {time.perf_counter() - time0} secs, parsed {context.parse_count} time(s)')
+        return record
+
+
+    def extract_metadata_from_pdf_string(self, pdf_stream, record=None, context=None, use_xmp=False):
+        """Extract only the cheap metadata fields (title, author, subject, 
+        keywords, date, page_nos); no page text is decoded.
+
+        Only the trailer, xref, document info and page tree are read.  With
+        `use_xmp`, fields missing from the document info are filled from the
+        xmp metadata stream.
+        """
+        if record is None:
+            record = DocumentTemplate()
+        close_context = context is None
+        if close_context:
+            context = PdfContext(pdf_stream)
+        try:
+            self.get_pdf_metadata(context, record)
+            if use_xmp:
+                with context.stats.stage('xmp'):
+                    xmp = _get_xmp_metadata(self.get_xmp_string(context))
+                for key, value in xmp.items():
+                    if not record[key]:
+                        record[key] = value
+        finally:
+            if close_context:
+                context.close()
+        return record
+
+    def get_pdf_metadata(self, context, record):
+        """Populate record metadata from the document info, read from the 
+        context's pypdf reader when it has one, else from pymupdf."""
+        reader = context.pypdf_reader
+        if reader is None:
+            ingest = context.fitz_document
+        with context.stats.stage('metadata'):
             if not record['author']:
-                meta = ingest.metadata
+                if reader is not None:
+                    meta = {key: str(value) for key, value in (reader.metadata or {}).items()}
+                    meta = {'title': meta.get('/Title', ''),
+                            'author': meta.get('/Author', ''),
+                            'subject': meta.get('/Subject', ''),
+                            'keywords': meta.get('/Keywords', ''),
+                            'creationDate': meta.get('/CreationDate', '')
+                            }
+                else:
+                    meta = ingest.metadata
                 record['title'] = meta['title']
                 record['author'] = meta['author']
                 record['subject'] = meta['subject']
                 record['keywords'] = meta['keywords']
-                record['page_nos'] = len(ingest)
-                Ymd = meta['creationDate'].split('D:')[1][:8]
-                record['date'] = datetime.datetime.strptime(Ymd, "%Y%m%d").date()
-            #pdf.miner
-            if not record['title']:
-                record['title'] = self.get_pdf_title(pdf_stream)
-            if not record['toc']:
-                record['toc'] = ingest.get_toc()
-
-            page_list_length = record['page_nos'] - 1
-            if self.config.MAX_PAGE_EXTRACT:
-                if page_list_length <= self.config.MAX_PAGE_EXTRACT: 
-                    number_of_pages_to_extract_text = page_list_length
-                else: 
-                    number_of_pages_to_extract_text = self.config.MAX_PAGE_EXTRACT 
-            else:
-                number_of_pages_to_extract_text = page_list_length
-
-            if not record['body']:
-                record['body'] = self.get_pdf_raw_text(pdf_stream=ingest, 
-                                                        mode='pymupdf', 
-                                                        number_of_pages_to_extract_text=number_of_pages_to_extract_text, 
-                                                        )
-            #pdf.miner
-            if not record['body']:
-                record['body'] = self.get_pdf_raw_text(pdf_stream=pdf_stream, 
-                                                        mode='pdf.miner', 
-                                                        number_of_pages_to_extract_text=number_of_pages_to_extract_text,  
-                                                        )
-        record['clean_body'] = get_clean_text(record['body'])
-
-        self.config.logger.info(f'Convert html to pdf took: {time.time() - time0} secs')
+                record['date'] = _get_pdf_date(meta['creationDate'])
+            if not record['page_nos']:
+                record['page_nos'] = len(reader.pages) if reader is not None else len(ingest)
         return record
 
+    def get_xmp_string(self, context):
+        """Raw xmp packet, from the context's pypdf reader when it has one."""
+        reader = context.pypdf_reader
+        if reader is None:
+            return context.fitz_document.get_xml_metadata()
+        try:
+            stream = reader.trailer['/Root'].get('/Metadata')
+            return stream.get_object().get_data().decode('utf-8', errors='ignore') if stream else ''
+        except Exception:
+            return ''
+
+    def get_number_of_pages_to_extract(self, page_nos):
+        """Number of pages to extract: the document's page count, capped at 
+        `MAX_PAGE_EXTRACT`."""
+        if self.config.MAX_PAGE_EXTRACT:
+            return min(page_nos, self.config.MAX_PAGE_EXTRACT)
+        return page_nos
+
+    def _iter_within_budget(self, context, pages):
+        """Pass through `(page_number, text)` until the extracted text reaches
+        `MAX_CONTENT_CHARS` characters or `MAX_CONTENT_SIZE` utf-8 bytes.
+
+        The page that crosses the budget is cut to fit and iteration stops,
+        so no further pages are decoded.  Truncation is counted in 
+        `context.stats` and the page noted as `truncated_at_page`, which 
+        `extract_from_pdf_string()` records as `truncated_at_page`.
+        """
+        for page_number, text, truncated in iter_within_budget(pages, 
+                                                               max_chars=self.config.MAX_CONTENT_CHARS, 
+                                                               max_bytes=self.config.MAX_CONTENT_SIZE
+                                                               ):
+            yield page_number, text
+            if truncated:
+                context.stats.count('truncations')
+                context.stats.note('truncated_at_page', page_number)
+                self.config.logger.info(f'Content budget reached, text truncated at page {page_number}')
 
-    def get_pdf_title(self, pdf_stream,):
-        """TODO"""
+    def get_pdf_title(self, context):
+        """Get title with `pdftitle` heuristics, falling back to the 
+        document info `/Title` already parsed by pymupdf.
+        """
         title = None
-        tmp = io.BytesIO(pdf_stream)
         #pdf.miner
         try:
-            with timeout(seconds=5):
-                title = pdftitle.get_title_from_io(tmp)
-        except Exception:
-            self.config.logger.info("`pdftitle` module threw error getting title")
-            pass
+            with context.stats.stage('pdftitle'):
+                title = self._run_pdftitle(context)
+        except TimeoutError:
+            context.stats.count('timeouts')
+            self.config.logger.info("`pdftitle` module timed out getting title")
+        except BrokenProcessPool:
+            context.stats.count('errors')
+            self.config.logger.info("`pdftitle` worker died getting title, it is restarted for the next document")
+        except Exception as e:
+            self.config.logger.info(f"`pdftitle` module threw error getting title: {type(e).__name__}")
         
-        #pypdf
+        #pymupdf - same `/Title` entry that pypdf would reparse the file to read
         if not title:
+            context.stats.count('fallbacks')
             try:
-                with timeout(seconds=5):
-                    pdfReader = pypdf.PdfReader(tmp)
-                    title = pdfReader.metadata['/Title']
+                with context.stats.stage('title_metadata'):
+                    title = context.fitz_document.metadata['title']
             except Exception:
-                self.config.logger.info("`pypdf` module threw error getting title")
+                self.config.logger.info("`pymupdf` module threw error getting title")
                 pass
 
         return title
 
 
-    def get_pdf_raw_text(self, pdf_stream, mode, number_of_pages_to_extract_text):
+    def get_pdf_raw_text(self, context, mode, number_of_pages_to_extract_text):
         """Get raw text from pdf.
-        Ensure only a limited number of pages are extracted.
+        Ensure only a limited number of pages, and a limited amount of text,
+        are extracted.
         """
         raw_text = ''
 
+        #pymupdf, pages split across processes
+        if mode == 'pymupdf-parallel':
+            try:
+                raw_text = self._get_pymupdf_text_parallel(context=context,
+                                                           number_of_pages_to_extract_text=number_of_pages_to_extract_text
+                                                           )
+            except Exception:
+                self.config.logger.info('parallel page extraction failed, falling back to serial')
+                context.stats.count('fallbacks')
+                mode = 'pymupdf'
+
         #pymupdf
         if mode == 'pymupdf':
-            ingest = pdf_stream
+            texts = []
             try:
-                #with fitz.open(pdf_stream) as doc:
-                pg_idx = 0
-                for page in ingest:
-                    if pg_idx <= number_of_pages_to_extract_text:
-                        raw_text += page.get_text()
-                        pg_idx += 1
+                pages = self.iter_pdf_pages(context, 
+                                            mode='pymupdf', 
+                                            number_of_pages_to_extract_text=number_of_pages_to_extract_text
+                                            )
+                for page_number, text in self._iter_within_budget(context, pages):
+                    texts.append(text)
+            except TimeoutError:
+                context.stats.count('timeouts')
             except Exception:
-                pass    
+                context.stats.count('errors')
+            raw_text = ''.join(texts)
 
         #pdf.miner
         if raw_text == '' and mode == 'pdf.miner':
-            tmp = io.BytesIO(pdf_stream)
             try:
-                with timeout(seconds=self.config.MAX_TIME_SEC):
-                    raw_text = pdf_extract_text(pdf_file=tmp,
-                                                maxpages=number_of_pages_to_extract_text
-                                                )
-            except Exception:
+                raw_text = self._get_pdfminer_text(context=context,
+                                                   maxpages=number_of_pages_to_extract_text
+                                                   )
+            except TimeoutError:
+                context.stats.count('timeouts')
                 self.config.logger.info(f'It took more than {self.config.MAX_TIME_SEC}sec to extract text')
-            if not raw_text=='':
-                raw_text = pdf_extract_text(pdf_file=tmp,
-                                            maxpages=1
-                                            )
-        return raw_text        
+            except Exception:
+                context.stats.count('errors')
+                self.config.logger.info('`pdfminer` module threw error getting text')
+            if raw_text == '':
+                try:
+                    raw_text = self._get_pdfminer_text(context=context,
+                                                       maxpages=1
+                                                       )
+                except Exception:
+                    self.config.logger.info('`pdfminer` module could not get text of the first page')
+        return raw_text
+
+    def iter_pdf_pages(self, context, mode='pymupdf', number_of_pages_to_extract_text=None):
+        """Yield `(page_number, text)` one page at a time.
+
+        Only the current page's text is held, so consumers (spacy, indexers,
+        chunkers) can read the body without it ever being concatenated.
+        Page numbers start at 1, as in the toc.
+        """
+        if number_of_pages_to_extract_text is None:
+            number_of_pages_to_extract_text = self.get_number_of_pages_to_extract(len(context.fitz_document))
+
+        #pymupdf
+        if mode == 'pymupdf':
+            for pg_idx, page in enumerate(context.fitz_document):
+                if pg_idx >= number_of_pages_to_extract_text:
+                    break
+                check_timeout()
+                text = page.get_text()
+                context.stats.count('pages_extracted')
+                yield pg_idx + 1, text
+
+        #pdf.miner
+        elif mode == 'pdf.miner':
+            yield from self._iter_pdfminer_pages(context=context,
+                                                 maxpages=number_of_pages_to_extract_text
+                                                 )
+
+    def _get_pymupdf_text_parallel(self, context, number_of_pages_to_extract_text):
+        """Split the page range across a process pool.
+
+        Workers open their own pymupdf handle on the local file, or on the
+        buffer placed in shared memory, once for all the chunks they take;
+        it stays open until their next job.  Chunks are joined in page 
+        order, so the text matches the serial 'pymupdf' mode; once the 
+        content budget is reached, chunks not yet started are cancelled.
+        """
+        page_count = min(number_of_pages_to_extract_text, len(context.fitz_document))
+        workers = self.config.PAGE_WORKERS
+        chunk = math.ceil(page_count / (workers * 4)) or 1
+        starts = list(range(0, page_count, chunk))
+        stops = [min(start + chunk, page_count) for start in starts]
+
+        if self._page_pool is None:
+            self._page_pool = ProcessPoolExecutor(max_workers=workers)
+        shm = None
+        size = len(context.pdf_stream)
+        filepath = str(context.filepath) if context.filepath else None
+        try:
+            if not filepath:
+                shm = shared_memory.SharedMemory(create=True, size=size)
+                shm.buf[:size] = context.pdf_stream
+            job_id = uuid.uuid4().hex
+            futures = [self._page_pool.submit(_extract_page_range, job_id, filepath, shm.name if shm else None, size, start, stop)
+                       for start, stop in zip(starts, stops)
+                       ]
+            def iter_pages():
+                for start, future in zip(starts, futures):
+                    check_timeout()
+                    chunk_texts = future.result(timeout=remaining_time())
+                    context.stats.count('pages_extracted', len(chunk_texts))
+                    for offset, text in enumerate(chunk_texts):
+                        yield start + offset + 1, text
+            try:
+                raw_text = ''.join([text for page_number, text in self._iter_within_budget(context, iter_pages())])
+            finally:
+                for future in futures:
+                    future.cancel()
+        finally:
+            if shm:
+                shm.close()
+                shm.unlink()
+        return raw_text
+
+    def _get_pdfminer_text(self, context, maxpages=0):
+        """Equivalent of `pdfminer.high_level.extract_text()` over the 
+        context's already-parsed document.
+        """
+        pages = self._iter_pdfminer_pages(context, maxpages)
+        texts = [text for page_number, text in self._iter_within_budget(context, pages)]
+        return ''.join(texts)
 
+    def _iter_pdfminer_pages(self, context, maxpages=0):
+        """Yield `(page_number, text)` from the context's pdfminer document."""
+        rsrcmgr = PDFResourceManager()
+        with io.StringIO() as output_string:
+            device = TextConverter(rsrcmgr, output_string, laparams=LAParams())
+            interpreter = PDFPageInterpreter(rsrcmgr, device)
+            for pg_idx, page in enumerate(PDFPage.create_pages(context.pdfminer_document)):
+                if maxpages and pg_idx >= maxpages:
+                    break
+                check_timeout()
+                interpreter.process_page(page)
+                text = output_string.getvalue()
+                output_string.seek(0)
+                output_string.truncate()
+                context.stats.count('pages_extracted')
+                yield pg_idx + 1, text
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Owners of registered domains from ICANN WHOIS, cached and rate limited
+
+Primary vars::
+* class WhoisResolver - owner lookups with a TTL cache, coalescing and per-registry rate limits
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from .cache import DiskCache, dumps_value, loads_value
+from .ratelimit import RateLimiter
+from .utils import tld_extract
+
+import whois
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+import threading
+import time
+
+
+def _lookup_whois_owner(domain):
+    """Registrant organization of `domain`, from python-whois."""
+    account = whois.whois(domain)
+    text = account.text or ''
+    if 'Organization:' in text:
+        return text.split('Organization:')[1].split('\n')[0].strip()
+    org = account.get('org')
+    org = org[0] if isinstance(org, list) and org else org
+    return org.strip() if isinstance(org, str) else ''
+
+
+
+class WhoisResolver:
+    """Owner (registrant organization) of the registered domain of urls.
+
+    Owners are kept for `WHOIS_TTL_SEC`, in memory and, with a
+    `config.cache_dir`, in a DiskCache under 'whois' that persists between
+    runs.  Failed lookups are remembered in memory only, for
+    `WHOIS_FAILURE_TTL_SEC`.  Threads asking for the same domain at once share
+    one lookup.  Lookups are paced per registry (the public suffix) at
+    `WHOIS_RATE_PER_SEC`, rather than sleeping after each, and a domain is
+    tried up to `WHOIS_ATTEMPTS` times.
+
+    Usage::
+        >>> Whois = WhoisResolver(config)
+        >>> Whois.get_owner('https://www.jpmorgan.com')
+        'JPMorgan Chase & Co.'
+        >>> Whois.get_owners(['https://www.jpmorgan.com', 'https://chase.com'])
+        {'jpmorgan.com': 'JPMorgan Chase & Co.', 'chase.com': 'JPMorgan Chase & Co.'}
+        >>> Whois.dump()
+        {'lookups': 2, 'cache_hits': 1, 'coalesced': 0, 'failures': 0, 'waited_secs': 1.0}
+    """
+
+    def __init__(self, config, lookup=None):
+        self.config = config
+        self.lookup = lookup if lookup else _lookup_whois_owner
+        self.limiter = RateLimiter(rate=config.WHOIS_RATE_PER_SEC)
+        self.store = DiskCache(Path(config.cache_dir) / 'whois', config.MAX_CACHE_SIZE) if config.cache_dir else None
+        self._memory = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.lookups = 0
+            self.cache_hits = 0
+            self.coalesced = 0
+            self.failures = 0
+
+    def dump(self):
+        with self._lock:
+            return {'lookups': self.lookups,
+                    'cache_hits': self.cache_hits,
+                    'coalesced': self.coalesced,
+                    'failures': self.failures,
+                    'waited_secs': self.limiter.dump()['waited_secs']
+                    }
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    @staticmethod
+    def get_registered_domain(url):
+        """The `(registered domain, registry)` of a url or domain, ie.
+        ('jpmorgan.co.uk', 'uk')."""
+        parts = tld_extract(url)
+        if not parts.suffix:
+            return parts.domain, ''
+        return f'{parts.domain}.{parts.suffix}', parts.suffix.split('.')[-1]
+
+    def _get_cached(self, domain):
+        now = time.time()
+        entry = self._memory.get(domain)
+        if entry and now < entry[1]:
+            return entry[0]
+        if self.store:
+            value = self.store.get(domain)
+            if value:
+                owner, expires_at = loads_value(value)
+                if now < expires_at:
+                    self._memory[domain] = (owner, expires_at)
+                    return owner
+        return None
+
+    def _set_cached(self, domain, owner):
+        if owner:
+            expires_at = time.time() + self.config.WHOIS_TTL_SEC
+            if self.store:
+                self.store.set(domain, dumps_value((owner, expires_at)))
+        else:
+            expires_at = time.time() + self.config.WHOIS_FAILURE_TTL_SEC
+        self._memory[domain] = (owner, expires_at)
+
+    def _lookup(self, domain, registry):
+        for attempt in range(self.config.WHOIS_ATTEMPTS):
+            self.limiter.acquire(registry)
+            self._count('lookups')
+            try:
+                owner = self.lookup(domain)
+                if owner:
+                    return owner
+            except Exception:
+                pass
+        self.config.logger.error(f'ICANN WHOIS gave no response for domain: `{domain}`')
+        self._count('failures')
+        return ''
+
+    def get_owner(self, url):
+        """Owner of the registered domain of `url`, or '' when unknown."""
+        domain, registry = self.get_registered_domain(url)
+        if not domain:
+            return ''
+        owner = self._get_cached(domain)
+        if owner is not None:
+            self._count('cache_hits')
+            return owner
+        with self._lock:
+            future = self._inflight.get(domain)
+            leader = future is None
+            if leader:
+                future = self._inflight[domain] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            owner = self._get_cached(domain)        #finished by another thread meanwhile
+            if owner is None:
+                owner = self._lookup(domain, registry)
+                self._set_cached(domain, owner)
+            future.set_result(owner)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[domain]
+        return owner
+
+    def get_owners(self, urls):
+        """Owners of many urls, as `{registered domain: owner}`, looked up
+        `WHOIS_WORKERS` at a time."""
+        domains = {}
+        for url in urls:
+            domain, registry = self.get_registered_domain(str(url))
+            domains.setdefault(domain, str(url))
+        with ThreadPoolExecutor(max_workers=self.config.WHOIS_WORKERS) as executor:
+            owners = list(executor.map(self.get_owner, domains.values()))
+        return dict(zip(domains.keys(), owners))
+
+    def has_same_owners(self, base_url, urls):
+        """Whether each of `urls` has the same owner as `base_url`.
+
+        Urls with the same domain name as `base_url` match without a lookup,
+        as in `UniformResourceLocator.has_same_url_owner_()`.  The rest are
+        looked up together; unknown owners do not match.
+        """
+        base_domain = tld_extract(str(base_url)).domain
+        others = [str(url) for url in urls if tld_extract(str(url)).domain != base_domain]
+        owners = self.get_owners([str(base_url)] + others) if others else {}
+        base_owner = owners.get(self.get_registered_domain(str(base_url))[0])
+        results = []
+        for url in urls:
+            if tld_extract(str(url)).domain == base_domain:
+                results.append(True)
+            else:
+                owner = owners.get(self.get_registered_domain(str(url))[0])
+                results.append(bool(owner and base_owner and owner == base_owner))
+        return results
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Token-bucket rate limiting, backoff and circuit breaking, shared by threads
+
+Primary vars::
+* class TokenBucket - `rate` requests per second, with bursts of up to `capacity`
+* class RateLimiter - one TokenBucket per key (host, registry, ...)
+* class CircuitBreaker - stop calling a key after repeated failures, then try again later
+* backoff_delay() - exponential backoff with full jitter
+* parse_retry_after() - seconds to wait from a `Retry-After` header
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+
+
+
+class TokenBucket:
+    """Allow `rate` acquisitions per second on average, and up to `capacity`
+    at once after a pause.
+
+    Usage::
+        >>> bucket = TokenBucket(rate=1.0)
+        >>> bucket.acquire()                    #returns at once
+        0.0
+        >>> bucket.acquire()                    #waits about 1sec
+        1.0
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token, possibly borrowed from the future, and return the
+        seconds until it is available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, 0.0)
+
+    def acquire(self):
+        """Block until a token is available; return the seconds waited."""
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def defer(self, secs):
+        """Make the next acquisition wait at least `secs`, ie. for a 
+        `Retry-After` from the server."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens = min(self.tokens, 1 - secs * self.rate)
+
+
+
+class RateLimiter:
+    """TokenBuckets created on first use for each key, with the same
+    `rate` and `capacity` unless `rates` gives a key its own rate.
+
+    A dotted key without its own rate takes that of its closest parent in
+    `rates`, so {'sec.gov': 10} also applies to 'www.sec.gov'.
+
+    Usage::
+        >>> limiter = RateLimiter(rate=1.0, rates={'sec.gov': 10})
+        >>> limiter.acquire('com')
+        >>> limiter.dump()
+        {'acquired': 1, 'waited_secs': 0.0}
+    """
+
+    def __init__(self, rate, capacity=1, rates=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.rates = rates if rates else {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.waited_secs = 0.0
+
+    def get_rate(self, key):
+        labels = str(key).split('.')
+        for idx in range(len(labels)):
+            parent = '.'.join(labels[idx:])
+            if parent in self.rates:
+                return self.rates[parent]
+        return self.rate
+
+    def get_bucket(self, key):
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self.get_rate(key), self.capacity)
+            return self._buckets[key]
+
+    def defer(self, key, secs):
+        """Hold requests for `key` for at least `secs`."""
+        self.get_bucket(key).defer(secs)
+
+    def acquire(self, key):
+        """Block until a request for `key` is allowed."""
+        wait = self.get_bucket(key).acquire()
+        with self._lock:
+            self.acquired += 1
+            self.waited_secs += wait
+        return wait
+
+    def dump(self):
+        with self._lock:
+            return {'acquired': self.acquired, 'waited_secs': round(self.waited_secs, 6)}
+
+
+
+class CircuitBreaker:
+    """Stop calling a key (ie. a host) once it has failed `failures` times
+    in a row, and allow one trial call after `reset_secs`.  A success closes 
+    the circuit again; a failed trial keeps it open for another `reset_secs`.
+
+    Usage::
+        >>> breaker = CircuitBreaker(failures=5, reset_secs=60)
+        >>> if breaker.allow('www.jpmorgan.com'):
+        ...     ok = call()
+        ...     breaker.record('www.jpmorgan.com', ok)
+        >>> breaker.dump()
+        {'opened': 0, 'rejected': 0, 'open': []}
+    """
+
+    def __init__(self, failures, reset_secs):
+        self.failures = failures
+        self.reset_secs = reset_secs
+        self._failed = {}
+        self._opened_at = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self, key):
+        with self._lock:
+            opened_at = self._opened_at.get(key)
+            if opened_at is None:
+                return True
+            if time.monotonic() - opened_at >= self.reset_secs:
+                self._opened_at[key] = time.monotonic()       #one trial, others wait again
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, key, success):
+        with self._lock:
+            if success:
+                self._failed.pop(key, None)
+                self._opened_at.pop(key, None)
+                return
+            self._failed[key] = self._failed.get(key, 0) + 1
+            if self._failed[key] >= self.failures:
+                if key not in self._opened_at:
+                    self.opened += 1
+                self._opened_at[key] = time.monotonic()
+
+    def dump(self):
+        with self._lock:
+            return {'opened': self.opened, 'rejected': self.rejected, 'open': sorted(self._opened_at)}
+
+
+
+def backoff_delay(attempt, base, cap):
+    """Seconds to wait before retry `attempt` (from 0): uniform in 
+    [0, min(cap, base * 2**attempt)], so clients that failed together do 
+    not retry together."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a `Retry-After` header, given in seconds or as an
+    http-date; None if missing or invalid."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
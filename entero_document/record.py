@@ -5,6 +5,7 @@ Attributes / Keys and Record classes for use with Document
 Primary vars::
 * record_attrs - all attributes to populate for each file, maintained in a record
 * class DocumentTemplate - schema for records
+* class LazyRecord(dotdict) - record with attributes computed on first access
 * class DocumentRecord(DocumentBase) - record filled with file metadata, text, and other values
 """
 
@@ -55,6 +56,9 @@ record_attrs = [
 
         "body",
         "clean_body",
+        "truncated",
+        "truncated_at_page",
+        "truncated_at_char",
         "readability_score",
         "tag_categories",
         "keywords",
@@ -86,6 +90,68 @@ class DocumentTemplate:
 
 
 
+class LazyRecord(dotdict):
+     """DocumentTemplate whose deferred attributes are computed on first access.
+
+     Reading any of `lazy_keys` (by key, attribute or `.get()`), or listing
+     the record (`.keys()`, `.items()`, `.values()`, iteration, `dict(record)`),
+     calls `loader` once to populate them.  The other attributes are 
+     available immediately.
+
+     Usage::
+     record = LazyRecord(template, lazy_keys=['body', 'toc'], loader=doc.load_deferred_attrs)
+     record.title          #no extraction
+     record.body           #runs loader, then memoized
+     """
+
+     def __init__(self, record, lazy_keys, loader):
+          super().__init__(record)
+          object.__setattr__(self, '_lazy_keys', set(lazy_keys))
+          object.__setattr__(self, '_loader', loader)
+
+     def is_loaded(self):
+          return self._loader is None
+
+     def load(self):
+          """Run the loader, if it has not run yet."""
+          loader = self._loader
+          if loader is not None:
+               object.__setattr__(self, '_loader', None)
+               loader()
+          return self
+
+     def __getitem__(self, key):
+          if key in self._lazy_keys:
+               self.load()
+          return dict.__getitem__(self, key)
+
+     def get(self, key, default=None):
+          if key in self._lazy_keys:
+               self.load()
+          return dict.get(self, key, default)
+
+     __getattr__ = get
+
+     def items(self):
+          self.load()
+          return dict.items(self)
+
+     def values(self):
+          self.load()
+          return dict.values(self)
+
+     def keys(self):
+          self.load()
+          return dict.keys(self)
+
+     def __iter__(self):
+          #also moves `dict(record)` and `{**record}` off the copy of the raw dict
+          self.load()
+          return dict.__iter__(self)
+
+
+
+
 class DocumentRecord(DocumentBase):
      """Extended functionality of namedtuple.
 
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Pooled, time-limited html to pdf rendering
+
+Primary vars::
+* class ResourceCache - stylesheets, fonts and images linked from html, keyed by url / path
+* class PdfRenderService - xhtml2pdf rendering in a worker-process pool, with per-job deadlines
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from .cache import DiskCache, dumps_value, loads_value
+from .extracts_html import _pisa_render
+from .utils import remaining_time
+
+import requests
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from pathlib import Path
+import base64
+import concurrent.futures
+import hashlib
+import mimetypes
+import os
+import signal
+import threading
+import time
+import urllib.parse
+
+
+class ResourceCache:
+    """Resources linked from html (css, fonts, images), used as the
+    xhtml2pdf `link_callback`.
+
+    Each resource is fetched or read once and handed to xhtml2pdf as a
+    `data:` uri, so the renderer does no i/o of its own.  Entries are kept
+    in memory per process, least-recently-used first out past 
+    `max_memory_bytes`, and, with a `directory`, in a DiskCache shared by
+    all worker processes.  Remote resources are keyed by url, local ones by
+    path, size and mtime.
+
+    Usage::
+        >>> resources = ResourceCache(Path('.cache/entero/resources'))
+        >>> pisa.pisaDocument(src=html, dest=result, link_callback=resources)
+    """
+
+    _fetch_timeout_sec = 10
+
+    def __init__(self, directory=None, max_size_bytes=1e+8, max_memory_bytes=2e+7):
+        self.store = DiskCache(directory, max_size_bytes) if directory else None
+        self.max_memory_bytes = int(max_memory_bytes)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self.fetches = 0
+
+    def __call__(self, uri, rel):
+        try:
+            return self.get_data_uri(uri, rel)
+        except Exception:
+            #leave the uri to xhtml2pdf
+            return None
+
+    def resolve(self, uri, rel=None):
+        """Absolute url or path of `uri`, relative to the document `rel`."""
+        if uri.startswith('data:'):
+            return None
+        if rel and not urllib.parse.urlparse(uri).scheme:
+            if urllib.parse.urlparse(rel).scheme in ('http', 'https'):
+                return urllib.parse.urljoin(rel, uri)
+            base = Path(rel)
+            base = base if base.is_dir() else base.parent
+            return str((base / uri).resolve())
+        return uri
+
+    def get_data_uri(self, uri, rel=None):
+        location = self.resolve(uri, rel)
+        if location is None:
+            return None
+        if urllib.parse.urlparse(location).scheme in ('http', 'https'):
+            key = hashlib.sha256(location.encode()).hexdigest()
+            loader = self._fetch
+        else:
+            location = location[len('file://'):] if location.startswith('file://') else location
+            st = os.stat(location)
+            key = hashlib.sha256(f'{location}|{st.st_size}|{st.st_mtime_ns}'.encode()).hexdigest()
+            loader = self._read
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+        else:
+            if self.store:
+                value = self.store.get(key)
+                entry = loads_value(value) if value else None
+            if entry is None:
+                entry = loader(location)
+                if self.store:
+                    self.store.set(key, dumps_value(entry))
+            self._remember(key, entry)
+        mimetype, content = entry
+        return f'data:{mimetype};base64,{base64.b64encode(content).decode()}'
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory_bytes += len(entry[1])
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, (mimetype, content) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(content)
+
+    def _fetch(self, url):
+        self.fetches += 1
+        resp = requests.get(url, timeout=self._fetch_timeout_sec)
+        resp.raise_for_status()
+        mimetype = resp.headers.get('content-type', '').split(';')[0].strip()
+        return (mimetype or self._guess_type(url), resp.content)
+
+    def _read(self, path):
+        self.fetches += 1
+        with open(path, 'rb') as f:
+            return (self._guess_type(path), f.read())
+
+    def _guess_type(self, location):
+        return mimetypes.guess_type(urllib.parse.urlparse(location).path)[0] or 'application/octet-stream'
+
+
+_worker_resources = {}          #the ResourceCache of this worker process, by resource_dir
+
+
+def _on_render_alarm(signum, frame):
+    raise TimeoutError('rendering html to pdf took too long')
+
+
+def _render_job(html_str, url_path, resource_dir, deadline=None):
+    """Worker for `PdfRenderService`; each process keeps one ResourceCache.
+
+    Workers run jobs on their main thread, so a timer signal stops the job
+    at `deadline` (a `time.time()`) and frees the worker (where 
+    `signal.setitimer` exists).  A job that waited in the queue past its 
+    deadline is not started.
+    """
+    seconds = None
+    if deadline is not None:
+        seconds = deadline - time.time()
+        if seconds <= 0:
+            raise TimeoutError('rendering html to pdf started after its deadline')
+    if resource_dir not in _worker_resources:
+        _worker_resources.clear()
+        _worker_resources[resource_dir] = ResourceCache(resource_dir)
+    use_alarm = seconds is not None and hasattr(signal, 'setitimer')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_render_alarm)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        return _pisa_render(html_str, url_path=url_path, link_callback=_worker_resources[resource_dir])
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class PdfRenderService:
+    """Render html to pdf with xhtml2pdf in a pool of `RENDER_WORKERS`
+    processes, so slow pages do not block ingestion.
+
+    Each job has a deadline of `MAX_RENDER_TIME_SEC`, shortened to any
+    enclosing `utils.timeout`.  A job that misses it raises TimeoutError,
+    and the worker stops the job itself at the same deadline.  Where timer
+    signals are not available, the pool is shut down and replaced instead,
+    its stuck worker left to finish; jobs that were queued on it are 
+    resubmitted once.  Linked resources go through a ResourceCache under 
+    `cache_dir` / 'resources', when set.
+
+    Usage::
+        >>> Render = PdfRenderService(config)
+        >>> meta, pdf_bytes = Render.render(html_str, url_path=url)
+        >>> Render.dump()
+        {'submitted': 1, 'completed': 1, 'failed': 0, 'timed_out': 0, 'queue_depth': 0, ...}
+        >>> Render.close()
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.resource_dir = str(Path(config.cache_dir) / 'resources') if config.cache_dir else None
+        self._lock = threading.Lock()
+        self._pool = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.submitted = 0
+            self.completed = 0
+            self.failed = 0
+            self.timed_out = 0
+            self.resubmitted = 0
+            self.render_secs = 0.0
+            self.time0 = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.config.RENDER_WORKERS)
+            return self._pool
+
+    def _replace_pool(self, pool):
+        """Shut down `pool`, cancelling its queued jobs, so new jobs go to 
+        a new pool; a worker stuck on a job exits once the job ends."""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, html_str, url_path, deadline):
+        pool = self._get_pool()
+        try:
+            future = pool.submit(_render_job, html_str, url_path, self.resource_dir, deadline)
+        except (RuntimeError, BrokenProcessPool):
+            #replaced by another thread since `_get_pool()`
+            pool = self._get_pool()
+            future = pool.submit(_render_job, html_str, url_path, self.resource_dir, deadline)
+        future.pool = pool
+        return future
+
+    def render(self, html_str, url_path=None, stats=None):
+        """Render and return `(meta, pdf_bytes)` within the deadline."""
+        if not isinstance(html_str, str):
+            html_str = html_str.read()
+        seconds = self.config.MAX_RENDER_TIME_SEC
+        enclosing = remaining_time()
+        if enclosing is not None:
+            seconds = min(seconds, enclosing)
+        deadline = time.time() + seconds
+        time0 = time.perf_counter()
+        with self._lock:
+            self.submitted += 1
+            if self.time0 is None:
+                self.time0 = time0
+        future = self._submit(html_str, url_path, deadline)
+        try:
+            try:
+                result = future.result(timeout=max(deadline - time.time(), 0))
+            except (BrokenProcessPool, concurrent.futures.CancelledError):
+                #the pool was replaced, or a worker died, before this job ran
+                with self._lock:
+                    self.resubmitted += 1
+                future = self._submit(html_str, url_path, deadline)
+                result = future.result(timeout=max(deadline - time.time(), 0))
+        except (concurrent.futures.TimeoutError, TimeoutError):
+            with self._lock:
+                self.timed_out += 1
+            if stats is not None:
+                stats.count('render_timeouts')
+            if not future.cancel() and not hasattr(signal, 'setitimer'):
+                self._replace_pool(future.pool)
+            raise TimeoutError(f'rendering html to pdf took more than {seconds}sec')
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        with self._lock:
+            self.completed += 1
+            self.render_secs += time.perf_counter() - time0
+        return result
+
+    def dump(self):
+        """Throughput and queue depth of the service."""
+        with self._lock:
+            elapsed = time.perf_counter() - self.time0 if self.time0 else 0.0
+            finished = self.completed + self.failed + self.timed_out
+            return {'submitted': self.submitted,
+                    'completed': self.completed,
+                    'failed': self.failed,
+                    'timed_out': self.timed_out,
+                    'resubmitted': self.resubmitted,
+                    'queue_depth': self.submitted - finished,
+                    'jobs_per_sec': round(self.completed / elapsed, 3) if elapsed else 0.0,
+                    'mean_secs': round(self.render_secs / self.completed, 6) if self.completed else 0.0
+                    }
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
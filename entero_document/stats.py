@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing and counters for Documents, with an aggregate registry
+
+Primary vars::
+* class StageStats - timings (secs) and counters of one Document's extraction stages
+* class StatsRegistry - totals across a batch of Documents, kept by DocumentFactory
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from contextlib import contextmanager
+import threading
+import time
+
+
+
+class StageStats:
+    """Timings and counters for the stages of one extraction.
+
+    Stage names used by the extractors: read, fitz_open, pdfminer_open,
+    metadata, pdftitle, title_metadata, toc, body_pymupdf, body_pdfminer,
+    clean_text, spacy, html_parse, body_html, body_html_stream, html_to_pdf,
+    cache_lookup.  Stages may nest (pdfminer_open runs within body_pdfminer).
+    Counters: bytes_read, pages_extracted, fallbacks, cache_hits, 
+    cache_misses, truncations, render_timeouts, timeouts, errors.  The last
+    two count stages cut short, whose output is incomplete.
+    Notes hold per-document facts that are not summed, ie. truncated_at_page.
+
+    Usage::
+        >>> stats = StageStats()
+        >>> with stats.stage('toc'):
+        ...     toc = ingest.get_toc()
+        >>> stats.count('pages_extracted', 12)
+        >>> stats.note('truncated_at_page', 12)
+        >>> stats._asdict()
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+        self.notes = {}
+
+    def __repr__(self):
+        return f'StageStats(timings={self.timings}, counters={self.counters}, notes={self.notes})'
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block and add it to stage `name`."""
+        time0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - time0
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def count(self, name, value=1):
+        """Increment counter `name` by `value`."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def note(self, name, value):
+        """Record per-document fact `name`; not aggregated by StatsRegistry."""
+        self.notes[name] = value
+
+    def copy(self):
+        stats = StageStats()
+        stats.timings, stats.counters, stats.notes = dict(self.timings), dict(self.counters), dict(self.notes)
+        return stats
+
+    def since(self, earlier):
+        """Return the timings and counters added since `earlier`, a `copy()`."""
+        stats = StageStats()
+        for name, elapsed in self.timings.items():
+            if elapsed > earlier.timings.get(name, 0.0):
+                stats.timings[name] = elapsed - earlier.timings.get(name, 0.0)
+        for name, value in self.counters.items():
+            if value != earlier.counters.get(name, 0):
+                stats.counters[name] = value - earlier.counters.get(name, 0)
+        return stats
+
+    def _asdict(self):
+        return {'timings': dict(self.timings), 'counters': dict(self.counters), 'notes': dict(self.notes)}
+
+
+
+class StatsRegistry:
+    """Aggregate of StageStats across a batch of Documents.
+
+    Thread-safe so one DocumentFactory can be shared by worker threads.
+
+    Usage::
+        >>> Doc = DocumentFactory()
+        >>> docs = [Doc.build(path) for path in paths]
+        >>> Doc.stats.dump()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.documents = 0
+            self.timings = {}
+            self.calls = {}
+            self.max_timings = {}
+            self.counters = {}
+
+    def add(self, stats, document=True):
+        """Add one Document's StageStats to the totals.
+
+        With `document=False` the stages are added without counting another
+        Document, ie. those deferred by `applyLazyExtraction` past `build()`.
+        """
+        with self._lock:
+            self.documents += int(document)
+            for name, elapsed in stats.timings.items():
+                self.timings[name] = self.timings.get(name, 0.0) + elapsed
+                self.calls[name] = self.calls.get(name, 0) + 1
+                self.max_timings[name] = max(self.max_timings.get(name, 0.0), elapsed)
+            for name, value in stats.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def dump(self):
+        """Return totals with stages ordered from most to least time spent."""
+        with self._lock:
+            stages = {}
+            for name in sorted(self.timings, key=self.timings.get, reverse=True):
+                stages[name] = {'total_secs': round(self.timings[name], 6),
+                                'calls': self.calls[name],
+                                'mean_secs': round(self.timings[name] / self.calls[name], 6),
+                                'max_secs': round(self.max_timings[name], 6)
+                                }
+            return {'documents': self.documents,
+                    'stages': stages,
+                    'counters': dict(self.counters)
+                    }
@@ -8,45 +8,448 @@ __version__ = "0.1.0"
 __license__ = "MIT"
 
 from .config import ConfigObj 
+from .cache import ResponseCache
+from .owner import WhoisResolver
+from .ratelimit import RateLimiter, CircuitBreaker, backoff_delay, parse_retry_after
+from .browser import ChromiumRenderer
+from .utils import get_html_parser, get_visible_text, BufferReader, tld_extract
 
-import tldextract
-import whois
 from requests_html import HTMLSession
+import requests
 import bs4
 import pypdf
 
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
 import urllib
+import weakref
 from pathlib import Path
-import io
+import asyncio
+import functools
+import mmap
+import tempfile
+import threading
 import time
-import sys
+
+
+class DownloadTooLarge(ValueError):
+    """Raised by `_read_body()` for a body larger than the download cap."""
+
+
+def _read_body(resp, max_size=None, spool_size=None, chunk_size=1 << 16, head=b''):
+    """Read the body of a streamed response in chunks, after the `head` 
+    already read from it.
+
+    Returns `(body, spool)`: the bytes, or for a body larger than 
+    `spool_size` a read-only mmap of the temp file `spool` it was written to.
+    Raises DownloadTooLarge, without reading further, once it is larger than 
+    `max_size`.
+    """
+    length = resp.headers.get('content-length', '')
+    if max_size and length.isdigit() and int(length) > max_size:
+        resp.close()
+        raise DownloadTooLarge(f'content-length {length} is larger than {int(max_size)} bytes')
+    chunks, size, spool = ([head], len(head), None) if head else ([], 0, None)
+    try:
+        for chunk in resp.iter_content(chunk_size):
+            size += len(chunk)
+            if max_size and size > max_size:
+                resp.close()
+                raise DownloadTooLarge(f'body is larger than {int(max_size)} bytes')
+            if spool is None and spool_size and size > spool_size:
+                spool = tempfile.NamedTemporaryFile(prefix='entero-', suffix='.download')
+                spool.writelines(chunks)
+                chunks = []
+            if spool is not None:
+                spool.write(chunk)
+            else:
+                chunks.append(chunk)
+    except BaseException:
+        if spool is not None:
+            spool.close()
+        raise
+    if spool is None:
+        return b''.join(chunks), None
+    spool.flush()
+    return mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ), spool
+
+
+
+_magic_numbers = [(b'%PDF-', 'pdf'),
+                  (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'msft'),    #doc, xls, ppt
+                  (b'\x89PNG', 'image'),
+                  (b'\xff\xd8\xff', 'image'),
+                  (b'GIF8', 'image'),
+                  (b'\x1f\x8b', 'archive')
+                  ]
+_html_markers = (b'<!doctype html', b'<html', b'<head', b'<body', b'<!--')
+_content_types = {'html': 'html',
+                  'application/pdf': 'pdf',
+                  'json': 'data', 'xml': 'data', 'csv': 'data', 'text/plain': 'data',
+                  'msword': 'msft', 'officedocument': 'msft', 'ms-excel': 'msft', 'ms-powerpoint': 'msft',
+                  'image/': 'image', 'audio/': 'media', 'video/': 'media', 'zip': 'archive'
+                  }
+
+def sniff_file_type(head, content_type=''):
+    """Type of a body from its first bytes, and its `content_type` when
+    they are not conclusive.  Returns a `url_type` ('html', 'pdf', 'data',
+    'msft') or 'image', 'media', 'archive', or None.
+
+    Usage::
+        >>> sniff_file_type(b'%PDF-1.7\n...', 'application/octet-stream')
+        'pdf'
+    """
+    start = head.lstrip(b'\xef\xbb\xbf \t\r\n')[:512]
+    if start.startswith(b'PK\x03\x04'):
+        return 'msft' if b'[Content_Types].xml' in head else 'archive'      #docx, xlsx, pptx are zips
+    for magic, file_type in _magic_numbers:
+        if start.startswith(magic):
+            return file_type
+    lowered = start.lower()
+    if lowered.startswith(b'<?xml'):
+        return 'html' if b'<html' in head.lower() else 'data'
+    if lowered.startswith(_html_markers):
+        return 'html'
+    #pdf allows junk before the header, within 1024 bytes, but not markup
+    position = head[:1024].find(b'%PDF-')
+    if position >= 0 and b'<' not in head[:position]:
+        return 'pdf'
+    if lowered[:1] in (b'{', b'['):
+        return 'data'
+    content_type = (content_type or '').lower()
+    for marker, file_type in _content_types.items():
+        if marker in content_type:
+            return file_type
+    return None
+
+
+
+class SniffStats:
+    """Downloads sniffed before reading their body, and those skipped, with
+    the bytes that were not downloaded (known from their content-length).
+
+    Usage::
+        >>> URL = UrlFactory()
+        >>> urls = URL.build_many(hrefs)
+        >>> URL.sniff_stats.dump()
+        {'sniffed': 12, 'skipped': 2, 'bytes_saved': 5302211, 'reasons': {'unsupported': 1, 'too_large': 1}}
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.sniffed = 0
+            self.skipped = 0
+            self.bytes_saved = 0
+            self.reasons = {}
+
+    def add(self, reason=None, bytes_saved=0):
+        """Count one sniffed download, skipped for `reason` if given."""
+        with self._lock:
+            self.sniffed += 1
+            if reason:
+                self.skipped += 1
+                self.bytes_saved += bytes_saved
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def dump(self):
+        with self._lock:
+            return {'sniffed': self.sniffed,
+                    'skipped': self.skipped,
+                    'bytes_saved': self.bytes_saved,
+                    'reasons': dict(self.reasons)
+                    }
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of requesting a host that keeps failing."""
+
+
+
+class _PooledAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter that adds the connection and request counts of each 
+    urllib3 pool to `counts` when the pool is discarded.
+
+    With a `config`, requests are also paced per hostname by `limiter`, 
+    idempotent requests that fail transiently (connection errors, timeouts,
+    429 and 5xx responses) are retried with jittered exponential backoff,
+    waiting at least as long as any `Retry-After`, and hosts that still 
+    fail are cut off for a while by `breaker`.
+    """
+
+    _retry_statuses = {429, 500, 502, 503, 504}
+    _retry_methods = {'GET', 'HEAD', 'OPTIONS'}
+
+    def __init__(self, counts, config=None, limiter=None, breaker=None, **kwargs):
+        self.counts = counts
+        self.factory_config = config        #HTTPAdapter has its own `config`
+        self.limiter = limiter
+        self.breaker = breaker
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if self.factory_config is None:
+            return super().send(request, **kwargs)
+        hostname = urllib.parse.urlsplit(request.url).hostname
+        if not self.breaker.allow(hostname):
+            raise CircuitOpenError(f'too many failures from host: {hostname}', request=request)
+        attempts = self.factory_config.URL_RETRY_ATTEMPTS if request.method in self._retry_methods else 1
+        for attempt in range(attempts):
+            self.limiter.acquire(hostname)
+            resp, error, retry_after = None, None, None
+            try:
+                resp = super().send(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            else:
+                if resp.status_code not in self._retry_statuses:
+                    self.breaker.record(hostname, True)
+                    return resp
+                retry_after = parse_retry_after(resp.headers.get('retry-after'))
+            if attempt + 1 == attempts:
+                break
+            if resp is not None:
+                resp.close()
+            self.counts['retries'] += 1
+            if retry_after is not None:
+                self.limiter.defer(hostname, min(retry_after, self.factory_config.URL_MAX_RETRY_AFTER_SEC))
+            else:
+                time.sleep(backoff_delay(attempt, self.factory_config.URL_BACKOFF_SEC, self.factory_config.URL_BACKOFF_MAX_SEC))
+        self.breaker.record(hostname, False)
+        if resp is not None:
+            return resp
+        raise error
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        pools = self.poolmanager.pools
+        dispose = pools.dispose_func
+
+        def retire(pool):
+            self.counts['connections'] += pool.num_connections
+            self.counts['requests'] += pool.num_requests
+            if dispose:
+                dispose(pool)
+            else:
+                pool.close()                #urllib3 1.x leaves discarded pools to gc
+        pools.dispose_func = retire
+
+    def get_counts(self):
+        """Counts of discarded pools plus those still open."""
+        counts = dict(self.counts)
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                counts['connections'] += pool.num_connections
+                counts['requests'] += pool.num_requests
+        return counts
+
 
 
 class UrlFactory:
     """Builder pattern with config.
     :param config: object of type EnteroConfig
+
+    All urls built by one factory share its session, which keeps up to 
+    `URL_POOL_SIZE` keep-alive connections for each of `URL_POOL_HOSTS` 
+    hosts.  Call `close()` when done.  With `config.cache_dir` they also 
+    share a ResponseCache.
+
+    Requests of the session are paced per hostname at `URL_RATE_PER_SEC` 
+    (or the rate for the host in `URL_HOST_RATES`), retried up to 
+    `URL_RETRY_ATTEMPTS` times on transient failures, and refused with 
+    CircuitOpenError for `URL_BREAKER_RESET_SEC` once a host has failed 
+    `URL_BREAKER_FAILURES` times in a row.
+
+    With `applySniffing`, the type of each download is decided from its 
+    first `SNIFF_SIZE` bytes, and unsupported or too large ones are closed 
+    without reading the rest; see `sniff_stats`.
+
+    With `applyRequestsRenderJs`, html pages are rendered by one long-lived
+    headless browser shared by the urls of the factory, see 
+    `browser.Renderer`.  Pass a `renderer` to use another, ie. FakeRenderer.
     
     Usage::
         >>> hrefs = ['https://www.jpmorgan.com']
         >>> URL = UrlFactory()
         >>> urls = [URL.build(url) for url in hrefs]
+        >>> urls = URL.build_many(hrefs)        #with artifacts, fetched concurrently
+        >>> URL.parse_many(hrefs)               #components only, for classifying many hrefs
+        [UrlComponents(url='https://www.jpmorgan.com', scheme='https://', hostname='www.jpmorgan.com', ...)]
+        >>> URL.dump()
+        {'requests': 1, 'connections': 1, 'reused': 0, 'retries': 0, 'throttled_secs': 0.0, 'rejected': 0}
+        >>> URL.close()
     """
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, renderer=None):
         if config:
             self.config = config
         else:
             self.config = ConfigObj
+        self._session = None
+        self._adapter = None
+        self._renderer = renderer
+        self._urls = weakref.WeakSet()
+        self._counts = {'connections': 0, 'requests': 0, 'retries': 0}
+        self.limiter = RateLimiter(rate=self.config.URL_RATE_PER_SEC,
+                                   capacity=self.config.URL_RATE_BURST,
+                                   rates=self.config.URL_HOST_RATES
+                                   )
+        self.breaker = CircuitBreaker(failures=self.config.URL_BREAKER_FAILURES,
+                                      reset_secs=self.config.URL_BREAKER_RESET_SEC
+                                      )
+        self.sniff_stats = SniffStats()
+        self._response_cache = None
+        self._owner_resolver = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def session(self):
+        """Session shared by the urls of this factory, created on first use."""
+        if self._session is None:
+            self._adapter = _PooledAdapter(self._counts,
+                                           config=self.config,
+                                           limiter=self.limiter,
+                                           breaker=self.breaker,
+                                           pool_connections=self.config.URL_POOL_HOSTS,
+                                           pool_maxsize=self.config.URL_POOL_SIZE
+                                           )
+            self._session = HTMLSession()
+            self._session.mount('http://', self._adapter)
+            self._session.mount('https://', self._adapter)
+        return self._session
+
+    @property
+    def response_cache(self):
+        """ResponseCache for `config.cache_dir`, or None when not configured."""
+        cache_dir = self.config.cache_dir
+        if not cache_dir:
+            return None
+        if self._response_cache is None or self._response_cache.store.directory != Path(cache_dir) / 'responses':
+            self._response_cache = ResponseCache(self.config)
+        return self._response_cache
+
+    @property
+    def owner_resolver(self):
+        """WhoisResolver shared by the urls of this factory."""
+        if self._owner_resolver is None:
+            self._owner_resolver = WhoisResolver(self.config)
+        return self._owner_resolver
+
+    @property
+    def renderer(self):
+        """Renderer of html pages shared by the urls of this factory; the 
+        browser is launched on the first render."""
+        if self._renderer is None:
+            self._renderer = ChromiumRenderer(self.config)
+        return self._renderer
+
+    def has_same_owners(self, base_url, urls):
+        """Compare the owner of `base_url` with that of each of `urls`,
+        looking the owners up together; see `WhoisResolver.has_same_owners()`.
+        """
+        return self.owner_resolver.has_same_owners(base_url, urls)
+
+    def close(self):
+        """Close the pooled connections and the browser, and release the 
+        spooled downloads of the urls built by this factory; a later request
+        opens a new pool, and a later render launches a new browser."""
+        for url in list(self._urls):
+            url.close()
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+            self._adapter = None
+        if self._renderer is not None:
+            self._renderer.close()
+
+    def dump(self):
+        """Requests made and connections opened by the shared session, 
+        with retries, seconds spent waiting on the rate limits and requests
+        refused by the circuit breaker."""
+        counts = self._adapter.get_counts() if self._adapter else dict(self._counts)
+        return {'requests': counts['requests'],
+                'connections': counts['connections'],
+                'reused': max(counts['requests'] - counts['connections'], 0),
+                'retries': counts['retries'],
+                'throttled_secs': self.limiter.dump()['waited_secs'],
+                'rejected': self.breaker.dump()['rejected']
+                }
 
     def build(self, url):
         """Build UniformResourceLocator objects from 
         url strings and the EnteroConfig.
         """
-        return UniformResourceLocator(
+        url = UniformResourceLocator(
             url,
             self.config.logger,
-            self.config.applyRequestsRenderJs
+            self.config.applyRequestsRenderJs,
+            html_parser=self.config.HTML_PARSER,
+            session=self.session,
+            response_cache=self.response_cache,
+            max_download_size=self.config.MAX_DOWNLOAD_SIZE,
+            spool_size=self.config.DOWNLOAD_SPOOL_SIZE,
+            owner_resolver=self.owner_resolver,
+            sniff_size=self.config.SNIFF_SIZE if self.config.applySniffing else None,
+            sniff_stats=self.sniff_stats,
+            renderer=self.renderer if self.config.applyRequestsRenderJs else None
             )
+        self._urls.add(url)
+        return url
+
+    def parse_many(self, hrefs):
+        """Normalize, parse and classify many url strings in one pass, 
+        without building UniformResourceLocator objects.  Returns the 
+        UrlComponents of each, see `parse_url()`.
+        """
+        return [parse_url(href.strip().lower()) for href in hrefs]
+
+    def build_many(self, hrefs):
+        """Build UniformResourceLocator objects and fetch all of their 
+        artifacts concurrently, see `fetch_many()`.  Spooled downloads stay
+        on disk until each url, or the factory, is closed.
+        """
+        urls = [self.build(href) for href in hrefs]
+        self.fetch_many(urls)
+        return urls
+
+    def fetch_many(self, urls):
+        """Populate the artifacts of many urls, as `get_file_artifact_()` 
+        does for one, and return their file formats.
+
+        Up to `URL_FETCH_WORKERS` requests run at once, and at most 
+        `URL_HOST_WORKERS` for any one hostname, over the factory's session.
+        Responses are validated and parsed afterwards, in the calling thread.
+        This runs its own event loop, so it cannot be called from a coroutine.
+        """
+        resps = asyncio.run(self._request_all(urls, self.session))
+        return [url.set_file_artifact_(resp) for url, resp in zip(urls, resps)]
+
+    async def _request_all(self, urls, session):
+        loop = asyncio.get_running_loop()
+        fetch_limit = asyncio.Semaphore(self.config.URL_FETCH_WORKERS)
+        host_limits = {}
+
+        async def request(url, executor):
+            hostname = url.get_hostname()
+            if hostname not in host_limits:
+                host_limits[hostname] = asyncio.Semaphore(self.config.URL_HOST_WORKERS)
+            #wait on the host before taking one of the shared slots
+            async with host_limits[hostname]:
+                async with fetch_limit:
+                    return await loop.run_in_executor(executor, url.request_artifact_, session, self.config.URL_FETCH_TIMEOUT_SEC)
+
+        with ThreadPoolExecutor(max_workers=self.config.URL_FETCH_WORKERS) as executor:
+            return await asyncio.gather(*[request(url, executor) for url in urls])
 
 
 
@@ -71,12 +474,22 @@ class UniformResourceLocator:
                           'data': ['json','jsonl','xml','csv','sql','txt'],
                           'msft': ['doc','ppt','xlsx']
                           }
-    _possible_suffixes_list = []
-
-    def __init__(self, url, logger, applyRequestsRenderJs):
+    _parsed_types = ['html', 'pdf']         #url_types with an artifact parser
+    def __init__(self, url, logger, applyRequestsRenderJs, html_parser='html.parser', session=None, response_cache=None,
+                 max_download_size=None, spool_size=2e+7, owner_resolver=None, sniff_size=None, sniff_stats=None,
+                 renderer=None):
         self.url = None
         self.logger = logger
         self.applyRequestsRenderJs = applyRequestsRenderJs
+        self.html_parser = get_html_parser(html_parser)
+        self.session = session          #shared by the urls of a UrlFactory
+        self.response_cache = response_cache
+        self.max_download_size = max_download_size
+        self.spool_size = spool_size
+        self.owner_resolver = owner_resolver
+        self.sniff_size = sniff_size
+        self.sniff_stats = sniff_stats
+        self.renderer = renderer
 
         if type(url) == str:
             self.url = url.lower()
@@ -100,11 +513,16 @@ class UniformResourceLocator:
 
         #artifacts
         self.file_type = ''             #from url content-type
+        self.sniffed_type = None        #from the first bytes of the body, see `sniff_file_type()`
         self.file_format = ''           #inferred from document
         self.file_str = ''              #document string
         self.file_document = ''         #document
         self.file_size_mb = ''
+        self.file_size_bytes = 0        #of the downloaded body
+        self.file_path = None           #temp file of a spooled download, see `request_artifact_()`
         self.file_visible_text = ''
+        self._spool = None
+        self._body = None
 
         self.run_checks()
 
@@ -125,10 +543,10 @@ class UniformResourceLocator:
             f'Length File: {len(self.file_str)}\n'
         )
     
-    def _populate_possible_suffixes_list(self):
-        self._possible_suffixes_list = []
-        for val in self._possible_suffixes.values():
-            self._possible_suffixes_list.extend(val)
+    @property
+    def components(self):
+        """Parsed components of the url, see `parse_url()`."""
+        return parse_url(self.url)
 
 
     #checks
@@ -141,39 +559,24 @@ class UniformResourceLocator:
 
     def check_scheme(self):
         """Check for valid scheme, populate `self.scheme`."""
-        check_scheme = [scheme in self.url for scheme in self._possible_schemes]
-        result = any(check_scheme)
+        result = bool(self.components.scheme)
         if result:
-            self.scheme = self._possible_schemes[check_scheme.index(True)]
+            self.scheme = self.components.scheme
         return result
 
     def check_suffix_and_url_type(self):
         """Check for suffixes that are possible to parse, 
         populate `self.suffix` and `self.url_type`.
         """
-        if not self._possible_suffixes_list:
-            self._populate_possible_suffixes_list()
-        result = ''
-        psl = tldextract.extract(self.url).suffix
-        split = self.url.split('.')
-        endpt = split[len(split)-1]
-        suffix = psl if (psl in endpt) else endpt
-
-        check_suffix = [suffix_val in suffix for suffix_val in self._possible_suffixes_list]
-        result = any(check_suffix)
+        result = bool(self.components.url_type)
         if result:
-            self.suffix = suffix
-            self.url_type = [k for k,v in self._possible_suffixes.items() if suffix in v][0]
+            self.suffix = self.components.suffix
+            self.url_type = self.components.url_type
         return result
 
     def check_valid_format(self):
         """Check if complete url is valid."""
-        try:
-            result = urllib.parse.urlparse(self.url)
-            if result:
-                return True
-        except:
-            return False
+        return self.components.valid
 
     
     #getters
@@ -189,7 +592,7 @@ class UniformResourceLocator:
         Network or system used to deliver a user to a certain address.
         schema: hostname = <www>.<internal_network>.<suffix>
         """
-        return urllib.parse.urlparse(self.url).hostname
+        return self.components.hostname
     
     def get_domain(self):
         """Get domain name.
@@ -197,7 +600,7 @@ class UniformResourceLocator:
         to ensure url is within same site.
         schema: <subdomain>.<domain>.<suffix>
         """
-        return tldextract.extract(self.url).domain
+        return self.components.domain
 
     def get_suffix(self):
         """Get actual suffix which might not align
@@ -208,6 +611,13 @@ class UniformResourceLocator:
         """Get actual suffix which might not align
         with PSL."""
         return self.scheme
+
+    def get_file_extension(self):
+        """Get the extension of the file downloaded: the suffix, unless
+        `sniffed_type` found another type behind it, ie. a pdf at `.html`."""
+        if self.sniffed_type and self.sniffed_type != self.url_type:
+            return self.sniffed_type
+        return self.get_suffix()
     
     def get_filename(self):
         """Get general file name.
@@ -217,9 +627,10 @@ class UniformResourceLocator:
         if self.filename and self.filename != '':
             return self.filename
         #check for existence
-        tmp = urllib.parse.urlparse(self.url).path.split('/')
+        file_type = self.sniffed_type if self.sniffed_type else self.url_type
+        tmp = self.components.path.split('/')
         if len(tmp) < 2 and self.get_suffix():
-            self.filename = f'{self.get_domain()}.{self.url_type}'
+            self.filename = f'{self.get_domain()}.{file_type}'
             return self.filename
         elif not self.get_suffix():
             return None
@@ -232,19 +643,19 @@ class UniformResourceLocator:
                 pass
         if not stem:
             try:
-                tmp = urllib.parse.urlparse(self.url).path.split('/')
+                tmp = self.components.path.split('/')
                 if len(tmp) > 1:
                     stem = tmp[len(tmp)-1]
             except:
                 pass
         if stem:
-            self.filename = f'{stem}.{self.url_type}'
+            self.filename = f'{stem}.{file_type}'
         else:
             self.filename = None
         return self.filename
     
     def get_subdomain(self):
-        return tldextract.extract(self.url).subdomain
+        return self.components.subdomain
 
     def get_domain_with_suffix(self):
         return f'{self.get_domain()}.{self.suffix}'
@@ -272,61 +683,53 @@ class UniformResourceLocator:
         return True
     
     def get_owner_(self):
-        """Request the owner from ICANN WHOIS.
-
-        Without 1sec delay ICANN will reject the request.  However, there
-        are continued difficulties with not getting the owner.
-        TODO:replace python-whois with custom lib that can: 
-            - parse owner from text
-            - improve error handling (too many errors)
+        """Request the owner from ICANN WHOIS, through the `owner_resolver`
+        of its UrlFactory, which caches owners by registered domain and 
+        paces requests so ICANN does not reject them.
         """
-        ATTEMPTS = 2
-
-        def request_iteration():
-            try:
-                self.whois_account = whois.whois(self.url)
-                self.owner = self.whois_account.text.split('Organization:')[1].split('\n')[0].strip()
-            except:
-                self.logger.error(f'ICANN WHOIS gave no response for url: `{self.url}`')
-            time.sleep(1)
-            return self.owner
-
-        while ATTEMPTS > 0:
-            if not self.owner:
-                request_iteration()
-            ATTEMPTS =- 1
-            
+        if not self.owner:
+            self.owner = self._get_owner_resolver().get_owner(self.url)
         return self.owner
+
+    def _get_owner_resolver(self):
+        return self.owner_resolver if self.owner_resolver else _get_default_url_factory().owner_resolver
     
     def has_same_url_owner_(self, comparison_url):
-        """Compare this url owner with another url's owner."""
-        if not type(comparison_url) == UniformResourceLocator:
-            Url = UrlFactory()
-            ComparisonUrl = Url.build(comparison_url)
+        """Compare this url owner with another url's owner.
+
+        A str `comparison_url` is not requested: its owner is looked up 
+        with this url's `owner_resolver`, under the same pacing and cache.
+        To compare many urls with one, use `UrlFactory.has_same_owners()`.
+        """
+        if type(comparison_url) == UniformResourceLocator:
+            comparison_href = comparison_url.url
+            comparison_domain = comparison_url.get_domain()
         else:
-            ComparisonUrl = comparison_url
+            comparison_href = comparison_url
+            comparison_domain = parse_url(comparison_url).domain
 
         #case-1: check domains
-        if self.get_domain() == comparison_url.get_domain():
+        if self.get_domain() == comparison_domain:
             result = True
             return result
 
         #case-2: check icann owners
-        if not self.owner:
-            self.get_owner_()
-        if not ComparisonUrl.owner:
-            ComparisonUrl.get_owner_()
+        self.get_owner_()
+        if type(comparison_url) == UniformResourceLocator:
+            comparison_owner = comparison_url.get_owner_()
+        else:
+            comparison_owner = self._get_owner_resolver().get_owner(comparison_href)
 
-        if self.owner and ComparisonUrl.owner:
-            result = self.owner == ComparisonUrl.owner
+        if self.owner and comparison_owner:
+            result = self.owner == comparison_owner
         else:
             result = False
         if not result:
             self.logger.info(f'WARNING: Different Owners:\n'
                         f'current url: `{self.url}`'
                         f'    owner [{self.owner}]\n' 
-                        f'comparison url: `{comparison_url.url}`' 
-                        f'    owner [{comparison_url.owner}]'
+                        f'comparison url: `{comparison_href}`' 
+                        f'    owner [{comparison_owner}]'
                         )
         return result
     
@@ -345,149 +748,324 @@ class UniformResourceLocator:
         note: Failing to parse the file will provision with a None.  This is used
         over empty string ('') to document that parsing was attempted.
         """
-        def _get_artifact():
-            """Get url artifact and verify self.url_type is correct."""
-            resp = None
-            try:
-                session = HTMLSession()
-                resp = session.get(self.url)
-                if resp.status_code == 200:
-                    content_type = resp.headers.get('content-type')
-                    self.file_type = content_type
-                    if 'text/html' in content_type:
-                        if self.url_type != 'html':
-                            self.logger.error('ERROR: `self.url_type` does not match content-type')  
-                            raise Exception
-                        if self.applyRequestsRenderJs:
-                            resp.html.render()
-                            txt = resp.html.text
-                        else:
-                            txt = resp.text
-                        if len(txt) < 100:
-                            self.logger.error('ERROR: HTML content length is insignificant')  
-                            raise Exception
-                        self.file_str = txt
-                    elif 'application/pdf' in content_type:
-                        if self.url_type != 'pdf':
-                            self.logger.error('ERROR: `self.url_type` does not match content-type') 
-                            raise Exception
-                        bytes = resp.content
-                        if len(bytes) < 100:
-                            self.logger.error('ERROR: PDF content length is insignificant')  
-                            raise Exception
-                        self.file_str = bytes        #output as bytes for binary file (PDF file, audio, image, etc.)
-                    else:
-                        self.logger.error(f'ERROR: unaddressed content-type: {content_type}')
-                        raise Exception
+        resp = self.request_artifact_()
+        return self.set_file_artifact_(resp)
+
+    def request_artifact_(self, session=None, timeout=None):
+        """Request the url with `session`, else the session of its UrlFactory, 
+        else a new one, through the `response_cache` when there is one.  
+        Returns the response, or None if the request failed.
+
+        The body is streamed, and the download is abandoned once it is larger
+        than `max_download_size`.  Binary bodies larger than `spool_size` are 
+        kept in a temp file at `self.file_path` and used through a memory 
+        map, rather than read into memory; they are not added to the response cache.
+
+        With a `sniff_size`, the first bytes are read ahead to decide the 
+        `sniffed_type`, and downloads of unsupported types are closed without
+        reading the rest, see `_sniff()`.
+        """
+        try:
+            session = session or self.session or HTMLSession()
+            if self.response_cache:
+                resp = self.response_cache.request(session, self.url, timeout=timeout)
+            else:
+                resp = session.get(self.url, timeout=timeout, stream=True)
+            if getattr(resp, 'from_cache', False):
+                self._body = resp.content
+                if self.sniff_size:
+                    self.sniffed_type = sniff_file_type(self._body[:int(self.sniff_size)], resp.headers.get('content-type'))
+            else:
+                head = b''
+                if self.sniff_size and resp.status_code == 200:
+                    head = resp.raw.read(int(self.sniff_size), decode_content=True)
+                    if not self._sniff(resp, head):
+                        resp.close()
+                        return None
+                if self.sniffed_type:
+                    binary = self.sniffed_type != 'html'
                 else:
-                    self.logger.error(f'ERROR: when requesting url, got status-code: {resp.status_code}')
-                    raise Exception
-            except Exception:
-                self.logger.error(f'ERROR: in request for url: {self.url}')
+                    binary = 'text/' not in resp.headers.get('content-type', '')
+                self._body, self._spool = _read_body(resp,
+                                                     max_size=self.max_download_size,
+                                                     spool_size=self.spool_size if binary else None,
+                                                     head=head
+                                                     )
+                if self._spool is None:
+                    resp._content = self._body
+                    if self.response_cache:
+                        self.response_cache.add(self.url, resp)
+                else:
+                    self.file_path = self._spool.name
+            self.file_size_bytes = len(self._body)
             return resp
+        except DownloadTooLarge as e:
+            self.logger.error(f'ERROR: download too large for url: {self.url}, {e}')
+            return None
+        except CircuitOpenError as e:
+            self.logger.error(f'ERROR: host skipped for url: {self.url}, {e}')
+            return None
+        except Exception as e:
+            self.logger.error(f'ERROR: in request for url: {self.url}, {type(e).__name__}: {e}')
+            return None
+
+    def _sniff(self, resp, head):
+        """Decide `self.sniffed_type` from the `head` of a download.  Return 
+        False, counting the bytes not downloaded, if it is too large or of a 
+        type that cannot be parsed."""
+        self.sniffed_type = sniff_file_type(head, resp.headers.get('content-type'))
+        length = resp.headers.get('content-length', '')
+        length = int(length) if length.isdigit() else None
+        reason = None
+        if self.max_download_size and length and length > self.max_download_size:
+            reason = 'too_large'
+        elif self.sniffed_type not in self._parsed_types:
+            reason = 'unsupported'
+        if self.sniff_stats:
+            self.sniff_stats.add(reason, max(length - len(head), 0) if reason and length else 0)
+        if reason:
+            self.logger.info(f'skipped download of url: {self.url}, {reason} '
+                             f'(type: {self.sniffed_type or resp.headers.get("content-type")}, content-length: {length})')
+        return reason is None
+
+    def close(self):
+        """Release the temp file of a spooled download."""
+        body, self._body = self._body, None
+        if isinstance(body, mmap.mmap):
+            try:
+                body.close()
+            except BufferError:
+                #the pdf reader still holds a view; left to gc
+                pass
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+            self.file_path = None
+
+    def set_file_artifact_(self, resp):
+        """Verify the response from `request_artifact_()` against 
+        `self.url_type`, then parse it and provision the file attributes.
+        """
+        self._check_response(resp)
+        return self._parse_artifact_from_suffix(resp)
+
+    def _check_response(self, resp):
+        """Check the response and populate `self.file_type` and `self.file_str`.
 
-        def _parse_artifact_from_suffix(resp):
-            """Parese file and provision file attributes."""
-            result = ''
-            #html
-            if resp and self.url_type == 'html':
-                try: 
-                    soup = bs4.BeautifulSoup(self.file_str, 'html.parser')
-                    if soup:
-                        result = 'html'
-                        self.file_format = result
-                        self.file_document = soup
-                except:
-                    self.logger.error(f'ERROR: file for url {self.url} is invalid HTML')
-                    result = None
-            #pdf
-            elif resp and self.url_type == 'pdf':
-                try:
-                    file_stream = io.BytesIO(self.file_str)
-                    pdf_file = pypdf.PdfReader(file_stream)     #purpose:to validate pdf format
-                    if pdf_file:
-                        result = 'pdf'
-                        self.file_format = result
-                        self.file_document = pdf_file
-                    else:
+        A `sniffed_type` is trusted over both the content-type and the 
+        `url_type` guessed from the suffix.
+        """
+        if resp is None:
+            return
+        try:
+            if resp.status_code == 200:
+                content_type = resp.headers.get('content-type', '')
+                self.file_type = content_type
+                if self.sniffed_type:
+                    file_type, url_type = self.sniffed_type, self.sniffed_type
+                elif 'text/html' in content_type:
+                    file_type, url_type = 'html', self.url_type
+                elif 'application/pdf' in content_type:
+                    file_type, url_type = 'pdf', self.url_type
+                else:
+                    file_type, url_type = None, self.url_type
+                if file_type == 'html':
+                    if url_type != 'html':
+                        self.logger.error('ERROR: `self.url_type` does not match content-type')  
+                        raise Exception
+                    txt = resp.text
+                    if self.applyRequestsRenderJs:
+                        txt = self.render_(txt)
+                    if len(txt) < 100:
+                        self.logger.error('ERROR: HTML content length is insignificant')  
+                        raise Exception
+                    self.file_str = txt
+                elif file_type == 'pdf':
+                    if url_type != 'pdf':
+                        self.logger.error('ERROR: `self.url_type` does not match content-type') 
                         raise Exception
-                except Exception:    #pypdf.errors.PdfReadError:
-                    self.logger.error(f'ERROR: file for url {resp.url} is invalid PDF')
-                    result = None
-            #if no url (no file)
+                    bytes = self._body if self._body is not None else resp.content
+                    if len(bytes) < 100:
+                        self.logger.error('ERROR: PDF content length is insignificant')  
+                        raise Exception
+                    self.file_str = bytes        #output as bytes for binary file (PDF file, audio, image, etc.), or mmap when spooled
+                else:
+                    self.logger.error(f'ERROR: unaddressed content-type: {content_type}')
+                    raise Exception
             else:
-                result = None
-                self.file_format = result
-                self.file_document = result
-            size_in_mb = int( sys.getsizeof(self.file_document) )  * 1e-6
-            self.file_size_mb = round(size_in_mb, ndigits=3)
-            return result
-        
-        #workflow
+                self.logger.error(f'ERROR: when requesting url, got status-code: {resp.status_code}')
+                raise Exception
+        except Exception:
+            self.logger.error(f'ERROR: in request for url: {self.url}')
+
+    def render_(self, html_str):
+        """Run the scripts of the downloaded html with the `renderer` of 
+        its UrlFactory, and return the rendered html; the downloaded html 
+        if rendering fails."""
+        renderer = self.renderer if self.renderer else _get_default_url_factory().renderer
+        try:
+            return renderer.render(self.url, html=html_str)
+        except Exception as e:
+            self.logger.error(f'ERROR: rendering failed for url: {self.url}, {type(e).__name__}: {e}')
+            return html_str
+
+    def _parse_artifact_from_suffix(self, resp):
+        """Parese file and provision file attributes."""
         result = ''
-        resp = _get_artifact()
-        result = _parse_artifact_from_suffix(resp)
-        time.sleep(1)
+        url_type = self.sniffed_type or self.url_type
+        #html
+        if resp and url_type == 'html':
+            try: 
+                soup = bs4.BeautifulSoup(self.file_str, self.html_parser)
+                if soup:
+                    result = 'html'
+                    self.file_format = result
+                    self.file_document = soup
+            except:
+                self.logger.error(f'ERROR: file for url {self.url} is invalid HTML')
+                result = None
+        #pdf
+        elif resp and url_type == 'pdf':
+            try:
+                file_stream = BufferReader(self.file_str)
+                pdf_file = pypdf.PdfReader(file_stream)     #purpose:to validate pdf format
+                if pdf_file:
+                    result = 'pdf'
+                    self.file_format = result
+                    self.file_document = pdf_file
+                else:
+                    raise Exception
+            except Exception:    #pypdf.errors.PdfReadError:
+                self.logger.error(f'ERROR: file for url {resp.url} is invalid PDF')
+                result = None
+        #if no url (no file)
+        else:
+            result = None
+            self.file_format = result
+            self.file_document = result
+        size_in_mb = self.file_size_bytes * 1e-6
+        self.file_size_mb = round(size_in_mb, ndigits=3)
         return result
     
     def get_hrefs_under_criteria_(self):
-        """Get all anchors from a `resp.text` html file under 
-        specific criterion.
+        """Get all anchors (`<a>` elements) from the html document."""
+        anchors = []
+        if self.file_document and self.file_format == 'html':
+            soup = self.file_document
+            anchors = soup.find_all('a')
+        return anchors
+
+    def get_canonical_hrefs_(self):
+        """Get the hrefs of all anchors in the html document, canonicalized
+        against the url (see `canonicalize_url()`), in order and without 
+        duplicates, leaving out sign-in and login links.
         """
         REMOVE = ['sign','login']
 
-        anchors_with_stem = None
-        if self.file_document and self.url_type == 'html':
-            tmp =  self.get_hostname()     #urllib.parse.urlparse(resp.url).hostname    #Path(resp.url).stem.split('.')
-            #stem = tmp[len(tmp)-1] if len(tmp) > 1 else tmp[0]
-            soup = self.file_document
+        hrefs = []
+        for anchor in self.get_hrefs_under_criteria_():
+            href = canonicalize_url(anchor['href'], self.url) if anchor.has_attr('href') else None
+            if href and not any(x in href for x in REMOVE):
+                hrefs.append(href)
+        return list(dict.fromkeys(hrefs))
 
-            #anchors
-            anchors = soup.find_all('a')
-            """
-            anchors_with_hrefs = [anchor for anchor in anchors if anchor.has_attr('href')]
-            anchors_with_www_hrefs = [anchor for anchor in anchors_with_hrefs if 'https://' in anchor['href']]
-            anchors_without_removed = [anchor for anchor in anchors_with_www_hrefs 
-                                       if not any(x in anchor['href'].lower() for x in REMOVE)
-                                       ]
-            anchors_with_stem = list(set([anchor['href'] for anchor in anchors_without_removed if stem in anchor['href']]))
-            """
-        return anchors    #_with_stem
-
-    def get_hrefs_within_hostname_(self, searched_hrefs=set(), additional_scope=[]):
-        """Get hrefs from html document that are within the scope of target hostnames.
-
-        TODO: add additional_scope
+    def get_hrefs_within_hostname_(self, searched_hrefs=None, additional_scope=None):
+        """Get anchors from html document whose canonical hrefs are not in 
+        `searched_hrefs` and are within the scope of target hostnames: the 
+        url's own, and those in `additional_scope`.
         """
-        hrefs = []
+        searched_hrefs = searched_hrefs if searched_hrefs is not None else set()
+        hostnames = {self.get_hostname()}
+        hostnames.update(additional_scope if additional_scope else [])
+        anchors = []
         #pre-checks
         if not (self.file_document or self.file_format):
             self.get_file_artifact_()
 
         #checks
         if (self.file_document and self.file_format == 'html'):
-            tmp_hrefs = self.get_hrefs_under_criteria_()
-            hrefs = [href for href in tmp_hrefs if href not in searched_hrefs]
-
-        return hrefs
+            for anchor in self.get_hrefs_under_criteria_():
+                href = canonicalize_url(anchor['href'], self.url) if anchor.has_attr('href') else None
+                if href and href not in searched_hrefs and parse_url(href).hostname in hostnames:
+                    anchors.append(anchor)
+        return anchors
 
     def get_visible_text_(self):
-        """Get visible text from html.
-
-        ref: https://stackoverflow.com/questions/1936466/how-to-scrape-only-visible-webpage-text-with-beautifulsoup
+        """Get visible text from html, without the script, style and head 
+        subtrees; see `utils.get_visible_text()`.
         """
-        def tag_visible(element):
-            if element.parent.name in ['style', 'script', 'head', 'title', 'meta', '[document]']:
-                return False
-            if isinstance(element, bs4.element.Comment):
-                return False
-            return True
-
-        if self.file_document and self.url_type == 'html':
-            soup = self.file_document
-            texts = soup.findAll(text=True)
-            visible_texts = filter(tag_visible, texts)
-            self.file_visible_text = visible_texts
-            return u" ".join(t.strip() for t in visible_texts)
+        if self.file_document and self.file_format == 'html':
+            self.file_visible_text = get_visible_text(self.file_document)
+            return self.file_visible_text
         else:
-            return False
\ No newline at end of file
+            return False
+
+
+UrlComponents = namedtuple('UrlComponents', ['url', 'scheme', 'hostname', 'subdomain', 'domain', 'registered_domain',
+                                             'suffix', 'url_type', 'path', 'valid'])
+
+
+def canonicalize_url(href, base_url=None):
+    """Absolute, canonical form of an href, or None when it is not http(s).
+
+    Relative hrefs are resolved against `base_url`.  The url is lower-cased,
+    as UniformResourceLocator does, and the fragment, default port and a 
+    bare trailing '/' are dropped, so one page has one url.
+    """
+    try:
+        href = href.strip()
+        url = urllib.parse.urljoin(base_url, href) if base_url else href
+        parsed = urllib.parse.urlparse(url.lower())
+        port = parsed.port
+    except ValueError:
+        return None
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return None
+    netloc = parsed.hostname
+    if port and (parsed.scheme, port) not in (('http', 80), ('https', 443)):
+        netloc = f'{netloc}:{port}'
+    path = parsed.path if parsed.path != '/' else ''
+    return urllib.parse.urlunparse((parsed.scheme, netloc, path, parsed.params, parsed.query, ''))
+
+
+@functools.lru_cache(maxsize=1 << 17)
+def parse_url(url):
+    """Components of a url string, computed once per url and shared by all
+    UniformResourceLocator objects and `UrlFactory.parse_many()`.
+
+    The domain parts come from the public suffix list snapshot bundled with
+    tldextract.  `scheme`, `suffix` and `url_type` follow the checks of 
+    UniformResourceLocator: the suffix is the public suffix when it ends the
+    url, else the text after the last '.', and the `url_type` is that of the 
+    first of `_possible_suffixes` found in it.  Hosts without a public 
+    suffix (ip addresses, localhost) take it from the path.
+    """
+    try:
+        parsed = urllib.parse.urlparse(url)
+        hostname, path, valid = parsed.hostname, parsed.path, True
+    except ValueError:
+        hostname, path, valid = None, '', False
+    parts = tld_extract(url)
+    scheme = next((scheme for scheme in UniformResourceLocator._possible_schemes if scheme in url), '')
+    endpt = url.split('.')[-1]
+    suffix = parts.suffix if (parts.suffix in endpt) else endpt
+    if not parts.suffix:
+        suffix = Path(path).suffix[1:]
+    url_type = next((url_type for url_type, values in UniformResourceLocator._possible_suffixes.items()
+                     for value in values if value in suffix), '')
+    registered_domain = f'{parts.domain}.{parts.suffix}' if parts.suffix else parts.domain
+    return UrlComponents(url, scheme, hostname, parts.subdomain, parts.domain, registered_domain,
+                         suffix if url_type else '', url_type, path, valid)
+
+
+_DefaultUrlFactory = None           #resolves owners, and renders, for urls built without a factory
+_default_url_factory_lock = threading.Lock()
+
+
+def _get_default_url_factory():
+    """The UrlFactory shared by urls built without one, made on first use."""
+    global _DefaultUrlFactory
+    with _default_url_factory_lock:
+        if _DefaultUrlFactory is None:
+            _DefaultUrlFactory = UrlFactory()
+        return _DefaultUrlFactory
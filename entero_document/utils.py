@@ -6,8 +6,14 @@ __author__ = "Jason Beach"
 __version__ = "0.1.0"
 __license__ = "MIT"
 
+import bs4
+import tldextract
 
-import signal
+import contextvars
+import multiprocessing
+import threading
+import time
+import io
 
 
 class dotdict(dict):
@@ -19,25 +25,207 @@ class dotdict(dict):
     __delattr__ = dict.__delitem__
 
 
+#public suffix list snapshot bundled with tldextract, so parsing urls makes no requests
+tld_extract = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None)
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only, seekable file object over a bytes-like buffer (bytes, mmap).
+
+    `io.BytesIO` copies a memoryview or mmap when created.  This reads only
+    the requested slices, so several readers can share one buffer with 
+    their own positions.  Close readers before closing an underlying mmap.
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        data = bytes(self._view[self._pos:end])
+        self._pos = max(self._pos, end)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = len(self._view) + offset
+        else:
+            raise ValueError(f'invalid whence: {whence}')
+        if pos < 0:
+            raise ValueError(f'negative seek position: {pos}')
+        self._pos = pos
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+_timeouts = contextvars.ContextVar('entero_timeouts', default=())
+
+
 class timeout:
-  """Timeout function after duration of seconds
-  
-  This uses `signal` and so is only useable on linux.
-  
+  """Deadline for a block of work, usable from any thread and nestable.
+
+  Unlike the previous `signal.SIGALRM` version this works outside the main 
+  thread and leaves other alarms alone.  Deadlines are kept per thread (via
+  contextvars); a nested timeout can shorten, but never extend, the one 
+  around it.  Work is stopped cooperatively: loops call `check_timeout()`, 
+  which raises TimeoutError once any enclosing deadline has passed.  Single
+  long library calls should go through `run_with_timeout()`.
+
   Usage:
   with timeout(seconds=3):
-    time.sleep(4)
+    for page in pages:
+      check_timeout()
+      ...
   """
   def __init__(self, seconds=1, error_message='Timeout'):
         self.seconds = seconds
         self.error_message = error_message
-  def handle_timeout(self, signum, frame):
-        raise TimeoutError(self.error_message)
+        self.deadline = None
+        self.cancelled = False
+        self._token = None
+  def remaining(self):
+        if self.cancelled:
+            return 0.0
+        return max(self.deadline - time.monotonic(), 0.0)
+  def expired(self):
+        return self.cancelled or time.monotonic() >= self.deadline
+  def cancel(self):
+        """Expire now, ie. to stop work that has been abandoned."""
+        self.cancelled = True
   def __enter__(self):
-        signal.signal(signal.SIGALRM, self.handle_timeout)
-        signal.alarm(self.seconds)
+        self.deadline = time.monotonic() + self.seconds
+        enclosing = _timeouts.get()
+        if enclosing:
+            self.deadline = min(self.deadline, enclosing[-1].deadline)
+        self._token = _timeouts.set(enclosing + (self,))
+        return self
   def __exit__(self, type, value, traceback):
-        signal.alarm(0)
+        _timeouts.reset(self._token)
+        self._token = None
+
+
+def check_timeout():
+    """Raise TimeoutError if an enclosing `timeout` has expired or been cancelled."""
+    for deadline in _timeouts.get():
+        if deadline.expired():
+            raise TimeoutError(deadline.error_message)
+
+
+def remaining_time():
+    """Seconds left before the nearest enclosing `timeout`, None if there is none."""
+    enclosing = _timeouts.get()
+    if not enclosing:
+        return None
+    return min(deadline.remaining() for deadline in enclosing)
+
+
+def _run_in_process_target(conn, func, args, kwargs):
+    try:
+        conn.send((True, func(*args, **kwargs)))
+    except BaseException as e:
+        try:
+            conn.send((False, e))
+        except Exception:
+            #the error cannot be pickled
+            conn.send((False, RuntimeError(f'{type(e).__name__}: {e}')))
+    finally:
+        conn.close()
+
+
+def get_spawn_context():
+    """Multiprocessing context that does not fork the calling process: 
+    forkserver where available, else spawn."""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def run_with_timeout(func, *args, seconds=None, use_process=False, **kwargs):
+    """Call `func(*args, **kwargs)`, giving up after `seconds` or the nearest 
+    enclosing `timeout`, whichever is sooner, with TimeoutError.
+
+    By default the call runs in a daemon thread.  On timeout the caller 
+    returns at once and the thread is abandoned with its deadline cancelled,
+    so any `check_timeout()` inside it stops it early; library code without
+    such checks runs on to its end.  With `use_process` the call runs in a
+    child process, started with forkserver or spawn (forking a process with
+    other threads running can deadlock on the locks they hold), which is 
+    terminated on timeout; `func`, its arguments and result must then be 
+    picklable.  A child process cannot be started from a daemonic process,
+    ie. a `multiprocessing.Pool` worker.  For repeated calls, prefer a 
+    persistent worker as `PdfExtracts.get_pdf_title()` does.
+    """
+    limit = seconds
+    remaining = remaining_time()
+    if remaining is not None:
+        limit = remaining if limit is None else min(limit, remaining)
+    if limit is None:
+        return func(*args, **kwargs)
+
+    if use_process:
+        mp = get_spawn_context()
+        parent_conn, child_conn = mp.Pipe(duplex=False)
+        proc = mp.Process(target=_run_in_process_target, 
+                          args=(child_conn, func, args, kwargs), 
+                          daemon=True
+                          )
+        proc.start()
+        child_conn.close()
+        try:
+            if not parent_conn.poll(limit):
+                proc.terminate()
+                raise TimeoutError(f'{getattr(func, "__name__", func)} took more than {limit}sec')
+            try:
+                ok, value = parent_conn.recv()
+            except EOFError:
+                proc.join()
+                raise ChildProcessError(f'{getattr(func, "__name__", func)} exited with code {proc.exitcode} and no result')
+        finally:
+            proc.join()
+            parent_conn.close()
+        if not ok:
+            raise value
+        return value
+
+    result = {}
+    job = timeout(seconds=limit, error_message=f'{getattr(func, "__name__", func)} took more than {limit}sec')
+    def target():
+        with job:
+            try:
+                result['value'] = func(*args, **kwargs)
+            except BaseException as e:
+                result['error'] = e
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True)
+    thread.start()
+    thread.join(limit)
+    if thread.is_alive():
+        job.cancel()
+        raise TimeoutError(job.error_message)
+    if 'error' in result:
+        raise result['error']
+    return result['value']
 
 
 def load_svg(filepath):
@@ -59,4 +247,76 @@ def get_clean_text(txt):
         txts = [txt.replace('-\n','').replace('\n',' ') for txt in txts]
         return txts
     else:
-        return txt
\ No newline at end of file
+        return txt
+
+
+def iter_within_budget(items, max_chars=None, max_bytes=None):
+    """Pass through `(key, text)` items, ie. pages, as `(key, text, truncated)`
+    until the texts reach `max_chars` characters or `max_bytes` utf-8 bytes.
+
+    The text that crosses the budget is cut to fit and yielded with 
+    `truncated` True, then iteration stops, so no further items are read.
+    """
+    total_chars = 0
+    total_bytes = 0
+    for key, text in items:
+        truncated = False
+        if max_chars and total_chars + len(text) > max_chars:
+            text = text[:int(max_chars - total_chars)]
+            truncated = True
+        if max_bytes:
+            encoded = text.encode('utf-8')
+            if total_bytes + len(encoded) > max_bytes:
+                text = encoded[:int(max_bytes - total_bytes)].decode('utf-8', errors='ignore')
+                encoded = text.encode('utf-8')
+                truncated = True
+            total_bytes += len(encoded)
+        total_chars += len(text)
+        yield key, text, truncated
+        if truncated:
+            break
+
+
+def get_html_parser(name):
+    """BeautifulSoup tree builder `name` ('lxml', 'html5lib', 'html.parser')
+    when it is installed, else the built-in 'html.parser'."""
+    if name and bs4.builder.builder_registry.lookup(name):
+        return name
+    return 'html.parser'
+
+
+def iter_visible(root, invisible_tags):
+    """Yield the tags and strings under `root` in document order.
+
+    Subtrees of `invisible_tags` are pruned, rather than every string 
+    being checked afterwards; comments, doctypes and the like are skipped.
+    The tree is not modified.
+    """
+    stack = [iter(root.contents)]
+    while stack:
+        for element in stack[-1]:
+            if isinstance(element, bs4.element.Tag):
+                if element.name in invisible_tags:
+                    continue
+                yield element
+                stack.append(iter(element.contents))
+                break
+            elif type(element) in (bs4.element.NavigableString, bs4.element.CData):
+                yield element
+        else:
+            stack.pop()
+
+
+_invisible_text_tags = {'head', 'title', 'meta', 'script', 'style', 'noscript', 'template'}
+
+
+def get_visible_text(soup):
+    """Visible text of a BeautifulSoup tree, with its strings joined by spaces."""
+    texts = []
+    for element in iter_visible(soup, _invisible_text_tags):
+        if isinstance(element, bs4.element.Tag) or element.parent is soup:
+            continue
+        text = element.strip()
+        if text:
+            texts.append(text)
+    return ' '.join(texts)
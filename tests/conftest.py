@@ -0,0 +1,43 @@
+"""
+Fixtures shared by the tests
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import functools
+import threading
+import pytest
+
+
+
+class _QuietServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        pass                                                    #clients closing skipped downloads
+
+
+@pytest.fixture
+def local_server():
+    """Start http servers on free ports of 127.0.0.1, shut down after the test.
+
+    Usage::
+        base_url = local_server(tmp_path)                       #serve the files of a directory
+        base_url = local_server(tmp_path, handler=Handler)      #with a SimpleHTTPRequestHandler subclass
+        base_url = local_server(handler=Handler)                #or any request handler
+        'http://127.0.0.1:40123'
+    """
+    servers = []
+    def start(directory=None, handler=SimpleHTTPRequestHandler):
+        quiet = type(handler.__name__, (handler,), {'log_message': lambda self, *args: None})
+        if directory is not None:
+            quiet = functools.partial(quiet, directory=str(directory))
+        server = _QuietServer(('127.0.0.1', 0), quiet)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,80 @@
+"""
+Tests for Renderer scheduling, with FakeRenderer
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from entero_document.browser import FakeRenderer
+from entero_document.url import UrlFactory
+from entero_document.config import EnteroConfig
+
+from concurrent.futures import ThreadPoolExecutor
+import time
+import pytest
+
+
+html_str = '<html><head><title>Page</title></head><body><p>' + 'text '*50 + '</p></body></html>'
+
+
+def test_renderer_tabs_and_recycling():
+    config = EnteroConfig(apply_logger=False)
+    config.BROWSER_MAX_TABS = 2
+    config.BROWSER_RECYCLE_PAGES = 3
+    hrefs = [f'https://www.example.com/page{idx}.html' for idx in range(8)]
+    Browser = FakeRenderer(config, delay=0.1, pages={href: html_str for href in hrefs}, launch_secs=0.05)
+    try:
+        time0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(Browser.render, hrefs))
+        elapsed = time.perf_counter() - time0
+        stats = Browser.dump()
+    finally:
+        Browser.close()
+    check1 = results == [html_str] * 8 and elapsed > 0.4                #at least 4 rounds of 2 tabs
+    check2 = stats['rendered'] == 8 and stats['max_tabs'] == 2 and stats['mean_secs'] >= 0.1
+    check3 = stats['launches'] == 3 and stats['recycled'] == 2 and Browser.closed == [0, 1, 2]
+    assert all([check1, check2, check3])
+
+
+def test_renderer_timeout_and_failure():
+    config = EnteroConfig(apply_logger=False)
+    config.BROWSER_RENDER_TIMEOUT_SEC = 0.2
+    Browser = FakeRenderer(config, pages={'https://a.com': html_str, 'https://slow.com': html_str},
+                           delays={'https://slow.com': 5})
+    try:
+        check1 = Browser.render('https://a.com') == html_str
+        with pytest.raises(TimeoutError):
+            Browser.render('https://slow.com')
+        check2 = Browser.dump()['timed_out'] == 1 and Browser.dump()['launches'] == 1
+        with pytest.raises(ConnectionError):
+            Browser.render('https://missing.com')
+        check3 = Browser.render('https://b.com', html=html_str) == html_str            #on a new browser
+        stats = Browser.dump()
+    finally:
+        Browser.close()
+    check4 = stats['rendered'] == 2 and stats['timed_out'] == 1 and stats['failed'] == 1
+    check5 = stats['launches'] == 2 and stats['recycled'] == 1
+    assert all([check1, check2, check3, check4, check5])
+
+
+def test_url_factory_renders_with_shared_renderer(tmp_path, local_server):
+    for idx in range(3):
+        (tmp_path / f'page{idx}.html').write_text(html_str)
+    base_url = local_server(tmp_path)
+    hrefs = [f'{base_url}/page{idx}.html' for idx in range(3)]
+
+    config = EnteroConfig(apply_logger=False)
+    config.applyRequestsRenderJs = True
+    Browser = FakeRenderer(config)
+    URL = UrlFactory(config, renderer=Browser)
+    try:
+        urls = URL.build_many(hrefs)
+    finally:
+        URL.close()
+    check1 = [url.file_format for url in urls] == ['html'] * 3
+    check2 = urls[0].file_document.title.string == 'Page'
+    stats = Browser.dump()
+    check3 = stats['rendered'] == 3 and stats['launches'] == 1 and Browser.closed == [0]
+    assert all([check1, check2, check3])
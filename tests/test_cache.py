@@ -0,0 +1,113 @@
+"""
+Tests for DiskCache and ExtractionCache classes
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from entero_document.cache import DiskCache, ExtractionCache, dumps_value, loads_value
+from entero_document.config import ConfigObj, EnteroConfig
+from entero_document.document_factory import DocumentFactory
+from entero_document.utils import get_html_parser
+
+from pathlib import Path
+import datetime
+import pytest
+import shutil
+import time
+
+
+
+def test_disk_cache_lru_eviction(tmp_path):
+    cache = DiskCache(tmp_path / 'cache', max_size_bytes=250)
+    cache.set('key0', bytes(100))
+    cache.set('key1', bytes(100))
+    time.sleep(0.01)
+    cache.get('key0')                       #key0 recently used, key1 is the oldest
+    time.sleep(0.01)
+    cache.set('key2', bytes(100))           #over max size, evicts key1
+    check1 = cache.get('key1') == None
+    check2 = cache.get('key0') == cache.get('key2') == bytes(100)
+    check3 = cache.size() <= 250
+    assert all([check1, check2, check3])
+
+def test_dumps_loads_value():
+    value = {'title': 'Title', 'page_nos': 3, 'file_size_mb': 0.25, 'truncated': False, 'summary': None,
+             'toc': [[1, 'Introduction', 1], (2, 'Section', 12)], 'date': datetime.date(2023, 1, 2),
+             'expires_at': datetime.datetime(2023, 1, 2, 3, 4, 5), 'content': b'%PDF-1.4\n\x00'}
+    check1 = loads_value(dumps_value(value)) == value
+    check2 = type(loads_value(dumps_value(value))['toc'][1]) == tuple
+    check3 = b'\n' not in dumps_value(value)
+    with pytest.raises(TypeError):
+        dumps_value({'filepath': Path('tests')})
+    with pytest.raises(ValueError):
+        loads_value(b'\x80\x04\x95')                        #ie. a pickle
+    assert all([check1, check2, check3])
+
+def test_extraction_cache_hit_for_renamed_copy(tmp_path):
+    test_file = Path('tests/examples/cs_nlp_2301.09640.pdf')
+    renamed_file = tmp_path / 'renamed.pdf'
+    shutil.copy(test_file, renamed_file)
+    original_cache_dir = ConfigObj.cache_dir
+    ConfigObj.cache_dir = tmp_path / 'cache'
+    try:
+        Doc = DocumentFactory()
+        doc1 = Doc.build(test_file)
+        doc2 = Doc.build(renamed_file)
+    finally:
+        ConfigObj.cache_dir = original_cache_dir
+    check1 = doc1.stats.counters['cache_misses'] == 1
+    check2 = doc2.stats.counters['cache_hits'] == 1 and 'body_pymupdf' not in doc2.stats.timings
+    check3 = doc2.record.body == doc1.record.body and doc2.record.title == doc1.record.title
+    check4 = doc2.record.filename_original == 'renamed'
+    assert all([check1, check2, check3, check4])
+
+def test_extraction_cache_key_by_html_parser(tmp_path):
+    config = EnteroConfig(apply_logger=False)
+    config.cache_dir = tmp_path / 'cache'
+    cache = ExtractionCache(config)
+    config.HTML_PARSER = 'html.parser'
+    key1 = cache.make_key(b'<html></html>', '.html')
+    config.HTML_PARSER = 'html5lib'
+    key2 = cache.make_key(b'<html></html>', '.html')
+    config.HTML_PARSER = 'not-a-parser'                  #falls back to 'html.parser'
+    key3 = cache.make_key(b'<html></html>', '.html')
+    check1 = key1 != key2 or get_html_parser('html5lib') == 'html.parser'
+    assert all([check1, key1 == key3])
+
+def test_extraction_cache_hit_keeps_truncation(tmp_path):
+    test_file = Path('tests/examples/example_long.pdf')
+    renamed_file = tmp_path / 'renamed.pdf'
+    shutil.copy(test_file, renamed_file)
+    original_cache_dir, original_max_chars = ConfigObj.cache_dir, ConfigObj.MAX_CONTENT_CHARS
+    ConfigObj.cache_dir = tmp_path / 'cache'
+    ConfigObj.MAX_CONTENT_CHARS = 5000
+    try:
+        Doc = DocumentFactory()
+        doc1 = Doc.build(test_file)
+        doc2 = Doc.build(renamed_file)
+    finally:
+        ConfigObj.cache_dir, ConfigObj.MAX_CONTENT_CHARS = original_cache_dir, original_max_chars
+    check1 = doc1.stats.counters['cache_misses'] == 1 and doc2.stats.counters['cache_hits'] == 1
+    check2 = doc1.record.truncated == doc2.record.truncated == True
+    check3 = doc2.record.truncated_at_page == doc1.record.truncated_at_page == doc1.stats.notes['truncated_at_page']
+    check4 = doc2.stats.counters['truncations'] == 1
+    assert all([check1, check2, check3, check4])
+
+def test_extraction_cache_skips_timed_out_record(tmp_path):
+    test_file = Path('tests/examples/example_long.pdf')
+    original_cache_dir, original_max_time = ConfigObj.cache_dir, ConfigObj.MAX_TIME_SEC
+    ConfigObj.cache_dir = tmp_path / 'cache'
+    ConfigObj.MAX_TIME_SEC = 1e-6
+    try:
+        Doc = DocumentFactory()
+        doc1 = Doc.build(test_file)
+        ConfigObj.MAX_TIME_SEC = original_max_time
+        doc2 = Doc.build(test_file)
+    finally:
+        ConfigObj.cache_dir, ConfigObj.MAX_TIME_SEC = original_cache_dir, original_max_time
+    check1 = doc1.stats.counters['timeouts'] > 0 and not doc1.record.body
+    check2 = doc2.stats.counters['cache_misses'] == 1 and len(doc2.record.body) > 0
+    check3 = 'timeouts' not in doc2.stats.counters
+    assert all([check1, check2, check3])
@@ -0,0 +1,101 @@
+"""
+Tests for Crawler and BloomFilter classes
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from entero_document.crawler import Crawler, BloomFilter
+from entero_document.config import EnteroConfig
+
+from http.server import SimpleHTTPRequestHandler
+import shutil
+import threading
+import urllib.parse
+
+
+def _write_page(path, links):
+    anchors = ''.join([f'<a href="{link}">{link}</a>' for link in links])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text('<html><head><title>Page</title></head><body><p>' + 'text '*50 + f'</p>{anchors}</body></html>')
+
+def _serve_site(tmp_path, local_server):
+    """Serve a small site from `tmp_path`, counting the requests of each path;
+    returns its base url."""
+    _write_page(tmp_path / 'index.html', ['about.html', '/docs/report.pdf', 'a.html', 'a.html#top', '#top',
+                                          'https://www.example.com/external.html', 'mailto:info@example.com',
+                                          'login.html', 'private/secret.html'])
+    _write_page(tmp_path / 'about.html', ['index.html', '/about.html'])
+    _write_page(tmp_path / 'a.html', ['b.html'])
+    _write_page(tmp_path / 'b.html', ['c.html'])
+    _write_page(tmp_path / 'c.html', ['index.html'])
+    _write_page(tmp_path / 'login.html', [])
+    _write_page(tmp_path / 'private' / 'secret.html', [])
+    (tmp_path / 'docs').mkdir()
+    shutil.copy('tests/examples/example.pdf', tmp_path / 'docs' / 'report.pdf')
+    (tmp_path / 'robots.txt').write_text('User-agent: *\nDisallow: /private/\n')
+    lock = threading.Lock()
+    requested = {}
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                requested[self.path] = requested.get(self.path, 0) + 1
+            super().do_GET()
+    return local_server(tmp_path, handler=Handler), requested
+
+
+def test_crawler_depth_scope_robots(tmp_path, local_server):
+    base_url, requested = _serve_site(tmp_path, local_server)
+    config = EnteroConfig(apply_logger=False)
+    config.CRAWL_MAX_DEPTH = 2
+    Crawl = Crawler(config)
+    docs = list(Crawl.crawl([f'{base_url}/index.html']))
+    check1 = sorted(requested) == ['/a.html', '/about.html', '/b.html', '/docs/report.pdf', '/index.html', '/robots.txt']
+    check2 = set(requested.values()) == {1}
+    check3 = len(docs) == 5 and sorted([doc.record.file_extension for doc in docs]) == ['html'] * 4 + ['pdf']
+    stats = Crawl.dump()
+    check4 = stats['fetched'] == 5 and stats['documents'] == 5 and stats['frontier'] == 0
+    check5 = stats['out_of_scope'] == 1 and stats['disallowed'] == 1
+    assert all([check1, check2, check3, check4, check5])
+
+
+def test_crawler_page_budget(tmp_path, local_server):
+    base_url, requested = _serve_site(tmp_path, local_server)
+    config = EnteroConfig(apply_logger=False)
+    config.CRAWL_MAX_DEPTH = 5
+    config.CRAWL_MAX_PAGES = 3
+    config.applyRobotsTxt = False
+    Crawl = Crawler(config)
+    docs = list(Crawl.crawl([f'{base_url}/index.html']))
+    check1 = len(docs) == 3 and Crawl.dump()['fetched'] == 3
+    check2 = '/robots.txt' not in requested and sum(requested.values()) == 3
+    assert all([check1, check2])
+
+
+def test_crawler_scope_per_seed_and_close(tmp_path, local_server):
+    base_url, requested = _serve_site(tmp_path, local_server)
+    port = urllib.parse.urlparse(base_url).port
+    _write_page(tmp_path / 'links.html', [f'http://localhost:{port}/b.html'])
+    config = EnteroConfig(apply_logger=False)
+    config.CRAWL_MAX_DEPTH = 1
+    config.applyRobotsTxt = False
+    Crawl = Crawler(config)
+    #b.html is out of scope for the first seed, which is fetched first, but not for the second
+    docs = list(Crawl.crawl([f'http://127.0.0.1:{port}/links.html', f'http://localhost:{port}/a.html']))
+    hrefs = sorted([doc.record.filepath.url for doc in docs])
+    check1 = hrefs == [f'http://127.0.0.1:{port}/links.html', f'http://localhost:{port}/a.html', f'http://localhost:{port}/b.html']
+    check2 = Crawl.dump()['out_of_scope'] == 1 and requested['/b.html'] == 1
+    check3 = Crawl.URL._session is None                 #the UrlFactory made by the Crawler is closed
+    assert all([check1, check2, check3])
+
+
+def test_bloom_filter():
+    seen = BloomFilter(capacity=1000, error_rate=0.01)
+    hrefs = [f'https://www.example.com/page{idx}.html' for idx in range(1000)]
+    check1 = sum([seen.add(href) for href in hrefs]) == len(seen) > 980                #a few may be false positives already
+    check2 = not any([seen.add(href) for href in hrefs]) and all([href in seen for href in hrefs])
+    false_positives = sum([f'https://www.example.com/other{idx}.html' in seen for idx in range(10000)])
+    check3 = false_positives < 300
+    check4 = len(seen.bits) < 1300                          #9586 bits for 1% error
+    assert all([check1, check2, check3, check4])
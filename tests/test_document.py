@@ -10,8 +10,14 @@ __license__ = "MIT"
 from entero_document.record import DocumentRecord
 from entero_document.document_factory import DocumentFactory
 from entero_document.document import Document
+from entero_document.config import EnteroConfig
+from entero_document.url import UrlFactory
+
+import bs4
+import pypdf
 
 from pathlib import Path
+import io
 import pytest
 
 Doc = DocumentFactory()
@@ -31,7 +37,7 @@ def test_document_populated():
     result = docrec.validate_object_attrs(doc)
     check1 = len(result['target_attrs_to_remove']) == 0
     check2 = not bool(result['target_attrs_to_add'])
-    check3 = doc.get_missing_attributes() == ['id', 'reference_number', 'file_str', 'file_document', 'length_lines', 'readability_score', 'tag_categories', 'summary']
+    check3 = doc.get_missing_attributes() == ['id', 'reference_number', 'file_str', 'file_document', 'length_lines', 'truncated_at_page', 'truncated_at_char', 'readability_score', 'tag_categories', 'summary']
     assert not False in [check1, check2, check3]
 
 def test_document_creation_fail():
@@ -77,4 +83,95 @@ def test_get_record():
     test_file = Path('tests/demo/econ_2301.00410.pdf')
     doc = Doc.build(test_file)
     record = doc.get_record()
-    assert list(record.keys()).__len__() == 24
\ No newline at end of file
+    assert list(record.keys()).__len__() == 27
+
+
+def test_iter_body():
+    test_file = Path('tests/demo/econ_2301.00410.pdf')
+    doc = Doc.build(test_file)
+    pages = list(doc.iter_body())
+    check1 = [page_number for page_number, text in pages] == list(range(1, doc.record.page_nos + 1))
+    check2 = ''.join([text for page_number, text in pages]) == doc.record.body
+    assert all([check1, check2])
+
+def test_document_stats():
+    test_file = Path('tests/demo/econ_2301.00410.pdf')
+    Factory = DocumentFactory()
+    doc = Factory.build(test_file)
+    check1 = {'read', 'fitz_open', 'metadata', 'toc', 'body_pymupdf', 'clean_text'}.issubset(doc.stats.timings)
+    check2 = doc.stats.counters['pages_extracted'] == doc.record.page_nos
+    check3 = doc.stats.counters['bytes_read'] == test_file.stat().st_size
+    registry = Factory.stats.dump()
+    check4 = registry['documents'] == 1 and registry['counters'] == doc.stats.counters
+    assert all([check1, check2, check3, check4])
+
+def test_document_html_without_pdf_rendering():
+    test_file = Path('tests/examples/example.html')
+    doc = Doc.build(test_file)
+    check1 = doc.record.title == 'The Website Title'
+    check2 = 'Learn Python the easy way!' in doc.record.body
+    check3 = 'html_to_pdf' not in doc.stats.timings and 'body_html' in doc.stats.timings
+    assert all([check1, check2, check3])
+
+def test_document_from_url_in_memory():
+    """Extract from content a url already fetched, as if by `get_file_artifact_()`."""
+    URL = UrlFactory(EnteroConfig(apply_logger=False))
+    pdf_file = Path('tests/demo/econ_2301.00410.pdf')
+    pdf_url = URL.build('https://arxiv.org/pdf/econ_2301.00410.pdf')
+    pdf_url.file_str = pdf_file.read_bytes()
+    pdf_url.file_document = pypdf.PdfReader(io.BytesIO(pdf_url.file_str))
+    pdf_url.file_format = 'pdf'
+    html_file = Path('tests/examples/Research Articles in Simplified HTML.html')
+    html_url = URL.build('https://example.org/rash.html')
+    html_url.file_str = html_file.read_text()
+    html_url.file_document = bs4.BeautifulSoup(html_url.file_str, 'html.parser')
+    html_url.file_format = 'html'
+    scripts = len(html_url.file_document.find_all('script'))
+
+    pdf_doc = Doc.build(pdf_url)
+    html_doc = Doc.build(html_url)
+    check1 = pdf_doc.record.body == Doc.build(pdf_file).record.body and 'read' not in pdf_doc.stats.timings
+    check2 = html_doc.record.body == Doc.build(html_file).record.body and 'html_parse' not in html_doc.stats.timings
+    check3 = len(html_url.file_document.find_all('script')) == scripts
+
+    config = EnteroConfig(apply_logger=False)
+    config.applyMetadataOnly = True
+    pdf_doc = DocumentFactory(config).build(pdf_url)
+    check4 = pdf_doc.record.title == 'Designing organizations for bottom-up task allocation: The role of incentives'
+    check5 = pdf_doc.record.page_nos == 38 and 'fitz_open' not in pdf_doc.stats.timings
+    assert all([check1, check2, check3, check4, check5])
+
+def test_document_lazy_extraction():
+    test_file = Path('tests/demo/econ_2301.00410.pdf')
+    config = EnteroConfig(apply_logger=False)
+    config.applyLazyExtraction = True
+    Factory = DocumentFactory(config)
+    doc = Factory.build(test_file)
+    check1 = doc.record.is_loaded() == False and 'body_pymupdf' not in doc.stats.timings
+    check2 = doc.record.title == 'Designing organizations for bottom-up task allocation: The role of incentives'
+    check3 = doc.record.page_nos == 38 and doc.record.is_loaded() == False
+    body = doc.record.body
+    check4 = doc.record.is_loaded() and body == Doc.build(test_file).record.body
+    stats = Factory.stats.dump()
+    check5 = stats['documents'] == 1 and 'body_pymupdf' in stats['stages']        #deferred stages reach the factory
+    record = Factory.build(test_file).record
+    check6 = dict(record)['body'] == body and record.is_loaded()
+    record = Factory.build(test_file).record
+    check7 = [key for key in record] == list(record.keys()) and record.is_loaded() and record['body'] == body
+    assert all([check1, check2, check3, check4, check5, check6, check7])
+
+def test_document_metadata_only():
+    """With `applyMetadataOnly`, pdf and html get page count, size and metadata,
+    no body stage runs, and the other deferred fields stay None."""
+    config = EnteroConfig(apply_logger=False)
+    config.applyMetadataOnly = True
+    Factory = DocumentFactory(config)
+    test_files = sorted([path for path in Path('tests/examples').iterdir() if path.suffix in ['.pdf', '.html']])
+    docs = [Factory.build(test_file) for test_file in test_files]
+    pdf_docs = [doc for doc in docs if doc.record.filetype == '.pdf']
+    check1 = len(docs) == len(test_files) and len(pdf_docs) == 5
+    check2 = all([doc.record.page_nos and doc.record.file_size_mb for doc in pdf_docs])
+    check3 = all([doc.record[attr] == None for doc in docs for attr in Document._deferred_attrs if attr not in ['title', 'author', 'subject', 'keywords', 'date', 'page_nos']])
+    check4 = all(['metadata' in doc.stats.timings and not any([name.startswith('body') for name in doc.stats.timings]) for doc in docs])
+    check5 = Factory.stats.dump()['documents'] == len(test_files)
+    assert all([check1, check2, check3, check4, check5])
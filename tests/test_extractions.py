@@ -9,7 +9,7 @@ __version__ = "0.1.0"
 __license__ = "MIT"
 
 from entero_document.url import UrlFactory, UniformResourceLocator
-from entero_document.extracts_pdf import PdfExtracts
+from entero_document.extracts_pdf import PdfExtracts, PdfContext
 from entero_document.extracts_html import HtmlExtracts
 #from entero_document.office_extracts import OfficeExtracts
 
@@ -17,6 +17,10 @@ from entero_document.record import record_attrs
 from entero_document.config import EnteroConfig
 
 from pathlib import Path
+import functools
+import io
+import multiprocessing
+import time
 
 config = EnteroConfig(apply_logger=False)
 
@@ -41,6 +45,129 @@ def test_local_extract_from_pdf_string():
     assert all(checks) == True
 
 
+def test_extract_from_pdf_string_parses_once():
+    filepath = Path() / 'tests' / 'demo' / 'econ_2301.00410.pdf'
+    pdf_stream = ''
+    with open(filepath, 'rb') as f:
+        pdf_stream = f.read()
+
+    Pdf = PdfExtracts(config)
+    with PdfContext(pdf_stream) as context:
+        result_record = Pdf.extract_from_pdf_string(pdf_stream, context=context)
+    check_title = result_record['title'] == 'Designing organizations for bottom-up task allocation: The role of incentives'
+    check_parse_count = context.parse_count == 1
+    assert all([check_title, check_parse_count]) == True
+
+
+def test_extract_from_pdf_filepath_mmap():
+    filepath = Path() / 'tests' / 'examples' / 'cs_nlp_2301.09640.pdf'
+    pdf_stream = ''
+    with open(filepath, 'rb') as f:
+        pdf_stream = f.read()
+
+    Pdf = PdfExtracts(config)
+    record_from_bytes = Pdf.extract_from_pdf_string(pdf_stream)
+    with PdfContext.from_filepath(filepath) as context:
+        record_from_mmap = Pdf.extract_from_pdf_string(context.pdf_stream, context=context)
+    check_title = record_from_mmap['title'] == record_from_bytes['title']
+    check_body = record_from_mmap['body'] == record_from_bytes['body']
+    assert all([check_title, check_body]) == True
+
+
+def test_pdf_raw_text_parallel_matches_serial():
+    filepath = Path() / 'tests' / 'examples' / 'example_long.pdf'
+    pdf_stream = ''
+    with open(filepath, 'rb') as f:
+        pdf_stream = f.read()
+    parallel_config = EnteroConfig(apply_logger=False)
+    parallel_config.PAGE_WORKERS = 2
+
+    Pdf = PdfExtracts(parallel_config)
+    try:
+        with PdfContext(pdf_stream) as context:
+            page_nos = len(context.fitz_document)
+            serial_text = Pdf.get_pdf_raw_text(context, mode='pymupdf', number_of_pages_to_extract_text=page_nos)
+            parallel_text = Pdf.get_pdf_raw_text(context, mode='pymupdf-parallel', number_of_pages_to_extract_text=page_nos)
+        with PdfContext.from_filepath(filepath) as context:             #next job, on the same workers
+            file_text = Pdf.get_pdf_raw_text(context, mode='pymupdf-parallel', number_of_pages_to_extract_text=page_nos)
+    finally:
+        Pdf.close()
+    check1 = len(serial_text) > 0 and parallel_text == serial_text == file_text
+    check2 = Pdf._page_pool is None
+    assert all([check1, check2])
+
+
+def test_extract_from_pdf_string_content_budget():
+    filepath = Path() / 'tests' / 'examples' / 'example_long.pdf'
+    pdf_stream = ''
+    with open(filepath, 'rb') as f:
+        pdf_stream = f.read()
+    budget_config = EnteroConfig(apply_logger=False)
+    budget_config.MAX_CONTENT_CHARS = 5000
+
+    Pdf = PdfExtracts(budget_config)
+    with PdfContext(pdf_stream) as context:
+        record = Pdf.extract_from_pdf_string(pdf_stream, context=context)
+        page_nos = len(context.fitz_document)
+    truncated_at_page = context.stats.notes['truncated_at_page']
+    check1 = len(record['body']) == 5000
+    check2 = context.stats.counters['truncations'] == 1
+    check3 = context.stats.counters['pages_extracted'] == truncated_at_page < page_nos
+    check3 = check3 and record['truncated'] == True and record['truncated_at_page'] == truncated_at_page and record['truncated_at_char'] == None
+
+    budget_config.MAX_CONTENT_CHARS = None
+    budget_config.MAX_CONTENT_SIZE = 1000
+    with PdfContext(pdf_stream) as context:
+        record = Pdf.extract_from_pdf_string(pdf_stream, context=context)
+    check4 = len(record['body'].encode('utf-8')) <= 1000
+    check5 = context.stats.notes['truncated_at_page'] < truncated_at_page
+
+    budget_config.MAX_CONTENT_SIZE = 1e+8
+    budget_config.MAX_PAGE_EXTRACT = 3
+    with PdfContext(pdf_stream) as context:
+        record = Pdf.extract_from_pdf_string(pdf_stream, context=context)
+    check6 = context.stats.counters['pages_extracted'] == 3
+    check7 = 'truncated_at_page' not in context.stats.notes and record['truncated'] == False
+    assert all([check1, check2, check3, check4, check5, check6, check7]) == True
+
+
+def _slow_title(marker, pdf_io):
+    """Stand-in for `pdftitle`, run in the title worker."""
+    time.sleep(0.5)
+    marker.write_text('finished')
+    return 'Slow Title'
+
+def _title_in_daemon(filepath):
+    Pdf = PdfExtracts(EnteroConfig(apply_logger=False))
+    with PdfContext.from_filepath(filepath) as context:
+        return Pdf.get_pdf_title(context), Pdf._title_pool
+
+def test_get_pdf_title_timeout_stops_pdftitle(tmp_path, monkeypatch):
+    marker = tmp_path / 'finished'
+    monkeypatch.setattr(PdfExtracts, '_get_title', staticmethod(functools.partial(_slow_title, marker)))
+    title_config = EnteroConfig(apply_logger=False)
+    title_config.MAX_TITLE_TIME_SEC = 0.1
+    Pdf = PdfExtracts(title_config)
+    try:
+        with PdfContext.from_filepath(Path('tests/examples/example.pdf')) as context:
+            title = Pdf.get_pdf_title(context)
+        time.sleep(0.8)
+        check1 = title != 'Slow Title' and context.stats.counters['timeouts'] == 1
+        check2 = not marker.exists()                        #the worker stopped the job at the deadline
+        pool = Pdf._title_pool
+        title_config.MAX_TITLE_TIME_SEC = 5
+        with PdfContext.from_filepath(Path('tests/examples/example.pdf')) as context:
+            title = Pdf.get_pdf_title(context)
+        check3 = title == 'Slow Title' and Pdf._title_pool is pool          #the same worker, freed
+    finally:
+        Pdf.close()
+    #a daemonic process cannot start the worker, so (the patched) pdftitle runs in a thread
+    with multiprocessing.get_context('fork').Pool(1) as daemon_pool:
+        title, title_pool = daemon_pool.apply(_title_in_daemon, (Path('tests/examples/example.pdf'),))
+    check4 = title == 'Slow Title' and title_pool == False
+    assert all([check1, check2, check3, check4])
+
+
 def test_web_extract_from_pdf_string():
     """TODO:this test appears to be non-deterministic as it sometimes fails because it is reading a different example file"""
     hrefs = ['https://www.jpmorgan.com/content/dam/jpm/merchant-services/documents/jpmorgan-interchange-guide.pdf'
@@ -80,6 +207,62 @@ def test_local_extract_html():
     assert all(checks) == True
 
 
+def test_local_extract_from_html_string():
+    filepath = Path() / 'tests' / 'examples' / 'Research Articles in Simplified HTML with CSS.html'
+    html_str = ''
+    with open(filepath, 'r') as f:
+        html_str = f.read()
+
+    Html = HtmlExtracts(config)
+    record = Html.extract_from_html_string(html_str)
+    check_title = record['title'] == 'Research Articles in Simplified HTML: a Web-first format for HTML-based scholarly articles'
+    check_author = record['author'].startswith('Silvio Peroni, Francesco Osborne')
+    check_keywords = 'Semantic Publishing' in record['keywords']
+    check_toc = [level for level, title, dest in record['toc']][:5] == [1, 1, 1, 1, 2]
+    level, title, dest = record['toc'][1]
+    check_toc_dest = record['body'][dest:].startswith(title)
+    check_body = 'Evernote Corporation' not in record['body'] and len(record['clean_body']) > 1
+    metadata = Html.extract_metadata_from_html_string(html_str)
+    check_metadata = metadata['title'] == record['title'] and metadata['body'] == None
+    checks = [check_title, check_author, check_keywords, check_toc, check_toc_dest, check_body, check_metadata]
+    assert all(checks) == True
+
+
+def test_local_extract_from_html_stream():
+    filepath = Path() / 'tests' / 'examples' / 'Research Articles in Simplified HTML with CSS.html'
+    Html = HtmlExtracts(config)
+    with open(filepath, 'r') as f:
+        record_from_tree = Html.extract_from_html_string(f)
+    with open(filepath, 'r') as f:
+        record_from_stream = Html.extract_from_html_stream(f)
+    checks = [record_from_stream[key] == record_from_tree[key] for key in ['title', 'author', 'keywords', 'toc', 'body', 'truncated']]
+
+    budget_config = EnteroConfig(apply_logger=False)
+    budget_config.MAX_CONTENT_CHARS = 500
+    with open(filepath, 'r') as f:
+        record_budget = HtmlExtracts(budget_config).extract_from_html_stream(f)
+    checks.append(len(record_budget['body']) == 500 and record_budget['truncated'] == True and record_budget['truncated_at_char'] == 500 and record_budget['truncated_at_page'] == None)
+    with open(filepath, 'r') as f:
+        record_budget_tree = HtmlExtracts(budget_config).extract_from_html_string(f)
+    checks.extend([record_budget_tree[key] == record_budget[key] for key in ['body', 'toc', 'truncated', 'truncated_at_char']])
+
+    class LargeHtml(io.TextIOBase):
+        """About 5MB of html, generated as it is read."""
+        def __init__(self, sections):
+            self.sections = sections
+            self.buffer = '<html><head><title>Large</title></head><body>'
+        def read(self, size=-1):
+            while len(self.buffer) < size and self.sections:
+                self.sections -= 1
+                self.buffer += f'<div><h2>Section {self.sections}</h2><p>text {"lorem ipsum " * 20}</p><script>x=1;</script></div>'
+            result, self.buffer = self.buffer[:size], self.buffer[size:]
+            return result
+    chunks = list(Html.iter_html_text(LargeHtml(sections=20000)))
+    checks.append(len(chunks) > 50 and max([len(chunk) for chunk in chunks]) <= 2 * 2**16)
+    checks.append('Section 0' in chunks[-1] and 'x=1;' not in ''.join(chunks))
+    assert all(checks) == True
+
+
 def test_web_local_extract_html():
     hrefs = ['https://www.jpmorganchase.com/ir/news/2021/chase-helps-more-than-two-million-customers-avoid-overdraft-service-fees',
     ]
@@ -0,0 +1,129 @@
+"""
+Tests for WhoisResolver, RateLimiter and CircuitBreaker classes
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from entero_document.owner import WhoisResolver
+from entero_document.ratelimit import RateLimiter, CircuitBreaker, parse_retry_after
+from entero_document.config import EnteroConfig
+from entero_document.url import UrlFactory
+
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+import threading
+import time
+
+
+owners = {'jpmorgan.com': 'JPMorgan Chase & Co.',
+          'chase.com': 'JPMorgan Chase & Co.',
+          'jpmorganchase.com': 'JPMorgan Chase & Co.',
+          'consumerfinance.gov': 'Consumer Financial Protection Bureau',
+          'wellsfargo.com': 'Wells Fargo & Company'
+          }
+
+def _fake_whois(calls, secs=0.0):
+    lock = threading.Lock()
+    def lookup(domain):
+        with lock:
+            calls[domain] = calls.get(domain, 0) + 1
+        time.sleep(secs)
+        if domain not in owners:
+            raise ConnectionError(domain)
+        return owners[domain]
+    return lookup
+
+
+def test_whois_resolver_cache_and_coalescing(tmp_path):
+    config = EnteroConfig(apply_logger=False)
+    config.cache_dir = tmp_path
+    config.WHOIS_RATE_PER_SEC = 100
+    calls = {}
+    Whois = WhoisResolver(config, lookup=_fake_whois(calls, secs=0.2))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(Whois.get_owner, ['https://www.jpmorgan.com/page'] * 8))
+    check1 = results == ['JPMorgan Chase & Co.'] * 8 and calls == {'jpmorgan.com': 1}
+    stats = Whois.dump()
+    check2 = stats['lookups'] == 1 and stats['coalesced'] + stats['cache_hits'] == 7
+
+    check3 = Whois.get_owner('https://unknown-registrant.com') == '' and calls['unknown-registrant.com'] == 2
+    check4 = Whois.get_owner('https://unknown-registrant.com/other') == '' and calls['unknown-registrant.com'] == 2
+
+    Whois = WhoisResolver(config, lookup=_fake_whois(calls))           #next run, same cache_dir
+    check5 = Whois.get_owner('https://jpmorgan.com') == 'JPMorgan Chase & Co.' and calls['jpmorgan.com'] == 1
+    check6 = Whois.dump()['cache_hits'] == 1
+    assert all([check1, check2, check3, check4, check5, check6])
+
+
+def test_whois_resolver_rate_limit_and_batch():
+    config = EnteroConfig(apply_logger=False)
+    config.WHOIS_RATE_PER_SEC = 5
+    calls = {}
+    Whois = WhoisResolver(config, lookup=_fake_whois(calls))
+    base_url = 'https://www.jpmorgan.com'
+    urls = ['https://www.jpmorgan.com/about', 'https://chase.com', 'https://www.jpmorganchase.com/ir',
+            'https://wellsfargo.com', 'https://www.consumerfinance.gov/credit-cards/', 'https://www.jpmorgan.co.uk'
+            ]
+    time0 = time.perf_counter()
+    results = Whois.has_same_owners(base_url, urls)
+    elapsed = time.perf_counter() - time0
+    check1 = results == [True, True, True, False, False, True]
+    check2 = sorted(calls) == ['chase.com', 'consumerfinance.gov', 'jpmorgan.com', 'jpmorganchase.com', 'wellsfargo.com']
+    stats = Whois.dump()
+    check3 = elapsed > 0.55 and stats['waited_secs'] > 0.5                #4 lookups under 'com' at 5/sec
+    check4 = stats['lookups'] == 5
+    assert all([check1, check2, check3, check4])
+
+
+def test_has_same_url_owner_with_factory_resolver():
+    config = EnteroConfig(apply_logger=False)
+    config.WHOIS_RATE_PER_SEC = 100
+    calls = {}
+    URL = UrlFactory(config)
+    URL._owner_resolver = WhoisResolver(config, lookup=_fake_whois(calls))
+    url = URL.build('https://www.jpmorgan.com/page')
+    check1 = url.has_same_url_owner_('https://www.chase.com') == True
+    check2 = url.has_same_url_owner_('https://www.wellsfargo.com') == False
+    check3 = url.has_same_url_owner_('https://www.jpmorgan.com/other') == True          #same domain, no lookup
+    check4 = calls == {'jpmorgan.com': 1, 'chase.com': 1, 'wellsfargo.com': 1}
+    check5 = URL.owner_resolver.dump()['lookups'] == 3 and URL.dump()['requests'] == 0
+    assert all([check1, check2, check3, check4, check5])
+
+
+def test_rate_limiter_per_key():
+    limiter = RateLimiter(rate=10)
+    time0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(limiter.acquire, ['a', 'a', 'a', 'a', 'b', 'b']))
+    elapsed = time.perf_counter() - time0
+    stats = limiter.dump()
+    check1 = elapsed > 0.28                                             #the 4th 'a' 0.3 secs after the 1st
+    check2 = stats['acquired'] == 6 and stats['waited_secs'] > 0.3           #up to 0.1 + 0.2 + 0.3 for 'a', 0.1 for 'b'
+    assert all([check1, check2])
+
+
+def test_rate_limiter_host_rates_and_circuit_breaker():
+    limiter = RateLimiter(rate=1, rates={'sec.gov': 20})
+    time0 = time.perf_counter()
+    for _ in range(3):
+        limiter.acquire('www.sec.gov')
+    elapsed = time.perf_counter() - time0
+    check1 = elapsed > 0.08 and limiter.dump()['waited_secs'] > 0.08 and limiter.get_rate('example.com') == 1
+    limiter.defer('www.sec.gov', 0.3)
+    check2 = limiter.acquire('www.sec.gov') > 0.25
+
+    breaker = CircuitBreaker(failures=2, reset_secs=0.2)
+    breaker.record('a.com', False)
+    check3 = breaker.allow('a.com')
+    breaker.record('a.com', False)
+    check4 = not breaker.allow('a.com') and breaker.allow('b.com')
+    time.sleep(0.25)
+    check5 = breaker.allow('a.com') and not breaker.allow('a.com')          #one trial after reset_secs
+    breaker.record('a.com', True)
+    check6 = breaker.allow('a.com') and breaker.dump() == {'opened': 1, 'rejected': 2, 'open': []}
+
+    check7 = parse_retry_after('120') == 120.0 and parse_retry_after('soon') is None
+    check8 = 50 < parse_retry_after(formatdate(time.time() + 60, usegmt=True)) <= 60
+    assert all([check1, check2, check3, check4, check5, check6, check7, check8])
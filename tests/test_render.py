@@ -0,0 +1,90 @@
+"""
+Tests for PdfRenderService and ResourceCache classes
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from entero_document.render import PdfRenderService, ResourceCache, _render_job
+from entero_document.config import EnteroConfig
+
+from http.server import SimpleHTTPRequestHandler
+from pathlib import Path
+import time
+import pytest
+
+
+html_str = '''<html><head><title>Render Title</title>
+<link rel="stylesheet" href="style.css"/></head>
+<body><h1>Heading</h1><p>Some text.</p></body></html>'''
+
+
+def test_render_service_pool_and_deadline():
+    config = EnteroConfig(apply_logger=False)
+    config.RENDER_WORKERS = 1
+    Render = PdfRenderService(config)
+    try:
+        meta, pdf_bytes = Render.render(html_str)
+        check1 = pdf_bytes[:5] == b'%PDF-' and meta['title'] == 'Render Title'
+
+        large_html = Path('tests/examples/Research Articles in Simplified HTML.html').read_text()
+        config.MAX_RENDER_TIME_SEC = 0.05
+        with pytest.raises(TimeoutError):
+            Render.render(large_html)
+        config.MAX_RENDER_TIME_SEC = 30
+        meta, pdf_bytes = Render.render(html_str)                #the worker stopped the late job
+        check2 = pdf_bytes[:5] == b'%PDF-'
+        stats = Render.dump()
+        check3 = stats['submitted'] == 3 and stats['completed'] == 2 and stats['timed_out'] == 1
+        check4 = stats['queue_depth'] == 0 and stats['jobs_per_sec'] > 0
+    finally:
+        Render.close()
+    assert all([check1, check2, check3, check4])
+
+
+def test_render_job_skipped_after_deadline():
+    """A job that waited in the queue past its deadline does not start."""
+    with pytest.raises(TimeoutError):
+        _render_job(html_str, None, None, deadline=time.time() - 1)
+    meta, pdf_bytes = _render_job(html_str, None, None, deadline=time.time() + 30)
+    check1 = pdf_bytes[:5] == b'%PDF-' and meta['title'] == 'Render Title'
+    assert all([check1])
+
+
+def test_resource_cache_fetches_once(tmp_path, local_server):
+    (tmp_path / 'site').mkdir()
+    (tmp_path / 'site' / 'style.css').write_text('h1 { color: #ff0000; }')
+    requests_seen = []
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            super().do_GET()
+    base_url = local_server(tmp_path / 'site', handler=Handler) + '/page.html'
+
+    config = EnteroConfig(apply_logger=False)
+    config.cache_dir = tmp_path / 'cache'
+    Render = PdfRenderService(config)
+    try:
+        results = [Render.render(html_str, url_path=base_url) for _ in range(3)]
+        check1 = all([pdf_bytes[:5] == b'%PDF-' for meta, pdf_bytes in results])
+        check2 = requests_seen == ['/style.css']                 #shared by all workers
+        resources = ResourceCache(tmp_path / 'cache' / 'resources')
+        data_uri = resources('style.css', base_url)
+        check3 = data_uri.startswith('data:text/css;base64,') and resources.fetches == 0
+    finally:
+        Render.close()
+    assert all([check1, check2, check3])
+
+
+def test_resource_cache_memory_bound(tmp_path):
+    for idx in range(3):
+        (tmp_path / f'image{idx}.png').write_bytes(bytes(100))
+    resources = ResourceCache(max_memory_bytes=250)
+    data_uris = [resources(f'image{idx}.png', str(tmp_path)) for idx in [0, 1, 0, 2]]
+    check1 = all([data_uri.startswith('data:image/png;base64,') for data_uri in data_uris])
+    check2 = resources.fetches == 3 and resources._memory_bytes <= 250
+    resources('image0.png', str(tmp_path))                      #recently used, kept
+    resources('image1.png', str(tmp_path))                      #evicted, read again
+    check3 = resources.fetches == 4
+    assert all([check1, check2, check3])
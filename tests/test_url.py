@@ -6,7 +6,20 @@ __author__ = "Jason Beach"
 __version__ = "0.1.0"
 __license__ = "MIT"
 
-from entero_document.url import UrlFactory, UniformResourceLocator
+from entero_document.url import UrlFactory, UniformResourceLocator, parse_url, sniff_file_type
+from entero_document.utils import tld_extract
+from entero_document.config import EnteroConfig
+from entero_document.document_factory import DocumentFactory
+
+from http.server import SimpleHTTPRequestHandler, BaseHTTPRequestHandler
+from pathlib import Path
+import bs4
+import mmap
+import os
+import shutil
+import threading
+import time
+import urllib
 
 
 
@@ -125,11 +138,298 @@ def test_has_same_url_owner_():
 
     assert check_owners_1 == check_owners_2
 
+def _html_url(href, html_str):
+    url = UrlFactory(EnteroConfig(apply_logger=False)).build(href)
+    url.file_document = bs4.BeautifulSoup(html_str, 'html.parser')
+    url.file_format = 'html'
+    return url
+
+anchors_html = '''<html><body><a href="about.html#top">About</a><a name="top">Top</a>
+<a href="/about.html">About</a><a href="login.html">Login</a><a href="https://other.com/a.html">Other</a></body></html>'''
+
 def test_get_hrefs_under_criteria_():
-    pass
+    url = _html_url('https://www.example.com/index.html', anchors_html)
+    anchors = url.get_hrefs_under_criteria_()
+    check1 = [anchor.get('href') for anchor in anchors] == ['about.html#top', None, '/about.html', 'login.html', 'https://other.com/a.html']
+    check2 = url.get_canonical_hrefs_() == ['https://www.example.com/about.html', 'https://other.com/a.html']
+    assert all([check1, check2])
 
 def test_get_hrefs_within_hostname_():
-    pass
+    url = _html_url('https://www.example.com/index.html', anchors_html)
+    anchors = url.get_hrefs_within_hostname_(searched_hrefs={'https://www.example.com/login.html'})
+    check1 = [anchor['href'] for anchor in anchors] == ['about.html#top', '/about.html']
+    anchors = url.get_hrefs_within_hostname_(additional_scope=['other.com'])
+    check2 = [anchor['href'] for anchor in anchors][-1] == 'https://other.com/a.html'
+    assert all([check1, check2])
 
 def test_get_visible_text_():
-    pass
\ No newline at end of file
+    pass
+
+
+def test_fetch_many_local_server(tmp_path, local_server):
+    html_str = '<html><head><title>Page</title></head><body><p>' + 'text '*50 + '</p></body></html>'
+    for idx in range(8):
+        (tmp_path / f'page{idx}.html').write_text(html_str)
+    shutil.copy('tests/examples/example.pdf', tmp_path / 'example.pdf')
+    lock = threading.Lock()
+    active, max_active = {}, {}
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            host = self.headers['Host'].split(':')[0]
+            with lock:
+                active[host] = active.get(host, 0) + 1
+                max_active[host] = max(max_active.get(host, 0), active[host])
+            time.sleep(0.2)
+            try:
+                super().do_GET()
+            finally:
+                with lock:
+                    active[host] -= 1
+    port = urllib.parse.urlparse(local_server(tmp_path, handler=Handler)).port
+    hrefs = [f'http://{host}:{port}/page{idx}.html' for host in ['127.0.0.1', 'localhost'] for idx in range(4)]
+    hrefs.extend([f'http://127.0.0.1:{port}/example.pdf', f'http://127.0.0.1:{port}/missing.html'])
+
+    config = EnteroConfig(apply_logger=False)
+    config.URL_FETCH_WORKERS = 4
+    config.URL_HOST_WORKERS = 2
+    URL = UrlFactory(config)
+    time0 = time.perf_counter()
+    urls = URL.build_many(hrefs)
+    elapsed = time.perf_counter() - time0
+    check1 = [url.file_format for url in urls] == ['html'] * 8 + ['pdf', None]
+    check2 = urls[0].file_document.title.string == 'Page' and urls[8].file_str[:5] == b'%PDF-'
+    check3 = sorted(max_active) == ['127.0.0.1', 'localhost'] and max(max_active.values()) <= 2
+    check4 = elapsed >= 0.2 * 3                 #6 requests to 127.0.0.1, at most 2 at a time
+    assert all([check1, check2, check3, check4])
+
+
+def test_url_factory_shared_session(tmp_path, local_server):
+    (tmp_path / 'page.html').write_text('<html><head><title>Page</title></head><body><p>' + 'text '*50 + '</p></body></html>')
+    class Handler(SimpleHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'                           #keep-alive
+    hrefs = [local_server(tmp_path, handler=Handler) + '/page.html'] * 5
+
+    config = EnteroConfig(apply_logger=False)
+    config.URL_HOST_WORKERS = 1
+    URL = UrlFactory(config)
+    try:
+        urls = URL.build_many(hrefs)
+        check1 = [url.file_format for url in urls] == ['html'] * 5
+        stats = URL.dump()
+        check2 = [stats[name] for name in ['requests', 'connections', 'reused', 'retries', 'rejected']] == [5, 1, 4, 0, 0]
+        urls[0].request_artifact_()                             #same session as the batch
+        URL.close()
+        stats = URL.dump()
+        check3 = [stats[name] for name in ['requests', 'connections', 'reused', 'retries', 'rejected']] == [6, 1, 5, 0, 0]
+        URL.build_many(hrefs[:2])
+        check4 = URL.dump()['connections'] == 2
+    finally:
+        URL.close()
+    assert all([check1, check2, check3, check4])
+
+
+def test_response_cache_revalidation(tmp_path, local_server):
+    html_str = '<html><head><title>Page</title></head><body><p>' + 'text '*50 + '</p></body></html>'
+    pdf_bytes = Path('tests/examples/example.pdf').read_bytes()
+    pages = {'/etag.html': (html_str, {'ETag': '"v1"', 'Cache-Control': 'no-cache'}),
+             '/fresh.html': (html_str, {'Cache-Control': 'max-age=60'}),
+             '/nostore.html': (html_str, {'ETag': '"v1"', 'Cache-Control': 'no-store'}),
+             '/example.pdf': (pdf_bytes, {'Last-Modified': 'Mon, 02 Jan 2023 00:00:00 GMT'})
+             }
+    seen, bytes_sent = [], []
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body, headers = pages[self.path]
+            body = body.encode() if type(body) == str else body
+            seen.append(self.path)
+            validators = [(self.headers.get('If-None-Match'), headers.get('ETag')), (self.headers.get('If-Modified-Since'), headers.get('Last-Modified'))]
+            if any([sent and sent == current for sent, current in validators]):
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/pdf' if self.path.endswith('.pdf') else 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            bytes_sent.append(len(body))
+    base_url = local_server(handler=Handler)
+    hrefs = [base_url + path for path in pages]
+
+    config = EnteroConfig(apply_logger=False)
+    config.cache_dir = tmp_path / 'cache'
+    URL = UrlFactory(config)
+    try:
+        first = URL.build_many(hrefs)
+        bytes_first = sum(bytes_sent)
+        second = URL.build_many(hrefs)
+        bytes_second = sum(bytes_sent) - bytes_first
+    finally:
+        URL.close()
+    check1 = [url.file_format for url in second] == ['html', 'html', 'html', 'pdf']
+    check2 = [url.file_str for url in second] == [url.file_str for url in first]
+    check3 = sorted(seen) == sorted(['/etag.html', '/fresh.html', '/nostore.html', '/example.pdf',
+                                     '/etag.html', '/nostore.html', '/example.pdf'])
+    check4 = bytes_second == len(html_str)                     #only the no-store page
+    check5 = URL.response_cache.dump() == {'hits': 1, 'revalidated': 2, 'misses': 5,
+                                           'bytes_saved': 2 * len(html_str) + len(pdf_bytes)}
+    assert all([check1, check2, check3, check4, check5])
+
+
+def test_download_size_cap_and_spool(tmp_path, capsys, local_server):
+    pdf_bytes = Path('tests/examples/cs_nlp_2301.09640.pdf').read_bytes()
+    shutil.copy('tests/examples/cs_nlp_2301.09640.pdf', tmp_path / 'paper.pdf')
+    shutil.copy('tests/examples/example.pdf', tmp_path / 'small.pdf')
+    (tmp_path / 'large.pdf').write_bytes(b'%PDF-' + b'0' * 500000)
+    (tmp_path / 'page.bin').write_text('<html><head><title>Page</title></head><body><p>' + 'text '*40000 + '</p></body></html>')
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/unsized.pdf':                     #no content-length, body ends when closed
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/pdf')
+                self.end_headers()
+                for _ in range(50):
+                    self.wfile.write(b'0' * 10000)
+                return
+            super().do_GET()
+    base_url = local_server(tmp_path, handler=Handler)
+    names = ['paper.pdf', 'small.pdf', 'large.pdf', 'unsized.pdf', 'page.bin']
+    hrefs = [f'{base_url}/{name}' for name in names]
+
+    config = EnteroConfig(apply_logger=False)
+    config.MAX_DOWNLOAD_SIZE = 400000
+    config.DOWNLOAD_SPOOL_SIZE = 100000
+    URL = UrlFactory(config)
+    try:
+        paper, small, large, unsized, page = URL.build_many(hrefs)
+        capsys.readouterr()
+        URL.build('http:///missing-host.pdf').get_file_artifact_()
+        invalid_log = capsys.readouterr().out
+        check1 = [url.file_format for url in [paper, small, large, unsized, page]] == ['pdf', 'pdf', None, None, 'html']
+        check1 = check1 and page.file_path is None and 'too large' not in invalid_log and 'InvalidURL' in invalid_log
+        check2 = isinstance(paper.file_str, mmap.mmap) and paper.file_str[:] == pdf_bytes
+        check3 = paper.file_size_bytes == len(pdf_bytes) and paper.file_size_mb == round(len(pdf_bytes) * 1e-6, 3)
+        check4 = type(small.file_str) == bytes and small.file_path is None and small.file_size_bytes == 1984
+        doc = DocumentFactory(config).build(paper)
+        check5 = doc.record.title == 'Weakly-Supervised Questions for Zero-Shot Relation Extraction'
+        spool_path = paper.file_path
+        doc.close()
+        check6 = os.path.exists(spool_path) == False and doc.record.title.startswith('Weakly-Supervised')
+        again_path = URL.build_many([hrefs[0]])[0].file_path
+    finally:
+        URL.close()
+    check7 = again_path and os.path.exists(again_path) == False                #released with the factory
+    assert all([check1, check2, check3, check4, check5, check6, check7])
+
+
+def test_retries_and_circuit_breaker(tmp_path, local_server):
+    html_str = '<html><head><title>Page</title></head><body><p>' + 'text '*50 + '</p></body></html>'
+    (tmp_path / 'flaky.html').write_text(html_str)
+    lock = threading.Lock()
+    requested = {}
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            key = self.headers['Host'].split(':')[0] + self.path
+            with lock:
+                requested[key] = requested.get(key, 0) + 1
+                count = requested[key]
+            if self.path == '/flaky.html' and count == 1:
+                self.send_response(503)
+                self.send_header('Retry-After', '1')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            elif self.path == '/down.html':
+                self.send_error(500)
+            else:
+                super().do_GET()
+    port = urllib.parse.urlparse(local_server(tmp_path, handler=Handler)).port
+
+    config = EnteroConfig(apply_logger=False)
+    config.URL_RETRY_ATTEMPTS = 3
+    config.URL_BACKOFF_SEC = 0.05
+    config.URL_BREAKER_FAILURES = 2
+    URL = UrlFactory(config)
+    try:
+        time0 = time.perf_counter()
+        flaky = URL.build(f'http://127.0.0.1:{port}/flaky.html')
+        flaky.get_file_artifact_()
+        elapsed = time.perf_counter() - time0
+        throttled_secs = URL.dump()['throttled_secs']
+        downs = [URL.build(f'http://localhost:{port}/down.html') for _ in range(3)]
+        for url in downs:
+            url.get_file_artifact_()
+    finally:
+        URL.close()
+    check1 = flaky.file_format == 'html' and requested[f'127.0.0.1/flaky.html'] == 2
+    check2 = [url.file_format for url in downs] == [None] * 3 and requested['localhost/down.html'] == 6
+    stats = URL.dump()
+    check3 = stats['retries'] == 5 and stats['rejected'] == 1 and URL.breaker.dump()['open'] == ['localhost']
+    check4 = elapsed > 0.9 and throttled_secs > 0.9                         #waited for the Retry-After
+    assert all([check1, check2, check3, check4])
+
+
+def test_sniff_before_download(tmp_path, local_server):
+    html_str = '<html><head><title>Page</title></head><body><p>' + 'text '*50 + '</p></body></html>'
+    (tmp_path / 'page.html').write_text(html_str)
+    shutil.copy('tests/examples/example.pdf', tmp_path / 'report.html')        #pdf served as text/html
+    (tmp_path / 'photo.pdf').write_bytes(b'\x89PNG\r\n\x1a\n' + b'\x00' * 50000)
+    (tmp_path / 'data.zip').write_bytes(b'PK\x03\x04' + os.urandom(1000000))
+    base_url = local_server(tmp_path)
+    hrefs = [f'{base_url}/{name}' for name in ['page.html', 'report.html', 'photo.pdf', 'data.zip']]
+
+    config = EnteroConfig(apply_logger=False)
+    URL = UrlFactory(config)
+    try:
+        urls = URL.build_many(hrefs)
+    finally:
+        URL.close()
+    check1 = [url.file_format for url in urls] == ['html', 'pdf', None, None]
+    check2 = [url.sniffed_type for url in urls] == ['html', 'pdf', 'image', 'archive']
+    check3 = urls[1].url_type == 'html' and urls[1].file_str[:5] == b'%PDF-' and urls[3].file_size_bytes == 0
+    stats = URL.sniff_stats.dump()
+    check4 = stats['sniffed'] == 4 and stats['skipped'] == 2 and stats['reasons'] == {'unsupported': 2}
+    check5 = stats['bytes_saved'] == (50008 - 4096) + (1000004 - 4096)
+    check6 = sniff_file_type(b'  <!DOCTYPE html><html>') == 'html' and sniff_file_type(b'{"a": 1}') == 'data' \
+             and sniff_file_type(b'', 'application/pdf') == 'pdf' and sniff_file_type(b'abc') is None
+    check7 = [url.get_filename() for url in urls[:2]] == ['page.html', 'report.pdf']                  #named by the sniffed type
+    check8 = [url.get_file_extension() for url in urls[:2]] == ['html', 'pdf']
+    check9 = sniff_file_type(b'<!DOCTYPE html><html><head><title>What is %PDF-1.7?</title>', 'text/html') == 'html' \
+             and sniff_file_type(b'<div>What is %PDF-1.7?</div>', 'text/html') == 'html' \
+             and sniff_file_type(b'junk\r\n%PDF-1.4\n', 'application/octet-stream') == 'pdf'
+    assert all([check1, check2, check3, check4, check5, check6, check7, check8, check9])
+
+
+def _check_suffix_and_url_type(url):
+    """Suffix and url_type as `UniformResourceLocator.check_suffix_and_url_type()` 
+    gave them before `parse_url()`."""
+    psl = tld_extract(url).suffix
+    endpt = url.split('.')[-1]
+    suffix = psl if (psl in endpt) else endpt
+    if not psl:
+        suffix = Path(urllib.parse.urlparse(url).path).suffix[1:]
+    possible_suffixes = [value for values in UniformResourceLocator._possible_suffixes.values() for value in values]
+    if not any([value in suffix for value in possible_suffixes]):
+        return '', ''
+    return suffix, [k for k, v in UniformResourceLocator._possible_suffixes.items() if suffix in v][0]
+
+def test_parse_many_components():
+    hrefs = Path('tests/data/jpmorgan_hrefs.txt').read_text().split()
+    URL = UrlFactory()
+    parse_url.cache_clear()
+    components = URL.parse_many(hrefs)
+    check1 = URL.parse_many(hrefs) == components and parse_url.cache_info().hits >= len(hrefs)
+
+    expected = []
+    for href in hrefs:
+        url = href.lower()
+        parts = tld_extract(url)
+        expected.append((urllib.parse.urlparse(url).scheme + '://', urllib.parse.urlparse(url).hostname,
+                         parts.domain, parts.subdomain) + _check_suffix_and_url_type(url))
+    check2 = [(c.scheme, c.hostname, c.domain, c.subdomain, c.suffix, c.url_type) for c in components] == expected
+    check3 = components[0] == ('https://www.vercounty.org/wp-content/uploads/2022/05/jp-morgan-chase-bank-card-aggreement.pdf',
+                               'https://', 'www.vercounty.org', 'www', 'vercounty', 'vercounty.org', 'pdf', 'pdf',
+                               '/wp-content/uploads/2022/05/jp-morgan-chase-bank-card-aggreement.pdf', True)
+    check4 = [(c.registered_domain, c.url_type) for c in components[2:4]] == [('jpmorganchase.com', 'html'), ('chase.com', 'html')]
+    assert all([check1, check2, check3, check4])
@@ -0,0 +1,97 @@
+"""
+Tests for shared utilities
+"""
+
+__author__ = "Jason Beach"
+__version__ = "0.1.0"
+__license__ = "MIT"
+
+from entero_document.utils import timeout, check_timeout, remaining_time, run_with_timeout
+from entero_document.utils import get_html_parser, get_visible_text, iter_within_budget
+
+import bs4
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import time
+import pytest
+
+
+
+def _count_until_timeout(seconds):
+    count = 0
+    with timeout(seconds=seconds):
+        while True:
+            try:
+                check_timeout()
+            except TimeoutError:
+                return count
+            count += 1
+            time.sleep(0.01)
+
+def test_timeout_in_worker_threads():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        counts = list(executor.map(_count_until_timeout, [0.1, 0.2]))
+    assert all([count > 0 for count in counts])
+
+def test_timeout_nested_cannot_extend():
+    with timeout(seconds=0.1):
+        with timeout(seconds=10):
+            check1 = remaining_time() <= 0.1
+            time.sleep(0.15)
+            with pytest.raises(TimeoutError):
+                check_timeout()
+    check2 = remaining_time() == None
+    assert all([check1, check2])
+
+def test_run_with_timeout_thread():
+    check1 = run_with_timeout(sum, [1, 2, 3], seconds=1) == 6
+    time0 = time.time()
+    with pytest.raises(TimeoutError):
+        run_with_timeout(time.sleep, 5, seconds=0.1)
+    check2 = time.time() - time0 < 1
+    assert all([check1, check2])
+
+def test_run_with_timeout_process():
+    check1 = run_with_timeout(sum, [1, 2, 3], seconds=5, use_process=True) == 6
+    time0 = time.time()
+    with pytest.raises(TimeoutError):
+        run_with_timeout(time.sleep, 5, seconds=0.1, use_process=True)
+    check2 = time.time() - time0 < 1
+    assert all([check1, check2])
+
+
+def test_iter_within_budget():
+    read = []
+    def pages():
+        for page_number in range(1, 11):
+            read.append(page_number)
+            yield page_number, 'é' * 100
+    check1 = [(key, len(text), truncated) for key, text, truncated in iter_within_budget(pages(), max_chars=250)] == \
+             [(1, 100, False), (2, 100, False), (3, 50, True)]
+    check2 = read == [1, 2, 3]                                          #stops reading at the budget
+    results = list(iter_within_budget(pages(), max_bytes=301))           #2 bytes a char
+    check3 = [len(text) for key, text, truncated in results] == [100, 50] and results[-1][2]
+    check4 = len(list(iter_within_budget(pages()))) == 10
+    assert all([check1, check2, check3, check4])
+
+
+def _legacy_visible_text(soup):
+    def tag_visible(element):
+        if element.parent.name in ['style', 'script', 'head', 'title', 'meta', '[document]']:
+            return False
+        if isinstance(element, bs4.element.Comment):
+            return False
+        return True
+    return ' '.join(t.strip() for t in filter(tag_visible, soup.find_all(string=True)) if t.strip())
+
+def test_html_parser_backends_visible_text():
+    check1 = get_html_parser('not-a-parser') == 'html.parser'
+    parsers = [name for name in ['html.parser', 'lxml', 'html5lib'] if get_html_parser(name) == name]
+    checks = [check1]
+    for filepath in sorted((Path() / 'tests' / 'examples').glob('*.html')):
+        html_str = filepath.read_text()
+        for parser in parsers:
+            soup = bs4.BeautifulSoup(html_str, parser)
+            checks.append(get_visible_text(soup) == _legacy_visible_text(soup) and len(get_visible_text(soup)) > 0)
+    assert all(checks)